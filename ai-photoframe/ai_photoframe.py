@@ -4,42 +4,137 @@ AI Photo Frame - メインプログラム
 画像生成とe-paper表示を統合
 """
 
-from PIL import Image
-from inky.inky_uc8159 import Inky
+import time
+
+# インタープリター起動後、importより前の時刻を計測の起点にする
+_STARTED_AT = time.perf_counter()
+
 import os
 import sys
-from image_generator import ImageGenerator
-import time
 from datetime import datetime
-import glob
 import json
 import random
 import signal
+import threading
+from generation_profiles import ProfileSelector
+from thermal_pacer import create_pacer
+from image_store import ImageStore
+from output_writer import extension_for, remove_derived
+from telemetry import TRACER
+from startup_profile import StartupTimer, run_startup_benchmark
+
+# torch・diffusers・inky・numpy は使うコマンドでのみ読み込む（list等を軽くするため）
+STARTUP = StartupTimer(_STARTED_AT)
+STARTUP.mark("import")
 
 class AIPhotoFrame:
-    def __init__(self):
-        """AI Photo Frameの初期化"""
+    def __init__(self, config=None, output_dir=None):
+        """
+        AI Photo Frameの初期化
+
+        Args:
+            config (dict): 設定（Noneの場合は config.json を読み込み）
+            output_dir (str): 生成画像の保存先（Noneの場合は標準の保存先）
+        """
         # 設定ファイル読み込み
-        self.config = self._load_config()
+        self.config = config if config is not None else self._load_config()
 
-        # E-paper ディスプレイの設定
-        resolution = tuple(self.config['display']['resolution'])
-        self.inky_display = Inky(resolution=resolution, cs_pin=8, dc_pin=25, reset_pin=17, busy_pin=24)
-        self.inky_display.set_border(self.inky_display.BLACK)
+        # ディスプレイドライバー・減色処理・画像生成器は初回使用時に初期化
+        self._display = None
+        self._renderer = None
+        self._generator = None
+        self._lazy_lock = threading.Lock()
 
-        # 画像生成器の初期化
-        self.generator = ImageGenerator()
+        # 連続実行時の生成プロファイル選択（ローテーション・時間帯別）
+        self.profile_selector = ProfileSelector(self.config['continuous_mode'].get('profile_schedule', {}))
+        # 連続実行のペース配分（温度・スロットリング・負荷からスレッド数・間隔・プロファイルを調整）
+        self.pacer = create_pacer(self.config['continuous_mode'].get('pacing', {}))
 
         # 出力ディレクトリ
-        self.output_dir = "/home/pi/AIPhotoFrame/ai-photoframe/generated_images"
+        self.output_dir = output_dir or "/home/pi/AIPhotoFrame/ai-photoframe/generated_images"
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
+        # 生成画像のインデックスと保持ポリシー（枚数・合計サイズ・日数）
+        image_config = self.config.get('image', {})
+        max_total_mb = image_config.get('max_total_mb')
+        self.image_store = ImageStore(
+            self.output_dir,
+            max_count=image_config.get('max_stored', 10),
+            max_bytes=max_total_mb * 1024 * 1024 if max_total_mb else None,
+            max_age_days=image_config.get('max_age_days'),
+        )
+        # シードを指定した生成は、同じ条件の画像がストアにあれば再利用する
+        self.reuse_cached = image_config.get('reuse_cached', True)
+        # 生成画像の形式（拡張子で書き出しの形式が決まる）
+        self.image_extension = extension_for(image_config.get('format', 'png'))
+
+        # ステージごとの計測結果の書き出し先（JSON Lines / Prometheus テキスト形式）
+        telemetry_config = self.config.get('telemetry', {})
+        TRACER.configure(
+            jsonl_path=self._local_path(telemetry_config.get('jsonl_path')),
+            jsonl_max_mb=telemetry_config.get('jsonl_max_mb', 10),
+            prometheus_path=self._local_path(telemetry_config.get('prometheus_path')),
+            prometheus_port=telemetry_config.get('prometheus_port'),
+        )
+
         # 起動時に古い画像を削除
         self._cleanup_old_images()
 
         # 永続実行用フラグ
         self.running = False
+        # 連続実行（シリアルモード）の停止要求。生成はステップ境界で中断する
+        self.stop_event = threading.Event()
+
+    @property
+    def display(self):
+        """ディスプレイドライバー（Inky実機 / ファイル出力 / メモリ保持）"""
+        with self._lazy_lock:
+            if self._display is None:
+                self._display = STARTUP.measure("init:display", self._create_display)
+            return self._display
+
+    def _create_display(self):
+        from display_drivers import create_display
+
+        display_config = self.config['display']
+        return create_display(dict(
+            display_config,
+            sink_directory=self._local_path(display_config.get('sink_directory', 'generated_images/display')),
+        ))
+
+    @property
+    def renderer(self):
+        """減色・ディザリング（パック済みフレームバッファを生成）"""
+        with self._lazy_lock:
+            if self._renderer is None:
+                self._renderer = STARTUP.measure("init:renderer", self._create_renderer)
+            return self._renderer
+
+    def _create_renderer(self):
+        from epaper_render import EpaperRenderer
+
+        display_config = self.config['display']
+        return EpaperRenderer(
+            tuple(display_config['resolution']),
+            saturation=display_config.get('saturation', 0.5),
+            dither=display_config.get('dither', 'floyd-steinberg'),
+            h_flip=display_config.get('h_flip', False),
+            v_flip=display_config.get('v_flip', False),
+        )
+
+    @property
+    def generator(self):
+        """画像生成器（torch・diffusersを読み込む）"""
+        with self._lazy_lock:
+            if self._generator is None:
+                self._generator = STARTUP.measure("init:generator", self._create_generator)
+            return self._generator
+
+    def _create_generator(self):
+        from image_generator import ImageGenerator
+
+        return ImageGenerator(self.config)
     
     def display_image(self, image_path):
         """
@@ -53,6 +148,11 @@ class AIPhotoFrame:
         """
         try:
             print(f"画像を表示中: {image_path}")
+
+            # 生成直後の画像は書き出しスレッドが書き終えるまで待つ
+            if not self.wait_for_output(image_path):
+                print(f"❌ 画像の書き出しに失敗しました: {image_path}")
+                return False
             
             # ファイル存在チェック
             if not os.path.exists(image_path):
@@ -61,18 +161,22 @@ class AIPhotoFrame:
             
             print(f"ファイルサイズ: {os.path.getsize(image_path)} bytes")
             
-            # 画像を開いて640x400にリサイズ
-            img = Image.open(image_path)
-            print(f"元の画像サイズ: {img.size}")
-            img = img.resize((640, 400))
-            print("画像リサイズ完了: 640x400")
+            trace_mark = TRACER.mark()
+
+            # 表示済み・生成時に保存済みのフレームバッファがあればそのまま使い、
+            # なければパネル解像度にリサイズして7色パレットに減色
+            render_start = time.time()
+            framebuffer, cached = self.renderer.load_or_render(image_path)
+            source = "キャッシュ" if cached else self.renderer.dither
+            print(f"フレームバッファ準備完了: {self.renderer.resolution[0]}x{self.renderer.resolution[1]} "
+                  f"({source}, {(time.time() - render_start) * 1000:.0f}ms)")
             
             # e-paperに表示
             print("e-paperディスプレイに送信中...")
-            self.inky_display.set_image(img)
-            self.inky_display.show()
+            self.display.show(framebuffer)
             
             print("✅ 画像表示完了")
+            TRACER.report(trace_mark)
             return True
             
         except Exception as e:
@@ -81,13 +185,19 @@ class AIPhotoFrame:
             traceback.print_exc()
             return False
     
-    def generate_and_display(self, prompt, display_immediately=True):
+    def generate_and_display(self, prompt, display_immediately=True, cancel_event=None, profile=None, callback=None,
+                             seed=None, resume=None):
         """
         画像を生成してe-paperに表示
         
         Args:
             prompt (str): 生成する画像の説明
             display_immediately (bool): 生成後すぐに表示するか
+            cancel_event (threading.Event): セットされると生成をステップ境界で中断
+            profile (str): 生成プロファイル名（Noneの場合は生成器のデフォルト）
+            callback (callable): ステップごとに (step, total_steps) で呼ばれる進行状況通知
+            seed (int): 乱数シード（指定すると同じ条件で生成済みの画像があればそれを使う。Noneの場合はランダム）
+            resume (dict): 続きから生成するチェックポイント（シード・保存先もチェックポイントのものを使う）
             
         Returns:
             str|None: 成功時は生成された画像のパス、失敗時はNone
@@ -95,11 +205,24 @@ class AIPhotoFrame:
         print("=== AI Photo Frame - 画像生成と表示 ===")
         print(f"プロンプト: {prompt}")
         print()
+
+        # シードを指定した場合は、同じ条件で生成済みの画像があれば生成せずに使う
+        if seed is not None and resume is None and self.reuse_cached:
+            cached_file = self.image_store.find(self.generator.result_key(prompt, seed, profile))
+            if cached_file:
+                print(f"♻️ 同じ条件で生成済みの画像を使います: {cached_file}")
+                if display_immediately:
+                    print("\n📺 e-paperディスプレイに表示...")
+                    self.display_image(cached_file)
+                return cached_file
         
         # 出力ファイル名を生成（日時付き）
         now = datetime.now()
         timestamp_str = now.strftime("%Y%m%d_%H%M%S")
-        output_file = os.path.join(self.output_dir, f"ai_photo_{timestamp_str}.png")
+        output_file = os.path.join(self.output_dir, f"ai_photo_{timestamp_str}{self.image_extension}")
+        if resume is not None:
+            seed = resume["job"]["seed"]
+            output_file = resume["job"]["output_path"]
         
         # 進行状況コールバック関数を定義
         def progress_callback(step, total_steps):
@@ -109,15 +232,25 @@ class AIPhotoFrame:
                 estimated_total = elapsed / progress * 100
                 remaining = max(0, estimated_total - elapsed)
                 print(f"📊 Step {step + 1:2d}/{total_steps} ({progress:5.1f}%) | 経過: {elapsed:.0f}秒 | 残り: 約{remaining:.0f}秒")
+            if callback:
+                callback(step, total_steps)
 
         # 画像生成
         print("🎨 画像生成を開始...")
+        trace_mark = TRACER.mark()
         start_time = time.time()
-        success = self.generator.generate_image(prompt, output_file, callback=progress_callback)
+        # 書き出し（エンコード・fsync）とインデックスへの登録は書き出しスレッドで行い、次の生成を待たせない
+        success = self.generator.generate_image(
+            prompt, output_file, callback=progress_callback, cancel_event=cancel_event, seed=seed, profile=profile,
+            job={"display": display_immediately}, resume=resume,
+            wait_for_write=False, on_written=self._register_output,
+        )
         
         if not success:
             print("❌ 画像生成に失敗しました")
             return None
+
+        TRACER.report(trace_mark)
         
         if display_immediately:
             print("\n📺 e-paperディスプレイに表示...")
@@ -130,6 +263,233 @@ class AIPhotoFrame:
         
         return output_file
     
+    def generate_batch(self, prompts, seeds=None, profile=None, cancel_event=None, callback=None):
+        """
+        複数の画像をまとめて生成して1枚ずつ保存・登録（表示はしない）
+
+        Args:
+            prompts (list): 1枚ごとのプロンプト
+            seeds (list): 1枚ごとの乱数シード（Noneの要素はランダム。指定した画像は生成済みなら再利用）
+            profile (str): 生成プロファイル名（Noneの場合は生成器のデフォルト）
+            cancel_event (threading.Event): セットされると生成をステップ境界で中断
+            callback (callable): ステップごとに (step, total_steps) で呼ばれる進行状況通知
+
+        Returns:
+            list: 1枚ごとの画像のパス（prompts と同じ順。失敗した画像はNone）
+        """
+        print(f"=== AI Photo Frame - バッチ画像生成 ({len(prompts)}枚) ===")
+        seeds = list(seeds or [None] * len(prompts))
+        result_paths = [None] * len(prompts)
+
+        # シードを指定した画像は、同じ条件で生成済みならバッチから外す
+        pending = []
+        for i, (prompt, seed) in enumerate(zip(prompts, seeds)):
+            if seed is not None and self.reuse_cached:
+                result_paths[i] = self.image_store.find(self.generator.result_key(prompt, seed, profile))
+                if result_paths[i]:
+                    print(f"♻️ 同じ条件で生成済みの画像を使います: {result_paths[i]}")
+                    continue
+            pending.append(i)
+        if not pending:
+            return result_paths
+
+        # 同じ秒に続けてバッチ生成しても上書きしないよう、既存のファイル名は飛ばして連番を振る
+        timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_files = []
+        number = 0
+        while len(output_files) < len(pending):
+            number += 1
+            output_file = os.path.join(self.output_dir, f"ai_photo_{timestamp_str}_{number}{self.image_extension}")
+            if not os.path.exists(output_file):
+                output_files.append(output_file)
+
+        trace_mark = TRACER.mark()
+        results = self.generator.generate_batch(
+            [prompts[i] for i in pending], output_files, seeds=[seeds[i] for i in pending],
+            profile=profile, callback=callback, cancel_event=cancel_event,
+            wait_for_write=False, on_written=self._register_output,
+        )
+        for i, output_file, result in zip(pending, output_files, results):
+            if result is not None:
+                result_paths[i] = output_file
+        TRACER.report(trace_mark)
+        return result_paths
+
+    def _register_output(self, output_file, image, generation):
+        """書き出し完了後の処理（書き出しスレッドで呼ばれる）: フレームバッファの保存とインデックスへの登録"""
+        # 表示時に減色をやり直さないよう、メモリ上の画像からフレームバッファを画像の隣に保存
+        try:
+            self.renderer.write_sidecar(output_file, image)
+        except Exception as e:
+            print(f"⚠️ フレームバッファ保存エラー: {e}")
+        self.image_store.add(output_file, **generation)
+
+    def wait_for_output(self, image_path):
+        """
+        生成した画像の書き出し完了を待つ
+
+        Returns:
+            bool: 書き出し済み（または書き出し中でない）場合True
+        """
+        # 生成器を使っていなければ書き出し中の画像はない（displayコマンドで torch を読み込まない）
+        if self._generator is None:
+            return True
+        return self._generator.output_writer.wait(image_path)
+
+    def batch_capacity(self):
+        """
+        連続実行で1サイクルにまとめて生成する最大枚数
+
+        Returns:
+            int: generator.batch.max_size（1でバッチ生成しない）
+        """
+        return max(1, self.config.get('generator', {}).get('batch', {}).get('max_size', 4))
+
+    def run_pool(self, count=None):
+        """
+        生成ワーカープールで連続実行のプロンプトから生成し続ける（生成サーバー向け、表示はしない）
+
+        Args:
+            count (int): 生成する枚数（Noneの場合は停止要求まで）
+        """
+        from worker_pool import GenerationWorkerPool
+
+        pool_config = self.config.get('worker_pool', {})
+        prompts = self.config['continuous_mode']['prompts']
+        pool = GenerationWorkerPool(
+            self.config, pool_config.get('workers', 2), pool_config.get('threads_per_worker'), prompts,
+        )
+
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+        print(f"=== AI Photo Frame - 生成ワーカープール ({len(pool.layout)}ワーカー) ===")
+        if not pool.start():
+            return
+
+        # 空いたワーカーがすぐ次を取り出せるよう、ワーカー数の2倍のジョブをキューに入れておく
+        timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+        submitted, outstanding, completed = 0, 0, 0
+        start_time = time.time()
+        try:
+            while not self.stop_event.is_set():
+                while outstanding < 2 * len(pool.layout) and (count is None or submitted < count):
+                    output_file = os.path.join(self.output_dir, f"ai_photo_{timestamp_str}_{submitted + 1}{self.image_extension}")
+                    pool.submit(random.choice(prompts), output_file, seed=self.rotation_seed(),
+                                profile=self.profile_selector.next_profile())
+                    submitted += 1
+                    outstanding += 1
+                if outstanding == 0:
+                    break
+
+                event = pool.result(timeout=1)
+                if event is None:
+                    if not pool.alive():
+                        print("❌ ワーカーがすべて終了しました")
+                        break
+                    continue
+                outstanding -= 1
+                if event["event"] != "done":
+                    print(f"⚠️ ワーカー{event['worker']}で画像生成に失敗しました")
+                    continue
+
+                completed += 1
+                self._register_pool_result(event)
+                per_hour = completed / (time.time() - start_time) * 3600
+                print(f"✅ ワーカー{event['worker']}: {event['output_path']} ({event['duration']:.0f}秒) | "
+                      f"{completed}枚完了, {per_hour:.1f}枚/時")
+        finally:
+            print("🛑 ワーカーを停止中（未着手のジョブは取り消し、生成中の画像は完了させます）...")
+            # 停止を待つ間に完了した画像も登録し、保持数の管理から外れたファイルを残さない
+            for event in pool.close():
+                if event.get("event") == "done":
+                    completed += 1
+                    self._register_pool_result(event)
+            print(f"🏁 生成ワーカープールを終了しました（{completed}枚）")
+
+    def _register_pool_result(self, event):
+        """ワーカーが生成した画像のフレームバッファを保存してインデックスに登録"""
+        try:
+            self.renderer.write_sidecar(event["output_path"])
+        except Exception as e:
+            print(f"⚠️ フレームバッファ保存エラー: {e}")
+        self.image_store.add(event["output_path"], **event["generation"])
+        self._cleanup_old_images()
+
+    def pending_resume(self):
+        """
+        前回の停止で中断した生成のチェックポイント
+
+        Returns:
+            dict|None: チェックポイント（ない場合・途中保存が無効の場合はNone）
+        """
+        if self.generator.checkpoint is None:
+            return None
+        return self.generator.checkpoint.pending()
+
+    def resume_interrupted(self, display_immediately=True, cancel_event=None):
+        """
+        前回の停止で中断した生成があれば続きから生成
+
+        Args:
+            display_immediately (bool): 生成後すぐに表示するか
+            cancel_event (threading.Event): セットされると生成をステップ境界で中断
+
+        Returns:
+            str|None: 生成された画像のパス（中断した生成がない・失敗した場合はNone）
+        """
+        resume = self.pending_resume()
+        if resume is None:
+            return None
+        job = resume["job"]
+        print(f"⏯️ 中断した生成を再開します（{resume['timestep_index']}ステップ完了済み）")
+        return self.generate_and_display(
+            job["prompt"], display_immediately=display_immediately, cancel_event=cancel_event,
+            profile=job["profile"], resume=resume,
+        )
+
+    def cycle_profile(self):
+        """
+        連続実行の次のサイクルのプロファイル（発熱を抑えている間は軽いプロファイルに置き換え）
+
+        Returns:
+            str|None: プロファイル名（Noneの場合は生成器のデフォルト）
+        """
+        profile = self.profile_selector.next_profile()
+        if self.pacer is None:
+            return profile
+        return self.pacer.profile_for(profile or self.generator.default_profile)
+
+    def pace_cycle(self, mark, images, cycle_seconds, stop_event):
+        """
+        サイクルの結果からスレッド数を調整し、発熱を抑える間隔だけ待機
+
+        Args:
+            mark (int): サイクル開始時の TRACER.mark()（呼び出し元のスレッドの記録を使う）
+            images (int): 生成した枚数
+            cycle_seconds (float): 生成にかかった時間
+            stop_event (threading.Event): セットされたら待機を打ち切る
+        """
+        if self.pacer is None:
+            return
+        plan = self.pacer.after_cycle(TRACER.records(mark, current_thread=True), images, cycle_seconds)
+        self.generator.set_num_threads(plan["threads"])
+        if plan["gap"] > 0:
+            print(f"⏳ 次のサイクルまで{plan['gap']:.0f}秒待機（発熱抑制）")
+            stop_event.wait(plan["gap"])
+
+    def rotation_seed(self):
+        """
+        連続実行で使うシード
+
+        continuous_mode.seeds_per_prompt を設定すると各プロンプトのシードをその数に限定し、
+        一巡した後は生成済みの画像を再利用する
+
+        Returns:
+            int|None: シード（未設定の場合はNoneで毎回ランダム）
+        """
+        seeds = self.config['continuous_mode'].get('seeds_per_prompt')
+        return random.randrange(seeds) if seeds else None
+
     def display_existing_image(self, image_path):
         """
         既存の画像をe-paperに表示
@@ -147,77 +507,113 @@ class AIPhotoFrame:
 
     def _cleanup_old_images(self):
         """
-        古い画像を削除して最新10枚のみ保持
+        保持ポリシー（image.max_stored / max_total_mb / max_age_days）を超えた古い画像を削除
         """
         try:
-            # generated_imagesディレクトリ内のai_photo_*.pngファイルを取得
-            pattern = os.path.join(self.output_dir, "ai_photo_*.png")
-            image_files = glob.glob(pattern)
-
-            if len(image_files) <= 10:
+            evicted = self.image_store.evict()
+            if not evicted:
                 return
 
-            # ファイルを更新日時でソート（古い順）
-            image_files.sort(key=lambda x: os.path.getmtime(x))
+            from epaper_render import remove_sidecars
 
-            # 古いファイルを削除（最新10枚を残す）
-            files_to_delete = image_files[:-10]
             deleted_count = 0
-
-            for file_path in files_to_delete:
+            for file_path in evicted:
                 try:
-                    os.remove(file_path)
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    remove_sidecars(file_path)
+                    remove_derived(file_path)
                     deleted_count += 1
                 except OSError as e:
                     print(f"⚠️ ファイル削除エラー {file_path}: {e}")
 
             if deleted_count > 0:
-                print(f"🗑️ 古い画像{deleted_count}枚を削除しました（最新10枚を保持）")
+                count, total_bytes = self.image_store.totals()
+                print(f"🗑️ 古い画像{deleted_count}枚を削除しました"
+                      f"（保持: {count}枚, {total_bytes / 1024 / 1024:.1f} MB）")
 
         except Exception as e:
             print(f"⚠️ 画像クリーンアップエラー: {e}")
 
-    def list_generated_images(self):
+    def list_generated_images(self, limit=20):
         """
         生成された画像の一覧を表示
+
+        Args:
+            limit (int): 新しい順に表示する最大枚数
         """
         print("=== AI Photo Frame - 生成画像一覧 ===")
 
-        pattern = os.path.join(self.output_dir, "ai_photo_*.png")
-        image_files = glob.glob(pattern)
-
-        if not image_files:
+        count, total_bytes = self.image_store.totals()
+        if count == 0:
             print("生成された画像はありません")
             return
 
-        # ファイルを更新日時でソート（新しい順）
-        image_files.sort(key=lambda x: os.path.getmtime(x), reverse=True)
-
         print(f"保存場所: {self.output_dir}")
-        print(f"画像数: {len(image_files)}枚\n")
-
-        for i, file_path in enumerate(image_files, 1):
-            filename = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path) / 1024  # KB
-            mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-
-            print(f"{i:2d}. {filename}")
-            print(f"    サイズ: {file_size:.1f} KB")
-            print(f"    作成日時: {mod_time.strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f"    パス: {file_path}")
+        print(f"画像数: {count}枚 ({total_bytes / 1024 / 1024:.1f} MB)\n")
+
+        for i, entry in enumerate(self.image_store.recent(limit), 1):
+            created_at = datetime.fromtimestamp(entry['created_at'])
+
+            print(f"{i:2d}. {os.path.basename(entry['path'])}")
+            print(f"    サイズ: {entry['file_size'] / 1024:.1f} KB")
+            print(f"    作成日時: {created_at.strftime('%Y-%m-%d %H:%M:%S')}")
+            if entry['prompt']:
+                print(f"    プロンプト: {entry['prompt']}")
+                print(f"    シード: {entry['seed']} | プロファイル: {entry['profile']} | "
+                      f"生成時間: {entry['generation_time']:.0f}秒")
+            print(f"    パス: {entry['path']}")
             print()
 
-    def generate_only(self, prompt):
+    def generate_only(self, prompt, seed=None):
         """
         画像生成のみ（表示しない）
 
         Args:
             prompt (str): 生成する画像の説明
+            seed (int): 乱数シード（Noneの場合はランダム）
 
         Returns:
             str|None: 成功時は生成された画像のパス、失敗時はNone
         """
-        return self.generate_and_display(prompt, display_immediately=False)
+        return self.generate_and_display(prompt, display_immediately=False, seed=seed)
+
+    @staticmethod
+    def _local_path(path):
+        """設定ファイルのパスを解決（相対パスはこのディレクトリ基準、Noneはそのまま）"""
+        if not path:
+            return None
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.expanduser(path))
+
+    def daemon_socket_path(self):
+        """常駐生成デーモンのUnixソケットのパス"""
+        return self._local_path(self.config.get('daemon', {}).get('socket_path', 'generated_images/daemon.sock'))
+
+    def submit_to_daemon(self, request):
+        """
+        常駐生成デーモンが起動していればジョブを依頼して完了を待つ
+
+        Args:
+            request (dict): {"action": "generate"|"display"|"status", ...}
+
+        Returns:
+            dict|None: 最後に受け取ったイベント（デーモンが起動していない場合はNone）
+        """
+        from generation_daemon import run_client
+
+        return run_client(self.daemon_socket_path(), request)
+
+    def run_daemon(self):
+        """常駐生成デーモンとしてジョブの受け付けを開始"""
+        from generation_daemon import GenerationDaemon
+
+        daemon_config = self.config.get('daemon', {})
+        GenerationDaemon(
+            self,
+            self.daemon_socket_path(),
+            rotation=daemon_config.get('rotation', self.config['continuous_mode']['enabled']),
+            preempt_rotation=daemon_config.get('preempt_rotation', True),
+        ).run()
 
     def _load_config(self):
         """設定ファイルを読み込み"""
@@ -242,13 +638,18 @@ class AIPhotoFrame:
             }
 
     def _signal_handler(self, signum, frame):
-        """シグナルハンドラー（Ctrl+C等での終了処理）"""
-        print(f"\n🛑 シグナル {signum} を受信しました。強制終了します...")
+        """
+        シグナルハンドラー（Ctrl+C等での終了処理）
+
+        生成は次のステップ境界で中断し、チェックポイントを残して次の起動時に続きから生成する。
+        2回目のシグナルでは即座に終了する
+        """
+        if self.stop_event.is_set():
+            print(f"\n🚨 シグナル {signum} を再度受信しました。強制終了します...")
+            sys.exit(0)
+        print(f"\n🛑 シグナル {signum} を受信しました。ステップ境界で生成を中断して終了します...")
         self.running = False
-        # 強制終了のため即座にexit
-        import sys
-        print("🚨 画像生成処理を中断中...")
-        sys.exit(0)
+        self.stop_event.set()
 
     def run_continuous(self):
         """永続実行モード - 表示完了後すぐに次の画像を生成し続ける"""
@@ -256,12 +657,36 @@ class AIPhotoFrame:
             print("❌ 永続実行モードが無効化されています")
             return
 
+        from continuous_pipeline import PipelinedContinuousRunner, BufferedContinuousRunner
+        from frame_buffer import FrameBuffer
+
+        prompts = self.config['continuous_mode']['prompts']
+
+        # 固定プロンプトの埋め込みを事前計算（以降テキストエンコーダーは不要）
+        self.generator.prepare_prompts(prompts)
+
+        # パイプラインモード: 生成と表示を別スレッドで並行実行
+        mode = self.config['continuous_mode'].get('mode', 'serial')
+        if mode == 'pipelined':
+            queue_size = self.config['continuous_mode'].get('queue_size', 1)
+            PipelinedContinuousRunner(self, queue_size=queue_size).run(prompts)
+            return
+
+        # バッファモード: 生成はバッファを埋め、表示は固定間隔でバッファから取り出す
+        if mode == 'buffered':
+            buffer_config = self.config.get('frame_buffer', {})
+            frame_buffer = FrameBuffer(
+                os.path.join(self.output_dir, "frame_buffer"),
+                size=buffer_config.get('size', 6),
+            )
+            interval = buffer_config.get('display_interval_minutes', 30) * 60
+            BufferedContinuousRunner(self, frame_buffer, interval).run(prompts)
+            return
+
         # シグナルハンドラーを設定
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
 
-        prompts = self.config['continuous_mode']['prompts']
-
         print("=== AI Photo Frame - 連続実行モード開始 ===")
         print(f"プロンプト数: {len(prompts)}個")
         print("モード: 表示完了後すぐに次の生成を開始")
@@ -272,6 +697,9 @@ class AIPhotoFrame:
         cycle_count = 0
 
         try:
+            # 前回の停止で中断した生成があれば、新しいプロンプトより先に続きから生成する
+            self.resume_interrupted(cancel_event=self.stop_event)
+
             while self.running:
                 cycle_count += 1
                 print(f"\n🔄 サイクル {cycle_count} 開始 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
@@ -282,19 +710,28 @@ class AIPhotoFrame:
 
                 # 画像生成と表示
                 try:
-                    result_path = self.generate_and_display(prompt)
+                    mark = TRACER.mark()
+                    start_time = time.time()
+                    result_path = self.generate_and_display(
+                        prompt, cancel_event=self.stop_event, profile=self.cycle_profile(),
+                        seed=self.rotation_seed(),
+                    )
                     if result_path:
                         print(f"✅ サイクル {cycle_count} 完了 - {datetime.now().strftime('%H:%M:%S')}")
-                        print("⚡ すぐに次のサイクルを開始...")
+                        if self.pacer is None:
+                            print("⚡ すぐに次のサイクルを開始...")
+                        self.pace_cycle(mark, 1, time.time() - start_time, self.stop_event)
+                    elif self.stop_event.is_set():
+                        break
                     else:
                         print(f"⚠️ サイクル {cycle_count} で画像生成に失敗")
                         print("⏰ 10秒待機してリトライします...")
-                        time.sleep(10)  # エラー時は少し待機
+                        self.stop_event.wait(10)  # エラー時は少し待機
 
                 except Exception as e:
                     print(f"❌ サイクル {cycle_count} でエラー: {e}")
                     print("⏰ 30秒待機してリトライします...")
-                    time.sleep(30)  # エラー時は長めに待機
+                    self.stop_event.wait(30)  # エラー時は長めに待機
 
                 # 古い画像の自動削除実行（毎回）
                 self._cleanup_old_images()
@@ -319,30 +756,80 @@ class AIPhotoFrame:
 
 def main():
     """メイン関数 - コマンドライン引数で動作を制御"""
+    command = sys.argv[1].lower() if len(sys.argv) >= 2 else "usage"
+    try:
+        run_command()
+    finally:
+        STARTUP.mark("command")
+        STARTUP.save(command)
+
+def _pop_seed_option(args):
+    """
+    引数から --seed N を取り出す
+
+    Returns:
+        tuple: (残りの引数, シード（指定なしはNone）)
+    """
+    if "--seed" not in args:
+        return args, None
+    index = args.index("--seed")
+    if index + 1 >= len(args):
+        print("⚠️ --seed の値がないためランダムなシードを使います")
+        return args[:index], None
+    return args[:index] + args[index + 2:], int(args[index + 1])
+
+
+def run_command():
+    """コマンドライン引数に応じた処理を実行"""
     if len(sys.argv) < 2:
         print("使用方法:")
-        print("  python ai_photoframe.py generate \"プロンプト\"      # 画像生成して表示")
-        print("  python ai_photoframe.py generate-only \"プロンプト\" # 画像生成のみ")
+        print("  python ai_photoframe.py generate \"プロンプト\" [--seed N]      # 画像生成して表示")
+        print("  python ai_photoframe.py generate-only \"プロンプト\" [--seed N] # 画像生成のみ")
+        print("  python ai_photoframe.py generate-batch 枚数 [\"プロンプト\"] [--seed N] # まとめて生成（プロンプト省略時は連続実行のプロンプトから選択）")
         print("  python ai_photoframe.py display image_path       # 既存画像を表示")
-        print("  python ai_photoframe.py list                     # 生成画像一覧")
+        print("  python ai_photoframe.py list [件数]              # 生成画像一覧（新しい順）")
         print("  python ai_photoframe.py continuous               # 永続実行モード")
+        print("  python ai_photoframe.py daemon                   # 常駐生成デーモン（generate等のジョブを受け付け）")
+        print("  python ai_photoframe.py pool [枚数]              # コアを分割した複数ワーカーで生成（生成サーバー向け）")
+        print("  python ai_photoframe.py pool-bench [枚数]        # ワーカー数・スレッド数の組ごとのスループットを比較")
+        print("  python ai_photoframe.py daemon-status            # 常駐生成デーモンのキュー状態")
+        print("  python ai_photoframe.py freeze                   # 高速起動用モデルスナップショットを作成")
+        print("  python ai_photoframe.py compare-precision [プロンプト] # 精度モードの速度・メモリ・画質を比較")
+        print("  python ai_photoframe.py compare-guidance [プロンプト]  # ガイダンス打ち切り位置の速度・画質を比較")
+        print("  python ai_photoframe.py startup-bench [コマンド ...]    # コマンドごとの起動時間を計測")
         print("\n例:")
         print("  python ai_photoframe.py generate \"beautiful mountain landscape\"")
+        print("  python ai_photoframe.py generate \"beautiful mountain landscape\" --seed 42")
         print("  python ai_photoframe.py display /path/to/image.jpg")
         print("  python ai_photoframe.py continuous")
         return
 
     command = sys.argv[1].lower()
 
+    if command == "startup-bench":
+        # 各コマンドを別プロセスで起動して計測（引数なしなら使用方法表示とlist）
+        commands = [arg.split() for arg in sys.argv[2:]] or [[], ["list"]]
+        run_startup_benchmark(os.path.abspath(__file__), commands)
+        return
+
     photoframe = AIPhotoFrame()
+    STARTUP.mark("init")
 
     if command == "generate":
         if len(sys.argv) < 3:
             print("❌ プロンプトを指定してください")
             return
 
-        prompt = " ".join(sys.argv[2:])
-        result_path = photoframe.generate_and_display(prompt)
+        args, seed = _pop_seed_option(sys.argv[2:])
+        prompt = " ".join(args)
+        # デーモンが起動していればモデルを読み込まずに依頼する
+        event = photoframe.submit_to_daemon(
+            {"action": "generate", "prompt": prompt, "display": True, "seed": seed}
+        )
+        if event is not None:
+            result_path = event.get("path") if event["event"] == "done" else None
+        else:
+            result_path = photoframe.generate_and_display(prompt, seed=seed)
         if result_path:
             print(f"\n📁 保存先: {result_path}")
 
@@ -351,29 +838,96 @@ def main():
             print("❌ プロンプトを指定してください")
             return
 
-        prompt = " ".join(sys.argv[2:])
-        result_path = photoframe.generate_only(prompt)
+        args, seed = _pop_seed_option(sys.argv[2:])
+        prompt = " ".join(args)
+        event = photoframe.submit_to_daemon(
+            {"action": "generate", "prompt": prompt, "display": False, "seed": seed}
+        )
+        if event is not None:
+            result_path = event.get("path") if event["event"] == "done" else None
+        else:
+            result_path = photoframe.generate_only(prompt, seed=seed)
         if result_path:
             print(f"\n📁 保存先: {result_path}")
             print(f"💡 表示するには: python ai_photoframe.py display \"{result_path}\"")
 
+    elif command == "generate-batch":
+        if len(sys.argv) < 3 or not sys.argv[2].isdigit():
+            print("❌ 生成する枚数を指定してください")
+            return
+
+        count = int(sys.argv[2])
+        args, seed = _pop_seed_option(sys.argv[3:])
+        if args:
+            prompts = [" ".join(args)] * count
+        else:
+            prompts = [random.choice(photoframe.config['continuous_mode']['prompts']) for _ in range(count)]
+        # シードを指定した場合は1枚ごとに1ずつ増やす
+        seeds = [seed + i for i in range(count)] if seed is not None else None
+        result_paths = photoframe.generate_batch(prompts, seeds=seeds)
+        print(f"\n📁 生成した画像: {sum(1 for path in result_paths if path)}/{count}枚")
+        for path in result_paths:
+            if path:
+                print(f"  {path}")
+
     elif command == "display":
         if len(sys.argv) < 3:
             print("❌ 画像パスを指定してください")
             return
 
         image_path = sys.argv[2]
-        photoframe.display_existing_image(image_path)
+        # デーモンが起動中はパネルを共有できないため表示もデーモンに依頼
+        event = photoframe.submit_to_daemon({"action": "display", "path": os.path.abspath(image_path)})
+        if event is None:
+            photoframe.display_existing_image(image_path)
+        elif event["event"] != "done":
+            print(f"❌ 画像表示に失敗しました: {image_path}")
 
     elif command == "list":
-        photoframe.list_generated_images()
+        if len(sys.argv) >= 3:
+            photoframe.list_generated_images(int(sys.argv[2]))
+        else:
+            photoframe.list_generated_images()
 
     elif command == "continuous":
         photoframe.run_continuous()
 
+    elif command == "daemon":
+        photoframe.run_daemon()
+
+    elif command == "pool":
+        photoframe.run_pool(int(sys.argv[2]) if len(sys.argv) >= 3 else None)
+
+    elif command == "pool-bench":
+        from worker_pool import run_pool_benchmark
+        run_pool_benchmark(
+            photoframe.config,
+            photoframe.config['continuous_mode']['prompts'],
+            os.path.join(photoframe.output_dir, "pool_bench"),
+            images=int(sys.argv[2]) if len(sys.argv) >= 3 else None,
+            layouts=photoframe.config.get('worker_pool', {}).get('bench_layouts'),
+        )
+
+    elif command == "daemon-status":
+        if photoframe.submit_to_daemon({"action": "status"}) is None:
+            print(f"❌ デーモンは起動していません: {photoframe.daemon_socket_path()}")
+
+    elif command == "freeze":
+        photoframe.generator.freeze_model()
+
+    elif command == "compare-precision":
+        prompt = " ".join(sys.argv[2:]) or photoframe.config['continuous_mode']['prompts'][0]
+        from precision import compare_precision_modes
+        compare_precision_modes(photoframe.config, prompt, photoframe.output_dir)
+
+    elif command == "compare-guidance":
+        prompt = " ".join(sys.argv[2:]) or photoframe.config['continuous_mode']['prompts'][0]
+        from guidance import compare_guidance_cutoffs
+        compare_guidance_cutoffs(photoframe.generator, prompt, photoframe.output_dir)
+
     else:
         print(f"❌ 不明なコマンド: {command}")
-        print("使用可能なコマンド: generate, generate-only, display, list, continuous")
+        print("使用可能なコマンド: generate, generate-only, generate-batch, display, list, continuous, daemon, daemon-status, pool, pool-bench, freeze, compare-precision, compare-guidance, startup-bench")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - バッチ生成の枚数決定
+1回のパイプライン呼び出しでまとめて生成する枚数を、メモリ予算と1枚あたりの実測メモリから決める
+"""
+
+import threading
+
+# 実測前の1枚あたりの追加メモリの見積もり（640x400、float32、attention slicing有効時のUNet）
+REFERENCE_PIXELS = 640 * 400
+REFERENCE_MB_PER_IMAGE = 900
+
+# 実測値のばらつきで予算を超えないよう見積もりに上乗せする割合
+SAFETY_MARGIN = 1.2
+
+
+class BatchPlanner:
+    """メモリ予算内に収まるバッチ枚数を解像度ごとの実測値から決める"""
+
+    def __init__(self, memory_budget_mb=1536, max_size=4):
+        """
+        Args:
+            memory_budget_mb (float): モデル読み込み後のRSSに上乗せしてよいメモリ（MB）
+            max_size (int): 1回に生成する最大枚数（1でバッチ生成を無効）
+        """
+        self.memory_budget_mb = memory_budget_mb
+        self.max_size = max(1, max_size)
+        # (幅, 高さ) -> 1枚あたりの追加メモリ（MB）
+        self.measured = {}
+        self.lock = threading.Lock()
+
+    def per_image_mb(self, width, height):
+        """
+        1枚あたりの追加メモリ（実測値がなければ画素数に比例した見積もり）
+
+        Returns:
+            float: MB
+        """
+        with self.lock:
+            measured = self.measured.get((width, height))
+        if measured is not None:
+            return measured
+        return REFERENCE_MB_PER_IMAGE * width * height / REFERENCE_PIXELS
+
+    def size_for(self, settings, pending):
+        """
+        次のバッチの枚数
+
+        Args:
+            settings (dict): 生成プロファイルの設定（width, height）
+            pending (int): 生成待ちの枚数
+
+        Returns:
+            int: 1以上 pending 以下の枚数
+        """
+        if pending <= 1 or self.max_size <= 1:
+            return 1
+        per_image = self.per_image_mb(settings['width'], settings['height']) * SAFETY_MARGIN
+        fits = int(self.memory_budget_mb // per_image) if per_image > 0 else self.max_size
+        return max(1, min(pending, self.max_size, fits))
+
+    def record(self, settings, batch_size, baseline_mb, peak_mb):
+        """
+        バッチ生成中のピークRSSから1枚あたりの追加メモリを更新
+
+        Args:
+            settings (dict): 生成プロファイルの設定（width, height）
+            batch_size (int): 生成した枚数
+            baseline_mb (float): 生成開始前のRSS（MB）
+            peak_mb (float): 生成中のピークRSS（MB）
+        """
+        if peak_mb <= baseline_mb or batch_size < 1:
+            return
+        with self.lock:
+            self.measured[(settings['width'], settings['height'])] = (peak_mb - baseline_mb) / batch_size
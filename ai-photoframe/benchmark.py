@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - オフラインベンチマーク
+ランダム重みの小さなStable Diffusionパイプラインを設定から組み立て、実際の生成・減色・連続実行の処理を
+パネルなし・ネットワークなしで計測し、保存済みのベースラインと比較する
+"""
+
+import copy
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# 初回importの時間も起動時間として計測する
+_import_start = time.perf_counter()
+from image_generator import ImageGenerator
+from telemetry import TRACER
+IMPORT_TIME = time.perf_counter() - _import_start
+
+from ai_photoframe import AIPhotoFrame
+from continuous_pipeline import PipelinedContinuousRunner
+from epaper_render import DITHER_MODES, EpaperRenderer
+from generation_profiles import load_profiles
+
+# 組み立てるモデルの構成を変えたらバージョンを上げる（キャッシュ済みのモデルを作り直す）
+FIXTURE_VERSION = 1
+FIXTURE_DIRECTORY = "~/.cache/ai-photoframe/bench-model"
+
+# 640x400と同じ縦横比。パイプラインは8の倍数を要求する
+BENCH_WIDTH = 128
+BENCH_HEIGHT = 80
+
+# 実機（UC8159）のリフレッシュは約30秒。連続実行のスループット計測では短くして再現する
+PANEL_REFRESH_SECONDS = 1.0
+
+IMAGES_PER_PROFILE = 2
+# バッチ生成の計測で1回に生成する枚数
+BATCH_SIZE = 4
+CONTINUOUS_CYCLES = 3
+
+# ベースラインからこの割合を超えて悪化したら失敗とする
+TOLERANCE = 0.10
+
+
+def _write_tokenizer(directory):
+    """
+    バイト単位のみの語彙でCLIPトークナイザーを作成（マージなし。ダウンロード不要）
+    """
+    from transformers import CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    os.makedirs(directory, exist_ok=True)
+    characters = list(bytes_to_unicode().values())
+    vocab = {}
+    for token in ["<|startoftext|>", "<|endoftext|>"] + characters + [c + "</w>" for c in characters]:
+        vocab.setdefault(token, len(vocab))
+
+    vocab_path = os.path.join(directory, "vocab.json")
+    merges_path = os.path.join(directory, "merges.txt")
+    with open(vocab_path, 'w', encoding='utf-8') as f:
+        json.dump(vocab, f)
+    with open(merges_path, 'w', encoding='utf-8') as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(vocab_path, merges_path, model_max_length=77)
+
+
+def build_fixture(directory=FIXTURE_DIRECTORY):
+    """
+    ランダム重みの小さなパイプラインを作成して保存（作成済みなら再利用）
+
+    Returns:
+        str: model_id として使えるパイプラインのディレクトリ
+    """
+    directory = os.path.join(os.path.expanduser(directory), f"v{FIXTURE_VERSION}")
+    if os.path.exists(os.path.join(directory, "model_index.json")):
+        return directory
+
+    import torch
+    from diffusers import AutoencoderKL, DDIMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    print(f"ベンチマーク用のランダム重みモデルを作成中: {directory}")
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(32, 64),
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D", "DownEncoderBlock2D"),
+        up_block_types=("UpDecoderBlock2D", "UpDecoderBlock2D"),
+        latent_channels=4,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=1,
+        hidden_size=32,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        vocab_size=1000,
+    ))
+    scheduler = DDIMScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        clip_sample=False,
+        set_alpha_to_one=False,
+    )
+    pipe = StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=_write_tokenizer(os.path.join(directory, "tokenizer")),
+        unet=unet,
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+    # 書き込み途中のディレクトリを使わないよう一時ディレクトリ経由で置き換え
+    tmp_directory = directory + ".tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    pipe.save_pretrained(tmp_directory, safe_serialization=True)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+    return directory
+
+
+def bench_config(model_dir, work_dir):
+    """
+    config.json を元に、ベンチマーク用モデル・作業ディレクトリを使う設定を作成
+
+    Returns:
+        dict: AIPhotoFrame / ImageGenerator に渡す設定
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config = copy.deepcopy(config)
+
+    generator = config.setdefault('generator', {})
+    generator['model_id'] = model_dir
+    generator['embedding_cache'] = dict(generator.get('embedding_cache', {}),
+                                        directory=os.path.join(work_dir, "prompt_embeds"))
+    generator['snapshot'] = {"enabled": False}
+    generator['precision'] = dict(generator.get('precision', {}), directory=os.path.join(work_dir, "precision"))
+    generator['backend'] = dict(generator.get('backend', {}), export_directory=os.path.join(work_dir, "exported"))
+    # 途中保存の時間も計測に含めるが、実機の中断した生成を再開しないよう保存先を分ける
+    generator['checkpoint'] = dict(generator.get('checkpoint', {}), directory=os.path.join(work_dir, "checkpoint"))
+    # 小型デコーダーの重みはないため tiny は full で計測される
+    generator['decoder'] = dict(generator.get('decoder', {}), tiny_path=None)
+
+    # プロファイルのスケジューラー・ステップ数・ガイダンス設定はそのまま、解像度だけ縮小
+    generator['profiles'] = {
+        name: dict(profile, width=BENCH_WIDTH, height=BENCH_HEIGHT)
+        for name, profile in load_profiles(generator).items()
+    }
+
+    config['continuous_mode'] = dict(config['continuous_mode'], enabled=True, mode="pipelined",
+                                     queue_size=1, profile_schedule={"mode": "fixed"})
+    config['telemetry'] = {}
+    # パネルの代わりにメモリに保持し、転送・リフレッシュ時間だけ再現する
+    config['display'] = dict(config['display'], driver="memory", refresh_seconds=PANEL_REFRESH_SECONDS)
+    return config
+
+
+def _stage(records, stage):
+    return [record for record in records if record["stage"] == stage]
+
+
+def bench_startup(config):
+    """モデル読み込み時間（新しい生成器で計測）"""
+    generator = ImageGenerator(config)
+    start_time = time.perf_counter()
+    if not generator.load_model():
+        raise RuntimeError("ベンチマーク用モデルの読み込みに失敗しました")
+    return {
+        "import_s": IMPORT_TIME,
+        "model_load_s": time.perf_counter() - start_time,
+    }, generator
+
+
+def bench_generation(generator, output_dir):
+    """
+    プロファイルごとに generate_image を実行し、秒/ステップ・デコード時間・ピークRSSを計測
+
+    Returns:
+        tuple: (プロファイル名 -> 計測結果, 最後に生成した画像のパス)
+    """
+    results = {}
+    image_path = None
+    for name in generator.profiles:
+        walls, steps, decodes, peaks = [], 0, [], []
+        for index in range(IMAGES_PER_PROFILE):
+            mark = TRACER.mark()
+            image_path = os.path.join(output_dir, f"bench_{name}_{index}.png")
+            if not generator.generate_image("benchmark prompt", image_path, seed=index, profile=name):
+                raise RuntimeError(f"プロファイル {name} の生成に失敗しました")
+
+            records = TRACER.records(mark)
+            for record in _stage(records, "unet_denoise"):
+                walls.append(record["wall"])
+                steps += record["steps"]
+                peaks.append(record["peak_rss_mb"])
+            for record in _stage(records, "vae_decode"):
+                decodes.append(record["wall"])
+                peaks.append(record["peak_rss_mb"])
+
+        results[name] = {
+            "s_per_step": sum(walls) / max(1, steps),
+            "decode_s": sum(decodes) / max(1, len(decodes)),
+            "peak_rss_mb": max(peaks) if peaks else 0,
+        }
+        print(f"  {name:<10} {results[name]['s_per_step']:.3f}秒/ステップ | "
+              f"デコード {results[name]['decode_s']:.3f}秒 | ピークRSS {results[name]['peak_rss_mb']:.0f}MB")
+    return results, image_path
+
+
+def bench_batch(generator, output_dir, batch_size=BATCH_SIZE):
+    """
+    同じ枚数を1枚ずつ生成した場合とバッチ生成した場合の1枚あたりの時間を比較
+
+    Returns:
+        dict: 1枚あたりの秒数（sequential / batched）
+    """
+    prompts = [f"benchmark prompt {index}" for index in range(batch_size)]
+    paths = [os.path.join(output_dir, f"bench_batch_{index}.png") for index in range(batch_size)]
+    # メモリ予算で分割されないよう枚数を固定
+    generator.batch_planner.max_size = batch_size
+    generator.batch_planner.memory_budget_mb = float("inf")
+
+    start_time = time.perf_counter()
+    for index, (prompt, path) in enumerate(zip(prompts, paths)):
+        if not generator.generate_image(prompt, path, seed=index):
+            raise RuntimeError("1枚ずつの生成に失敗しました")
+    sequential = (time.perf_counter() - start_time) / batch_size
+
+    start_time = time.perf_counter()
+    results = generator.generate_batch(prompts, paths, seeds=list(range(batch_size)))
+    if not all(results):
+        raise RuntimeError("バッチ生成に失敗しました")
+    batched = (time.perf_counter() - start_time) / batch_size
+
+    print(f"  1枚ずつ {sequential:.3f}秒/枚 | バッチ{batch_size}枚 {batched:.3f}秒/枚 "
+          f"({sequential / batched:.2f}倍)")
+    return {"sequential_s_per_image": sequential, "batched_s_per_image": batched}
+
+
+def bench_quantize(config, image_path, repeat=3):
+    """減色・ディザリング（パネル解像度へのリサイズを含む）の時間を方式ごとに計測"""
+    from PIL import Image
+
+    results = {}
+    resolution = tuple(config['display']['resolution'])
+    with Image.open(image_path) as image:
+        image.load()
+        for dither in DITHER_MODES:
+            renderer = EpaperRenderer(resolution, saturation=config['display'].get('saturation', 0.5), dither=dither)
+            durations = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                renderer.render(image)
+                durations.append(time.perf_counter() - start_time)
+            results[dither] = {"quantize_ms": sorted(durations)[len(durations) // 2] * 1000}
+            print(f"  {dither:<16} {results[dither]['quantize_ms']:.1f}ms")
+    return results
+
+
+def bench_continuous(config, output_dir, cycles=CONTINUOUS_CYCLES):
+    """パイプライン連続実行をメモリ上のパネルで cycles 枚表示するまで実行し、1サイクルの時間を計測"""
+    photoframe = AIPhotoFrame(config, output_dir=output_dir)
+    photoframe.generator.prepare_prompts(config['continuous_mode']['prompts'])
+    runner = PipelinedContinuousRunner(photoframe, queue_size=config['continuous_mode']['queue_size'])
+
+    def stop_after_cycles():
+        while not runner.stop_event.is_set():
+            if runner.stats.displayed_count >= cycles:
+                runner.stop_event.set()
+            time.sleep(0.1)
+
+    # run() はシグナルハンドラーを登録するためメインスレッドで実行する
+    threading.Thread(target=stop_after_cycles, daemon=True).start()
+    runner.run(config['continuous_mode']['prompts'])
+
+    summary = runner.stats.summary() or {}
+    result = {
+        "cycle_s": 3600 / summary["pipelined_per_hour"] if summary else None,
+        "avg_generation_s": summary.get("avg_generation"),
+        "avg_display_s": summary.get("avg_display"),
+        "panel_refresh_s": PANEL_REFRESH_SECONDS,
+    }
+    return result
+
+
+def flatten(results, prefix=""):
+    """ネストした計測結果を "a.b.c" -> 数値 の辞書にする"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    ベースラインと比較して表示（すべての指標は小さいほど良い）
+
+    Returns:
+        list: 許容範囲を超えて悪化した指標名
+    """
+    current = flatten(results)
+    previous = flatten(baseline)
+    regressions = []
+    print(f"\n=== ベースラインとの比較（許容: +{tolerance * 100:.0f}%） ===")
+    for name in sorted(current):
+        # 設定値（擬似パネルのリフレッシュ時間）は比較しない
+        if name not in previous or not previous[name] or name.endswith("panel_refresh_s"):
+            continue
+        ratio = current[name] / previous[name]
+        status = "✅"
+        if ratio > 1 + tolerance:
+            status = "❌"
+            regressions.append(name)
+        print(f"{status} {name:<40} {previous[name]:10.4f} -> {current[name]:10.4f} ({(ratio - 1) * 100:+.1f}%)")
+    return regressions
+
+
+def run_benchmark(output_path="bench_results.json", baseline_path="bench_baseline.json"):
+    """
+    ベンチマークを実行して結果を保存し、ベースラインがあれば比較（なければ結果をベースラインとして保存）
+
+    Returns:
+        bool: 悪化した指標がない場合True
+    """
+    print("=== AI Photo Frame - オフラインベンチマーク ===")
+    work_dir = tempfile.mkdtemp(prefix="aiphotoframe-bench-")
+    try:
+        config = bench_config(build_fixture(), work_dir)
+        output_dir = os.path.join(work_dir, "images")
+        os.makedirs(output_dir)
+
+        print("\n起動:")
+        startup, generator = bench_startup(config)
+        print(f"  import {startup['import_s']:.2f}秒 | モデル読み込み {startup['model_load_s']:.2f}秒")
+
+        print(f"\n生成（{BENCH_WIDTH}x{BENCH_HEIGHT}, 各プロファイル{IMAGES_PER_PROFILE}枚）:")
+        generation, image_path = bench_generation(generator, output_dir)
+
+        print(f"\nバッチ生成（{BATCH_SIZE}枚）:")
+        batch = bench_batch(generator, output_dir)
+        del generator
+
+        print("\n減色:")
+        quantize = bench_quantize(config, image_path)
+
+        print(f"\n連続実行（擬似パネル, {CONTINUOUS_CYCLES}サイクル）:")
+        continuous = bench_continuous(config, output_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "host": {"machine": platform.machine(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "results": {
+            "startup": startup,
+            "generation": generation,
+            "batch": batch,
+            "quantize": quantize,
+            "continuous": continuous,
+        },
+    }
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📁 結果: {output_path}")
+
+    if not os.path.exists(baseline_path):
+        shutil.copyfile(output_path, baseline_path)
+        print(f"📌 ベースラインとして保存しました: {baseline_path}")
+        return True
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(report["results"], baseline["results"])
+    if regressions:
+        print(f"\n❌ {len(regressions)}個の指標が悪化しました")
+        return False
+    print("\n✅ ベースラインからの悪化はありません")
+    return True
+
+
+def main():
+    """使用方法: python benchmark.py [結果JSON] [ベースラインJSON]"""
+    output_path = sys.argv[1] if len(sys.argv) > 1 else "bench_results.json"
+    baseline_path = sys.argv[2] if len(sys.argv) > 2 else "bench_baseline.json"
+    sys.exit(0 if run_benchmark(output_path, baseline_path) else 1)
+
+
+if __name__ == "__main__":
+    main()
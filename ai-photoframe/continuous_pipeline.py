@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - パイプライン連続実行
+生成ワーカーと表示ワーカーを分離し、e-paper表示中に次の画像を生成する
+"""
+
+import queue
+import random
+import signal
+import threading
+import time
+from datetime import datetime
+
+from telemetry import TRACER
+
+
+class ThroughputStats:
+    """生成・表示の所要時間を記録し、直列ループとのスループットを比較"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.generation_times = []
+        self.display_times = []
+        self.displayed_count = 0
+
+    def record_generation(self, duration):
+        with self.lock:
+            self.generation_times.append(duration)
+
+    def record_display(self, duration):
+        with self.lock:
+            self.display_times.append(duration)
+            self.displayed_count += 1
+
+    def summary(self):
+        """
+        スループットの集計結果を返す
+
+        Returns:
+            dict|None: 表示済み画像がない場合はNone
+        """
+        with self.lock:
+            if self.displayed_count == 0 or not self.generation_times:
+                return None
+
+            elapsed = time.time() - self.started_at
+            avg_generation = sum(self.generation_times) / len(self.generation_times)
+            avg_display = sum(self.display_times) / len(self.display_times)
+
+            # 直列ループでは1サイクル = 生成 + 表示
+            serial_cycle = avg_generation + avg_display
+            pipelined_cycle = elapsed / self.displayed_count
+
+            return {
+                "displayed": self.displayed_count,
+                "avg_generation": avg_generation,
+                "avg_display": avg_display,
+                "serial_per_hour": 3600 / serial_cycle,
+                "pipelined_per_hour": 3600 / pipelined_cycle,
+                "speedup": serial_cycle / pipelined_cycle,
+            }
+
+    def report(self):
+        """集計結果を表示"""
+        result = self.summary()
+        if result is None:
+            print("📈 スループット: 計測データなし")
+            return
+
+        print(f"📈 スループット: {result['pipelined_per_hour']:.2f}枚/時 "
+              f"(直列ループ推定: {result['serial_per_hour']:.2f}枚/時, "
+              f"{result['speedup']:.2f}倍)")
+        print(f"    平均生成時間: {result['avg_generation']:.0f}秒 | "
+              f"平均表示時間: {result['avg_display']:.0f}秒 | "
+              f"表示枚数: {result['displayed']}枚")
+
+
+class PipelinedContinuousRunner:
+    """生成ワーカーと表示ワーカーによるプロデューサー/コンシューマー型の連続実行"""
+
+    def __init__(self, photoframe, queue_size=1):
+        """
+        Args:
+            photoframe (AIPhotoFrame): 生成・表示を行うフォトフレーム
+            queue_size (int): 表示待ち画像キューの最大長
+        """
+        self.photoframe = photoframe
+        self.ready_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.stop_event = threading.Event()
+        self.stats = ThroughputStats()
+        self.cycle_count = 0
+
+    def _signal_handler(self, signum, frame):
+        """シグナルハンドラー（ワーカーに停止を通知し、メインスレッドで終了を待つ）"""
+        print(f"\n🛑 シグナル {signum} を受信しました。ワーカーを停止します...")
+        self.stop_event.set()
+        self.photoframe.running = False
+
+    def _describe_mode(self):
+        return f"e-paper表示中に次の画像を生成（キュー長: {self.ready_queue.maxsize}）"
+
+    def _wait_for_capacity(self):
+        """生成開始前に受け入れ先の空きを待つ（キューは生成後に待つため即座に返す）"""
+        return not self.stop_event.is_set()
+
+    def _handoff(self, result_path, prompt):
+        """生成済み画像を表示待ちキューに渡す（空きができるまで待機）"""
+        while not self.stop_event.is_set():
+            try:
+                self.ready_queue.put(result_path, timeout=1)
+                print(f"📥 表示待ちキューに追加: {result_path} (待ち: {self.ready_queue.qsize()}枚)")
+                return
+            except queue.Full:
+                continue
+
+    def _resume_interrupted(self):
+        """前回の停止で中断した生成があれば続きから生成して表示側に渡す"""
+        result_path = self.photoframe.resume_interrupted(display_immediately=False, cancel_event=self.stop_event)
+        if result_path:
+            self._handoff(result_path, self.photoframe.generator.last_generation["prompt"])
+
+    def _free_slots(self):
+        """表示側が今受け取れる枚数（1サイクルでまとめて生成する枚数の上限）"""
+        return max(1, self.ready_queue.maxsize - self.ready_queue.qsize())
+
+    def _generate(self, prompts):
+        """
+        1サイクル分の画像を生成（受け取れる枚数が2枚以上ならバッチ生成）
+
+        Returns:
+            list: 1枚ごとの画像のパス（prompts と同じ順。失敗した画像はNone）
+        """
+        profile = self.photoframe.cycle_profile()
+        if len(prompts) > 1:
+            return self.photoframe.generate_batch(
+                prompts,
+                seeds=[self.photoframe.rotation_seed() for _ in prompts],
+                profile=profile,
+                cancel_event=self.stop_event,
+            )
+        return [self.photoframe.generate_and_display(
+            prompts[0],
+            display_immediately=False,
+            cancel_event=self.stop_event,
+            profile=profile,
+            seed=self.photoframe.rotation_seed(),
+        )]
+
+    def _generation_worker(self, prompts):
+        """画像を生成して表示側に渡し続ける"""
+        # 破損したチェックポイントやメモリ不足で再開に失敗しても、通常の生成は続ける
+        try:
+            self._resume_interrupted()
+        except Exception as e:
+            print(f"❌ 中断した生成の再開でエラー: {e}")
+        while self._wait_for_capacity():
+            self.cycle_count += 1
+            cycle = self.cycle_count
+            count = min(self._free_slots(), self.photoframe.batch_capacity())
+            cycle_prompts = [random.choice(prompts) for _ in range(count)]
+            print(f"\n🔄 生成サイクル {cycle} 開始 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            for prompt in cycle_prompts:
+                print(f"📝 選択されたプロンプト: '{prompt}'")
+
+            mark = TRACER.mark()
+            start_time = time.time()
+            try:
+                result_paths = self._generate(cycle_prompts)
+            except Exception as e:
+                print(f"❌ 生成サイクル {cycle} でエラー: {e}")
+                print("⏰ 30秒待機してリトライします...")
+                self.stop_event.wait(30)
+                continue
+
+            results = [(path, prompt) for path, prompt in zip(result_paths, cycle_prompts) if path]
+            if not results:
+                if self.stop_event.is_set():
+                    break
+                print(f"⚠️ 生成サイクル {cycle} で画像生成に失敗")
+                print("⏰ 10秒待機してリトライします...")
+                self.stop_event.wait(10)
+                continue
+
+            # スループットは1枚あたりの生成時間で比較する
+            cycle_seconds = time.time() - start_time
+            duration = cycle_seconds / len(results)
+            for result_path, prompt in results:
+                self.stats.record_generation(duration)
+                self._handoff(result_path, prompt)
+            self.photoframe.pace_cycle(mark, len(results), cycle_seconds, self.stop_event)
+
+    def _display_worker(self):
+        """キューから画像を取り出し、リサイズ・減色・SPI転送・リフレッシュを行う"""
+        while not self.stop_event.is_set():
+            try:
+                image_path = self.ready_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            # 表示中にシグナルを受けても、パネルのリフレッシュは最後まで完了させる
+            start_time = time.time()
+            if self.photoframe.display_image(image_path):
+                self.stats.record_display(time.time() - start_time)
+                self.stats.report()
+
+            self.photoframe._cleanup_old_images()
+
+    def _run_worker(self, target, *args):
+        """ワーカーを実行し、どちらかが終了したら（例外を含む）もう一方も止める"""
+        try:
+            target(*args)
+        except Exception as e:
+            print(f"❌ {threading.current_thread().name} が異常終了しました: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            # 片方だけが止まると、もう一方が空のキューを待ち続けて run() が戻らなくなる
+            self.stop_event.set()
+
+    def run(self, prompts):
+        """
+        パイプライン連続実行を開始し、停止要求まで待機
+
+        Args:
+            prompts (list): ランダムに選択するプロンプト一覧
+        """
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+
+        print("=== AI Photo Frame - パイプライン連続実行モード開始 ===")
+        print(f"プロンプト数: {len(prompts)}個")
+        print(f"モード: {self._describe_mode()}")
+        print("終了するには Ctrl+C を押してください")
+        print()
+
+        self.photoframe.running = True
+        workers = [
+            threading.Thread(target=self._run_worker, args=(self._generation_worker, prompts),
+                             name="generation-worker"),
+            threading.Thread(target=self._run_worker, args=(self._display_worker,), name="display-worker"),
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            # メインスレッドはシグナル受信のためタイムアウト付きで待機
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(timeout=1)
+        finally:
+            self.stop_event.set()
+            for worker in workers:
+                worker.join()
+            self.photoframe.running = False
+            print(f"\n🏁 パイプライン連続実行モードを終了しました")
+            print(f"📈 総生成サイクル数: {self.cycle_count}")
+            self.stats.report()
+            print(f"⏱️  実行時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} に終了")
+
+
+class BufferedContinuousRunner(PipelinedContinuousRunner):
+    """フレームバッファを介し、生成速度と無関係に固定間隔で表示を更新する連続実行"""
+
+    def __init__(self, photoframe, frame_buffer, display_interval):
+        """
+        Args:
+            photoframe (AIPhotoFrame): 生成・表示を行うフォトフレーム
+            frame_buffer (FrameBuffer): 表示可能な画像を保持するバッファ
+            display_interval (float): 表示更新間隔（秒）
+        """
+        super().__init__(photoframe)
+        self.frame_buffer = frame_buffer
+        self.display_interval = display_interval
+
+    def _describe_mode(self):
+        return (f"フレームバッファから{self.display_interval / 60:.0f}分間隔で表示 "
+                f"（バッファ: {self.frame_buffer.size}枚, 未表示: {self.frame_buffer.unshown_count()}枚）")
+
+    def _wait_for_capacity(self):
+        """未表示フレームでバッファが埋まっている間は生成を保留"""
+        while not self.stop_event.is_set():
+            if self.frame_buffer.has_capacity():
+                return True
+            self.stop_event.wait(5)
+        return False
+
+    def _free_slots(self):
+        """未表示フレームを上書きせずに追加できるスロット数"""
+        return max(1, self.frame_buffer.size - self.frame_buffer.unshown_count())
+
+    def _handoff(self, result_path, prompt):
+        # バッファにコピーするため書き出しの完了を待つ（次の生成はすでに始められる状態）
+        if not self.photoframe.wait_for_output(result_path):
+            print(f"⚠️ 画像の書き出しに失敗したため追加をスキップ: {result_path}")
+            return
+        buffered_path = self.frame_buffer.add(result_path, prompt=prompt)
+        if buffered_path:
+            print(f"📥 フレームバッファに追加: {buffered_path} (未表示: {self.frame_buffer.unshown_count()}枚)")
+        else:
+            print(f"⚠️ フレームバッファに空きがないため追加をスキップ: {result_path}")
+
+    def _display_worker(self):
+        """固定スケジュールでバッファからフレームを取り出して表示"""
+        next_tick = time.time()
+        while not self.stop_event.is_set():
+            # 処理時間によるずれが蓄積しないよう開始時刻基準でスケジュール
+            if self.stop_event.wait(max(0, next_tick - time.time())):
+                break
+            next_tick += self.display_interval
+
+            read_start = time.time()
+            frame = self.frame_buffer.next_frame()
+            if frame is None:
+                print("⏳ フレームバッファが空のため表示をスキップ（生成待ち）")
+                # 最初のフレームが届いたらすぐ表示できるよう短い間隔で再確認
+                next_tick = time.time() + min(self.display_interval, 10)
+                continue
+
+            read_time = time.time() - read_start
+            print(f"🖼️ バッファから取得: {frame['path']} ({read_time * 1000:.1f}ms, "
+                  f"表示回数: {frame['shown_count']}回目)")
+
+            start_time = time.time()
+            if self.photoframe.display_image(frame['path']) and frame['shown_count'] == 1:
+                # スループットには新規画像の表示のみ計上（再表示は含めない）
+                self.stats.record_display(time.time() - start_time)
+
+            self.photoframe._cleanup_old_images()
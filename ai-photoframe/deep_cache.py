@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - UNet特徴キャッシュ（DeepCache方式）
+深い層の特徴をNステップごとにだけ計算し、間のステップは浅い分岐のみを実行する
+"""
+
+import time
+
+import torch
+
+from guidance import UNetForwardPatch
+
+
+class DeepCacheUNet(UNetForwardPatch):
+    """
+    UNetのforwardを生成中だけ差し替え、上位ブロックの特徴をステップ間で再利用する
+
+    フルステップでは全ブロックを計算し、浅い側の up block に入る直前の特徴を保存する。
+    キャッシュステップでは浅い down block だけを計算し、保存した特徴から
+    残りの up block を実行する（スキップ接続は毎ステップ計算した浅い特徴を使う）。
+    """
+
+    def __init__(self, unet, interval, branch=0):
+        """
+        Args:
+            unet (torch.nn.Module): パイプラインのUNet
+            interval (int): 深い特徴を再計算する間隔（ステップ数）
+            branch (int): 毎ステップ計算する浅い up block の数 - 1（0が最も浅い）
+        """
+        super().__init__(unet)
+        # torch.compileのラッパーからは元のモジュールのブロックを使う
+        self.model = getattr(unet, '_orig_mod', unet)
+        self.interval = max(1, interval)
+        self.branch = min(branch, len(self.model.up_blocks) - 1)
+        self.step = 0
+        self.cached_feature = None
+        self.full_times = []
+        self.shallow_times = []
+
+    def _call_block(self, block, sample, emb, encoder_hidden_states, cross_attention_kwargs, **kwargs):
+        if getattr(block, 'has_cross_attention', False):
+            return block(
+                hidden_states=sample,
+                temb=emb,
+                encoder_hidden_states=encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+                **kwargs,
+            )
+        return block(hidden_states=sample, temb=emb, **kwargs)
+
+    def _forward(self, sample, timestep, encoder_hidden_states=None, *args,
+                 cross_attention_kwargs=None, return_dict=True, **kwargs):
+        model = self.model
+        start_time = time.time()
+        full_step = self.cached_feature is None or self.step % self.interval == 0
+
+        # 時刻埋め込み（UNet2DConditionModel.forward と同じ処理）
+        timesteps = timestep
+        if not torch.is_tensor(timesteps):
+            timesteps = torch.tensor([timesteps], dtype=torch.int64, device=sample.device)
+        elif timesteps.dim() == 0:
+            timesteps = timesteps[None].to(sample.device)
+        timesteps = timesteps.expand(sample.shape[0])
+        emb = model.time_embedding(model.time_proj(timesteps).to(dtype=sample.dtype))
+
+        # 潜在サイズがアップサンプル倍率で割り切れない場合（640x400 -> 80x50）は出力サイズを明示
+        up_factor = 2 ** (len(model.up_blocks) - 1)
+        forward_upsample_size = any(size % up_factor != 0 for size in sample.shape[-2:])
+
+        # キャッシュステップで計算する up block と、それが使うスキップ接続の数
+        first_up = 0 if full_step else len(model.up_blocks) - 1 - self.branch
+        needed_residuals = sum(len(block.resnets) for block in model.up_blocks[first_up:])
+
+        sample = model.conv_in(sample)
+        residuals = (sample,)
+        for block in model.down_blocks:
+            if not full_step and len(residuals) >= needed_residuals:
+                break
+            sample, block_residuals = self._call_block(
+                block, sample, emb, encoder_hidden_states, cross_attention_kwargs)
+            residuals += block_residuals
+
+        if full_step:
+            sample = model.mid_block(
+                sample, emb,
+                encoder_hidden_states=encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+            )
+        else:
+            residuals = residuals[:needed_residuals]
+            # ガイダンス打ち切りでバッチが半分になった場合は条件付き側（後半）を使う
+            sample = self.cached_feature[-sample.shape[0]:]
+
+        cache_at = len(model.up_blocks) - 1 - self.branch
+        for index in range(first_up, len(model.up_blocks)):
+            block = model.up_blocks[index]
+            if full_step and index == cache_at:
+                self.cached_feature = sample
+
+            is_final_block = index == len(model.up_blocks) - 1
+            block_residuals = residuals[-len(block.resnets):]
+            residuals = residuals[:-len(block.resnets)]
+            upsample_size = residuals[-1].shape[2:] if not is_final_block and forward_upsample_size else None
+            sample = self._call_block(
+                block, sample, emb, encoder_hidden_states, cross_attention_kwargs,
+                res_hidden_states_tuple=block_residuals,
+                upsample_size=upsample_size,
+            )
+
+        if model.conv_norm_out is not None:
+            sample = model.conv_act(model.conv_norm_out(sample))
+        sample = model.conv_out(sample)
+
+        (self.full_times if full_step else self.shallow_times).append(time.time() - start_time)
+        self.step += 1
+
+        if not return_dict:
+            return (sample,)
+        from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+        return UNet2DConditionOutput(sample=sample)
+
+    def report(self):
+        """フル/浅い分岐のステップ時間を表示"""
+        def average(times):
+            return sum(times) / len(times) if times else 0
+
+        print(f"🧊 特徴キャッシュ: {self.interval}ステップごとに再計算 "
+              f"(フル: {len(self.full_times)}回 平均{average(self.full_times):.2f}秒, "
+              f"浅い分岐: {len(self.shallow_times)}回 平均{average(self.shallow_times):.2f}秒)")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - ディスプレイドライバー
+Inky (UC8159) 実機 / ファイル出力 / メモリ保持 を同じインターフェースで扱い、パネルなしでも表示処理を実行する
+"""
+
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from epaper_render import blend_palette, unpack_4bit
+from telemetry import TRACER
+
+# 設定すると config.json の display.driver より優先（例: AIPHOTOFRAME_DISPLAY=memory）
+DISPLAY_ENV = "AIPHOTOFRAME_DISPLAY"
+
+# UC8159のSPIクロック（inkyの設定値）と、実測のリフレッシュ時間
+DEFAULT_SPI_HZ = 3000000
+DEFAULT_REFRESH_SECONDS = 30.0
+
+
+class DisplayDriver:
+    """ディスプレイドライバーの共通インターフェース"""
+
+    name = None
+
+    def __init__(self, resolution, options):
+        """
+        Args:
+            resolution (tuple): 表示解像度 (幅, 高さ)
+            options (dict): config.json の display セクション
+        """
+        self.resolution = tuple(resolution)
+        self.options = options
+
+    def show(self, framebuffer, busy_wait=True):
+        """
+        パック済みフレームバッファを転送してリフレッシュ
+
+        Args:
+            framebuffer (np.ndarray): 4bitパックのフレームバッファ
+            busy_wait (bool): リフレッシュの完了まで待つか
+        """
+        raise NotImplementedError
+
+
+class InkyDriver(DisplayDriver):
+    """SPI接続のInky (UC8159) パネル"""
+
+    name = "inky"
+
+    def __init__(self, resolution, options):
+        super().__init__(resolution, options)
+        from inky.inky_uc8159 import Inky
+
+        self.inky = Inky(
+            resolution=self.resolution,
+            cs_pin=8, dc_pin=25, reset_pin=17, busy_pin=24,
+            h_flip=options.get('h_flip', False),
+            v_flip=options.get('v_flip', False),
+        )
+        self.inky.set_border(self.inky.BLACK)
+
+    def show(self, framebuffer, busy_wait=True):
+        """
+        Inky.show() は内部バッファのパックからやり直すため、パック済みのデータを
+        SPI転送処理（Inky._update）に直接渡す（spidevがシーケンスを要求するためリストに変換）
+
+        Inky._update はリセット後のBUSY待ち・パネル設定の後にDTM1で画像データを転送し、
+        その後BUSYピンを待ちながらリフレッシュするため、DTM1の送信を spi_transfer、
+        それ以降を panel_refresh として計測する
+        """
+        from inky.inky_uc8159 import UC8159_DTM1
+
+        inky = self.inky
+        spans = []
+        original_send_command = inky.__dict__.get('_send_command')
+        class_send_command = inky._send_command
+
+        def timed_send_command(command, *args, **kwargs):
+            if command != UC8159_DTM1:
+                return class_send_command(command, *args, **kwargs)
+            spans.append(TRACER.start("spi_transfer", driver=self.name))
+            result = class_send_command(command, *args, **kwargs)
+            spans[-1].end()
+            spans.append(TRACER.start("panel_refresh", driver=self.name))
+            return result
+
+        inky._send_command = timed_send_command
+        try:
+            inky._update(framebuffer.tolist(), busy_wait=busy_wait)
+            if spans:
+                spans[-1].end()
+        finally:
+            if original_send_command is None:
+                del inky._send_command
+            else:
+                inky._send_command = original_send_command
+            # 例外で抜けた場合は未完了の区間を記録しない
+            if spans:
+                TRACER.discard(spans[-1])
+
+
+class EmulatedPanel(DisplayDriver):
+    """
+    実機のSPI転送時間とリフレッシュ中のBUSYを再現するパネルの代わり
+
+    busy_wait=False で返った場合も、次の show() は前回のリフレッシュ完了まで待つ
+    """
+
+    def __init__(self, resolution, options):
+        super().__init__(resolution, options)
+        self.spi_hz = options.get('spi_hz', DEFAULT_SPI_HZ)
+        self.refresh_seconds = options.get('refresh_seconds', DEFAULT_REFRESH_SECONDS)
+        self.busy_until = 0.0
+        self.updates = 0
+
+    def _write(self, framebuffer):
+        """転送されたフレームバッファを保存"""
+        raise NotImplementedError
+
+    def show(self, framebuffer, busy_wait=True):
+        # 前回のリフレッシュ中はBUSYのため転送できない
+        time.sleep(max(0.0, self.busy_until - time.monotonic()))
+
+        with TRACER.span("spi_transfer", driver=self.name):
+            transfer_seconds = framebuffer.nbytes * 8 / self.spi_hz if self.spi_hz else 0.0
+            deadline = time.monotonic() + transfer_seconds
+            self._write(framebuffer)
+            time.sleep(max(0.0, deadline - time.monotonic()))
+
+        self.updates += 1
+        self.busy_until = time.monotonic() + self.refresh_seconds
+        if busy_wait:
+            with TRACER.span("panel_refresh", driver=self.name):
+                time.sleep(self.refresh_seconds)
+
+
+class FileDriver(EmulatedPanel):
+    """転送されたフレームバッファをPNG（パレット色）または生データとして書き出す"""
+
+    name = "file"
+
+    def __init__(self, resolution, options):
+        super().__init__(resolution, options)
+        self.directory = options.get('sink_directory') or "display"
+        self.format = options.get('sink_format', "png")
+        self.palette = blend_palette(options.get('saturation', 0.5)).astype(np.uint8)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _write(self, framebuffer):
+        if self.format in ("raw", "both"):
+            self._replace(os.path.join(self.directory, "latest.fb"), framebuffer.tobytes())
+        if self.format in ("png", "both"):
+            indices = unpack_4bit(framebuffer, self.resolution)
+            path = os.path.join(self.directory, "latest.png")
+            # 表示結果を見る側が書き込み途中のファイルを読まないよう一時ファイル経由で置き換え
+            tmp_path = path + ".tmp"
+            Image.fromarray(self.palette[indices]).save(tmp_path, format="PNG")
+            os.replace(tmp_path, path)
+
+    @staticmethod
+    def _replace(path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+class MemoryDriver(EmulatedPanel):
+    """転送されたフレームバッファを直近の数枚だけメモリに保持（ベンチマーク・負荷試験用）"""
+
+    name = "memory"
+
+    def __init__(self, resolution, options):
+        super().__init__(resolution, options)
+        self.keep = options.get('memory_frames', 4)
+        self.frames = []
+
+    def _write(self, framebuffer):
+        self.frames.append(np.array(framebuffer, copy=True))
+        del self.frames[:-self.keep]
+
+
+DISPLAY_DRIVERS = {
+    driver.name: driver
+    for driver in (InkyDriver, FileDriver, MemoryDriver)
+}
+
+
+def create_display(options):
+    """
+    config.json の display.driver（環境変数 AIPHOTOFRAME_DISPLAY で上書き可）に対応するドライバーを生成
+
+    Args:
+        options (dict): display セクション
+
+    Returns:
+        DisplayDriver: 未知の名前の場合はInky実機
+    """
+    name = os.environ.get(DISPLAY_ENV) or options.get('driver', InkyDriver.name)
+    if name not in DISPLAY_DRIVERS:
+        print(f"⚠️ 不明なディスプレイドライバー: {name}（{InkyDriver.name} を使用します）")
+        name = InkyDriver.name
+    return DISPLAY_DRIVERS[name](options.get('resolution', (640, 400)), options)
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - e-paper描画
+Inky (UC8159) の7色パレットへの減色・ディザリングをNumPyで行い、4bitパックのフレームバッファを生成
+"""
+
+import glob
+import hashlib
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from output_writer import derived_paths
+from telemetry import TRACER
+
+# inky.inky_uc8159 と同じパレット（BLACK, WHITE, GREEN, BLUE, RED, YELLOW, ORANGE, CLEAN）
+DESATURATED_PALETTE = [
+    [0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255],
+    [255, 0, 0], [255, 255, 0], [255, 140, 0], [255, 255, 255],
+]
+SATURATED_PALETTE = [
+    [57, 48, 57], [255, 255, 255], [58, 91, 70], [61, 59, 94],
+    [156, 72, 75], [208, 190, 71], [177, 106, 73], [255, 255, 255],
+]
+
+# CLEAN（インデックス7）は表示色ではないため減色には使わない
+DISPLAY_COLOURS = 7
+
+DITHER_MODES = ("floyd-steinberg", "ordered", "none")
+
+# 画像の隣に保存するフレームバッファの拡張子（np.load の mmap_mode で読める .npy）
+SIDECAR_SUFFIX = ".fb.npy"
+
+# 8x8 Bayer行列（0-63）
+BAYER_8X8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32)
+
+
+def blend_palette(saturation):
+    """
+    Inky.set_image と同じ方法で彩度に応じてパレットを合成
+
+    Args:
+        saturation (float): 0.0（標準パレット）- 1.0（実測の彩度パレット）
+
+    Returns:
+        np.ndarray: (7, 3) のfloat32パレット
+    """
+    saturated = np.array(SATURATED_PALETTE[:DISPLAY_COLOURS], dtype=np.float32)
+    desaturated = np.array(DESATURATED_PALETTE[:DISPLAY_COLOURS], dtype=np.float32)
+    return saturated * saturation + desaturated * (1.0 - saturation)
+
+
+class PaletteQuantizer:
+    """3次元カラーLUTによる最近傍パレット色の検索とディザリング"""
+
+    def __init__(self, palette, lut_bits=5):
+        """
+        Args:
+            palette (np.ndarray): (N, 3) のパレット
+            lut_bits (int): LUTの各チャンネルのビット数（5で32x32x32）
+        """
+        self.palette = np.asarray(palette, dtype=np.float32)
+        self.shift = 8 - lut_bits
+        self.lut = self._build_lut(lut_bits)
+
+    def _build_lut(self, lut_bits):
+        """各LUTセルの中心色に最も近いパレット色のインデックスを事前計算"""
+        size = 1 << lut_bits
+        centers = (np.arange(size, dtype=np.float32) + 0.5) * (256 / size)
+        grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+        distances = ((grid - self.palette[None, :, :]) ** 2).sum(axis=-1)
+        return distances.argmin(axis=-1).astype(np.uint8).reshape(size, size, size)
+
+    def lookup(self, rgb):
+        """
+        RGB配列をパレットインデックスに変換（ディザリングなし）
+
+        Args:
+            rgb (np.ndarray): (..., 3) の0-255の値
+
+        Returns:
+            np.ndarray: (...) のuint8インデックス
+        """
+        q = np.clip(rgb, 0, 255).astype(np.uint8) >> self.shift
+        return self.lut[q[..., 0], q[..., 1], q[..., 2]]
+
+    def quantize(self, rgb, dither="floyd-steinberg"):
+        """
+        画像をパレットインデックスに変換
+
+        Args:
+            rgb (np.ndarray): (H, W, 3) のuint8画像
+            dither (str): floyd-steinberg / ordered / none
+
+        Returns:
+            np.ndarray: (H, W) のuint8インデックス
+        """
+        if dither == "ordered":
+            return self._ordered(rgb)
+        if dither == "floyd-steinberg":
+            return self._floyd_steinberg(rgb)
+        return self.lookup(rgb)
+
+    def _ordered(self, rgb, strength=64.0):
+        """Bayer行列のしきい値を加えてからLUTを引く（完全にベクトル化）"""
+        height, width = rgb.shape[:2]
+        threshold = (BAYER_8X8 + 0.5) / 64.0 - 0.5
+        tiled = np.tile(threshold, (height // 8 + 1, width // 8 + 1))[:height, :width]
+        return self.lookup(rgb.astype(np.float32) + tiled[..., None] * strength)
+
+    def _floyd_steinberg(self, rgb):
+        """
+        Floyd-Steinberg誤差拡散
+
+        画素(y, x)は左・左上・上・右上の画素にのみ依存するため、x + 2y が等しい画素は
+        互いに独立に処理できる。この斜めの波面ごとにまとめて処理し、ループ回数を
+        画素数から W + 2H 程度に減らしている。
+        """
+        height, width = rgb.shape[:2]
+        # 右・左・下方向への拡散先のために1画素ずつ余白を取る
+        work = np.zeros((height + 1, width + 2, 3), dtype=np.float32)
+        work[:height, 1:width + 1] = rgb
+        indices = np.empty((height, width), dtype=np.uint8)
+
+        for t in range(width + 2 * (height - 1)):
+            y_min = max(0, (t - width + 2) // 2)
+            y_max = min(height - 1, t // 2)
+            if y_min > y_max:
+                continue
+            ys = np.arange(y_min, y_max + 1)
+            xs = t - 2 * ys
+            px = xs + 1  # 余白込みの列
+
+            pixels = np.clip(work[ys, px], 0, 255)
+            index = self.lookup(pixels)
+            indices[ys, xs] = index
+            error = pixels - self.palette[index]
+
+            # 同じ文の中では拡散先が重複しないため、文ごとの加算で誤差が失われない
+            work[ys, px + 1] += error * (7 / 16)
+            work[ys + 1, px - 1] += error * (3 / 16)
+            work[ys + 1, px] += error * (5 / 16)
+            work[ys + 1, px + 1] += error * (1 / 16)
+
+        return indices
+
+
+def pack_4bit(indices):
+    """
+    パレットインデックスを1バイト2画素の4bitフレームバッファにパック（UC8159の転送形式）
+
+    Args:
+        indices (np.ndarray): (H, W) のuint8インデックス
+
+    Returns:
+        np.ndarray: (H * W / 2,) のuint8
+    """
+    flat = indices.reshape(-1)
+    return ((flat[0::2] << 4) & 0xF0) | (flat[1::2] & 0x0F)
+
+
+def unpack_4bit(framebuffer, resolution):
+    """
+    4bitフレームバッファをパレットインデックスに戻す（pack_4bit の逆変換）
+
+    Args:
+        framebuffer (np.ndarray): (H * W / 2,) のuint8
+        resolution (tuple): (幅, 高さ)
+
+    Returns:
+        np.ndarray: (H, W) のuint8インデックス
+    """
+    width, height = resolution
+    framebuffer = np.asarray(framebuffer, dtype=np.uint8)
+    indices = np.empty(framebuffer.size * 2, dtype=np.uint8)
+    indices[0::2] = framebuffer >> 4
+    indices[1::2] = framebuffer & 0x0F
+    return indices.reshape(height, width)
+
+
+class EpaperRenderer:
+    """リサイズ・減色・パックを行い、ディスプレイドライバーに渡すフレームバッファを生成"""
+
+    def __init__(self, resolution=(640, 400), saturation=0.5, dither="floyd-steinberg", h_flip=False, v_flip=False):
+        """
+        Args:
+            resolution (tuple): 表示解像度 (幅, 高さ)
+            saturation (float): パレットの彩度（Inky.set_image の既定値は0.5）
+            dither (str): floyd-steinberg / ordered / none
+            h_flip (bool): 上下反転（Inkyの h_flip と同じ意味）
+            v_flip (bool): 左右反転（Inkyの v_flip と同じ意味）
+        """
+        if dither not in DITHER_MODES:
+            print(f"⚠️ 不明なディザリング: {dither}（floyd-steinberg を使用します）")
+            dither = "floyd-steinberg"
+        self.resolution = tuple(resolution)
+        self.saturation = saturation
+        self.dither = dither
+        self.h_flip = h_flip
+        self.v_flip = v_flip
+        self.quantizer = PaletteQuantizer(blend_palette(saturation))
+
+    def render_indices(self, image):
+        """
+        画像をパネル解像度のパレットインデックスに変換
+
+        Args:
+            image (PIL.Image.Image): 表示する画像
+
+        Returns:
+            np.ndarray: (高さ, 幅) のuint8インデックス
+        """
+        image = image.convert("RGB")
+        if image.size != self.resolution:
+            image = image.resize(self.resolution)
+        return self.quantizer.quantize(np.asarray(image), self.dither)
+
+    def render(self, image):
+        """
+        画像をパックされたフレームバッファに変換
+
+        Args:
+            image (PIL.Image.Image): 表示する画像
+
+        Returns:
+            np.ndarray: 4bitパックのフレームバッファ
+        """
+        with TRACER.span("quantize", dither=self.dither):
+            indices = self.render_indices(image)
+            # Inky.show と同じ順序で反転を適用（パネルを初期化せずに生成できるよう設定値を使う）
+            if self.v_flip:
+                indices = np.fliplr(indices)
+            if self.h_flip:
+                indices = np.flipud(indices)
+            return pack_4bit(np.ascontiguousarray(indices))
+
+    def preview(self, image):
+        """減色結果をパレット色のRGB画像として返す（パネルなしでの確認用）"""
+        indices = self.render_indices(image)
+        return Image.fromarray(self.quantizer.palette[indices].astype(np.uint8))
+
+    def settings_key(self):
+        """フレームバッファの内容に影響する表示設定の文字列"""
+        return f"{self.resolution}|{self.saturation}|{self.dither}|{self.h_flip}|{self.v_flip}"
+
+    def sidecar_path(self, image_path):
+        """
+        画像と表示設定に対応するフレームバッファのサイドカーのパス
+
+        キーは画像ファイルの内容のハッシュと表示設定から作るため、画像の上書きや
+        設定変更の後に古いフレームバッファが使われることはない
+        """
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(self.settings_key().encode("utf-8"))
+        return f"{os.path.splitext(image_path)[0]}.{digest.hexdigest()[:16]}{SIDECAR_SUFFIX}"
+
+    def write_sidecar(self, image_path, image=None):
+        """
+        フレームバッファを生成して画像の隣に保存
+
+        Args:
+            image_path (str): 保存済みの画像のパス
+            image (PIL.Image.Image): 同じ画像のメモリ上のコピー（あればファイルを読み直さない）
+
+        Returns:
+            np.ndarray: 生成したフレームバッファ
+        """
+        path = self.sidecar_path(image_path)
+        if image is not None:
+            framebuffer = self.render(image)
+        else:
+            with self._open_source(image_path) as image:
+                framebuffer = self.render(image)
+
+        # 表示側が書き込み途中のファイルを読まないよう一時ファイル経由で置き換え
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, framebuffer)
+        os.replace(tmp_path, path)
+        return framebuffer
+
+    def load_or_render(self, image_path):
+        """
+        キャッシュ済みのフレームバッファをメモリマップで読み込み、なければ生成して保存
+
+        Returns:
+            tuple: (フレームバッファ, キャッシュから読み込んだ場合True)
+        """
+        path = self.sidecar_path(image_path)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r'), True
+
+        try:
+            return self.write_sidecar(image_path), False
+        except OSError as e:
+            # 書き込めない場所の画像（displayコマンドの任意パス等）はキャッシュせずに表示
+            print(f"⚠️ フレームバッファを保存できません: {e}")
+            with self._open_source(image_path) as image:
+                return self.render(image), False
+
+    def _open_source(self, image_path):
+        """
+        ディスクから減色する画像を開く
+
+        書き出しスレッドが作成した表示解像度のコピーがあればそれを使い、
+        元画像のデコードとリサイズを省く（サイドカーのキーは元画像の内容から作る）
+        """
+        display_path = derived_paths(image_path)["display"]
+        if os.path.exists(display_path):
+            image = Image.open(display_path)
+            if image.size == self.resolution:
+                return image
+            image.close()
+        return Image.open(image_path)
+
+
+def copy_sidecars(image_path, dest_path):
+    """
+    画像のフレームバッファのサイドカーを、同じ内容のコピー先の画像のものとしてコピー
+
+    サイドカーのキーは画像の内容と表示設定から作るため、ファイル名の画像部分だけを置き換える
+
+    Args:
+        image_path (str): コピー元の画像のパス
+        dest_path (str): 同じ内容をコピーした画像のパス
+
+    Returns:
+        int: コピーしたファイル数
+    """
+    source_stem = os.path.splitext(image_path)[0]
+    dest_stem = os.path.splitext(dest_path)[0]
+    copied = 0
+    for path in glob.glob(f"{glob.escape(source_stem)}.*{SIDECAR_SUFFIX}"):
+        target = dest_stem + path[len(source_stem):]
+        # 表示側が書き込み途中のファイルを読まないよう一時ファイル経由で置き換え
+        tmp_path = target + ".tmp"
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, target)
+            copied += 1
+        except OSError as e:
+            print(f"⚠️ フレームバッファのコピーエラー {path}: {e}")
+    return copied
+
+
+def remove_sidecars(image_path):
+    """
+    画像に対応するフレームバッファのサイドカーをすべて削除
+
+    Returns:
+        int: 削除したファイル数
+    """
+    pattern = f"{glob.escape(os.path.splitext(image_path)[0])}.*{SIDECAR_SUFFIX}"
+    removed = 0
+    for path in glob.glob(pattern):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            print(f"⚠️ ファイル削除エラー {path}: {e}")
+    return removed
+
+
+def main():
+    """減色速度の計測とプレビュー画像の出力（パネル不要）"""
+    if len(sys.argv) < 2:
+        print("使用方法: python epaper_render.py 画像パス [floyd-steinberg|ordered|none]")
+        return
+
+    image = Image.open(sys.argv[1])
+    dithers = sys.argv[2:] or list(DITHER_MODES)
+    for dither in dithers:
+        renderer = EpaperRenderer(dither=dither)
+        start_time = time.time()
+        framebuffer = renderer.render(image)
+        duration = time.time() - start_time
+        output_path = f"preview_{dither}.png"
+        renderer.preview(image).save(output_path)
+        print(f"{dither:<16} {duration * 1000:7.1f}ms  {framebuffer.nbytes} bytes  -> {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - フレームバッファ
+表示待ち画像を保持するディスク上のリングバッファ（再起動後も保持）
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+from epaper_render import copy_sidecars, remove_sidecars
+
+
+class FrameBuffer:
+    """表示可能な画像を固定数のスロットに保持するリングバッファ"""
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory, size=6):
+        """
+        Args:
+            directory (str): バッファの保存先ディレクトリ
+            size (int): 保持するフレーム数
+        """
+        self.directory = directory
+        self.size = max(1, size)
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        self.slots = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.directory, self.INDEX_FILE)
+
+    def _slot_path(self, slot, ext):
+        return os.path.join(self.directory, f"frame_{slot:02d}{ext}")
+
+    def _load_index(self):
+        """インデックスを読み込み、実ファイルが欠けたスロットは空として扱う"""
+        slots = [None] * self.size
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                saved = json.load(f).get("slots", [])
+        except FileNotFoundError:
+            return slots
+        except Exception as e:
+            print(f"⚠️ フレームバッファのインデックス読み込みエラー: {e}")
+            return slots
+
+        # サイズ変更後も既存フレームはできるだけ引き継ぐ
+        dropped = []
+        for entry in saved:
+            if entry is None or not os.path.exists(entry.get("path", "")):
+                continue
+            if entry["slot"] < self.size:
+                slots[entry["slot"]] = entry
+            else:
+                dropped.append(entry)
+
+        # 縮小で範囲外になったスロットの画像は二度と参照されないため削除
+        for entry in dropped:
+            try:
+                os.remove(entry["path"])
+            except OSError as e:
+                print(f"⚠️ ファイル削除エラー {entry['path']}: {e}")
+            remove_sidecars(entry["path"])
+        if dropped:
+            print(f"🧹 バッファサイズの縮小により{len(dropped)}フレームを削除しました")
+            self.slots = slots
+            self._save_index()
+        return slots
+
+    def _save_index(self):
+        """インデックスをアトミックに書き込み"""
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"slots": self.slots}, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._index_path())
+
+    def _writable_slot(self):
+        """空きスロット、なければ最も古く表示済みのスロットを返す"""
+        for slot, entry in enumerate(self.slots):
+            if entry is None:
+                return slot
+
+        shown = [entry for entry in self.slots if entry["shown_count"] > 0]
+        if not shown:
+            return None
+        return min(shown, key=lambda entry: entry["last_shown"])["slot"]
+
+    def has_capacity(self):
+        """未表示フレームを上書きせずに追加できるか"""
+        with self.lock:
+            return self._writable_slot() is not None
+
+    def unshown_count(self):
+        """未表示フレーム数"""
+        with self.lock:
+            return sum(1 for entry in self.slots if entry is not None and entry["shown_count"] == 0)
+
+    def add(self, image_path, prompt=None):
+        """
+        画像をバッファにコピーして登録
+
+        Args:
+            image_path (str): 追加する画像のパス
+            prompt (str): 生成に使ったプロンプト
+
+        Returns:
+            str|None: バッファ内のパス、空きがない場合はNone
+        """
+        with self.lock:
+            slot = self._writable_slot()
+            if slot is None:
+                return None
+
+            old_entry = self.slots[slot]
+            ext = os.path.splitext(image_path)[1] or ".png"
+            dest_path = self._slot_path(slot, ext)
+
+            # 上書きするスロットの古いフレームバッファは二度と使われないため削除
+            # （同じスロット名で新しいフレームバッファをコピーするため、コピーより先に消す）
+            if old_entry is not None:
+                remove_sidecars(old_entry["path"])
+
+            # 書き込み途中のファイルを表示しないよう一時ファイル経由で置き換え
+            tmp_path = dest_path + ".tmp"
+            shutil.copyfile(image_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+            # 生成時に作った減色済みのフレームバッファも一緒に移し、表示時に減色し直さない
+            copy_sidecars(image_path, dest_path)
+
+            if old_entry is not None and old_entry["path"] != dest_path and os.path.exists(old_entry["path"]):
+                os.remove(old_entry["path"])
+
+            self.slots[slot] = {
+                "slot": slot,
+                "path": dest_path,
+                "source": image_path,
+                "prompt": prompt,
+                "created_at": time.time(),
+                "shown_count": 0,
+                "last_shown": 0,
+            }
+            self._save_index()
+            return dest_path
+
+    def next_frame(self):
+        """
+        次に表示するフレームを取り出して表示済みにする
+
+        未表示フレームがあれば最も古いものを、なければ最も長く表示されていない
+        フレームを返すため、生成が遅れても同じ画像が表示され続けることはない
+
+        Returns:
+            dict|None: フレーム情報、バッファが空の場合はNone
+        """
+        with self.lock:
+            entries = [entry for entry in self.slots if entry is not None]
+            if not entries:
+                return None
+
+            unshown = [entry for entry in entries if entry["shown_count"] == 0]
+            if unshown:
+                entry = min(unshown, key=lambda e: e["created_at"])
+            else:
+                entry = min(entries, key=lambda e: e["last_shown"])
+
+            entry["shown_count"] += 1
+            entry["last_shown"] = time.time()
+            self._save_index()
+            return dict(entry)
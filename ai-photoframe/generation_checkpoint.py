@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 生成の途中保存と再開
+ステップ境界ごとに潜在表現・スケジューラーの状態・乱数状態を保存し、停止や再起動の後に続きから生成する
+"""
+
+import os
+import threading
+
+import torch
+
+CHECKPOINT_FILE = "generation.pt"
+
+# 同じチェックポイントからの再開がこの回数失敗したら（再開するたびにOOM等）破棄する
+MAX_RESUME_ATTEMPTS = 3
+
+# 途中からの再開を確認済みのスケジューラー（ステップの位置をタイムステップ列の検索で求め、
+# ステップ間の状態がすべてインスタンス属性にあるもの）
+RESUMABLE_SCHEDULERS = (
+    "PNDMScheduler",
+    "DDIMScheduler",
+    "EulerDiscreteScheduler",
+    "EulerAncestralDiscreteScheduler",
+    "DPMSolverMultistepScheduler",
+    "LCMScheduler",
+)
+
+
+class GenerationCheckpoint:
+    """実行中の1件の生成の途中状態をディスクに保持"""
+
+    def __init__(self, directory, interval=1):
+        """
+        Args:
+            directory (str): チェックポイントの保存先ディレクトリ
+            interval (int): 何ステップごとに保存するか
+        """
+        self.directory = os.path.expanduser(directory)
+        self.interval = max(1, interval)
+        self.job = None
+        # ディスク上のチェックポイントの生成の保存先（begin 後・最初の保存前は前の生成のものが残る）
+        self.saved_output_path = None
+        # 書き出しスレッドからの完了通知と次の生成の保存が重ならないようにする
+        self.lock = threading.RLock()
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self):
+        return os.path.join(self.directory, CHECKPOINT_FILE)
+
+    def begin(self, job):
+        """
+        新しい生成の保存を開始（前の生成のチェックポイントは最初の保存で置き換わる）
+
+        Args:
+            job (dict): 再開に必要なジョブ情報（prompt, seed, profile, output_path 等）
+        """
+        with self.lock:
+            self.job = dict(job)
+
+    def save(self, timestep_index, latents, scheduler, generator, guidance_truncated_at=None):
+        """
+        ステップ完了時の状態を保存（interval ステップごと）
+
+        Args:
+            timestep_index (int): 処理済みのタイムステップ数
+            latents (torch.Tensor): このステップ後の潜在表現
+            scheduler (SchedulerMixin): マルチステップ法の履歴等を持つスケジューラー
+            generator (torch.Generator): 確率的サンプラーが使う乱数生成器
+            guidance_truncated_at (int): ガイダンスを打ち切ったステップ（未打ち切りはNone）
+        """
+        with self.lock:
+            if self.job is None or timestep_index % self.interval != 0:
+                return
+
+            state = {
+                "job": self.job,
+                "timestep_index": timestep_index,
+                "latents": latents.detach().clone(),
+                "scheduler": scheduler_state(scheduler),
+                "generator_state": generator.get_state(),
+                "guidance_truncated_at": guidance_truncated_at,
+            }
+            # 保存中に停止しても前回のチェックポイントが壊れないよう一時ファイル経由で置き換え
+            path = self._path()
+            tmp_path = path + ".tmp"
+            torch.save(state, tmp_path)
+            os.replace(tmp_path, path)
+            self.saved_output_path = self.job.get("output_path")
+
+    def load(self):
+        """
+        保存済みのチェックポイントを読み込み
+
+        Returns:
+            dict|None: 状態（ない・読めない場合はNone）
+        """
+        path = self._path()
+        if not os.path.exists(path):
+            return None
+        try:
+            # スケジューラーの設定（FrozenDict）・numpy配列・乱数状態を含むため weights_only=False で読む
+            # （torch 2.6以降の既定の True では拒否される。自分で書き出したローカルのファイルのみ読む）
+            state = torch.load(path, map_location="cpu", weights_only=False)
+        except Exception as e:
+            # 原因を調べられるよう削除せずに退避し、次の生成の保存で上書きされないようにする
+            broken_path = path + ".broken"
+            print(f"⚠️ チェックポイントを読み込めないため再開しません（{broken_path} に退避）: "
+                  f"{type(e).__name__}: {e}")
+            os.replace(path, broken_path)
+            return None
+        with self.lock:
+            self.saved_output_path = state["job"].get("output_path")
+        return state
+
+    def pending(self):
+        """
+        再開待ちのチェックポイントを再開回数を数えて返す
+
+        Returns:
+            dict|None: 状態（ない場合・再開に失敗し続けている場合はNone）
+        """
+        state = self.load()
+        if state is None:
+            return None
+
+        attempts = state["job"].get("resume_attempts", 0) + 1
+        if attempts > MAX_RESUME_ATTEMPTS:
+            print(f"⚠️ チェックポイントからの再開が{MAX_RESUME_ATTEMPTS}回失敗したため破棄します")
+            self.clear()
+            return None
+
+        state["job"]["resume_attempts"] = attempts
+        path = self._path()
+        tmp_path = path + ".tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+        return state
+
+    def complete(self, output_path):
+        """
+        画像の書き出し完了時に、その生成のチェックポイントを削除
+
+        書き出しを待たずに次の生成が始まっている場合は、次の生成のチェックポイントを残す
+        （次の生成の最初の保存前であれば、ディスク上に残っている完了済みの生成のものは削除する）
+
+        Args:
+            output_path (str): 書き出しが完了した画像のパス
+        """
+        with self.lock:
+            if self.job is not None and self.job.get("output_path") == output_path:
+                self.job = None
+            if self.saved_output_path == output_path:
+                self._remove_files()
+
+    def clear(self):
+        """チェックポイントを削除"""
+        with self.lock:
+            self.job = None
+            self._remove_files()
+
+    def _remove_files(self):
+        self.saved_output_path = None
+        for path in (self._path(), self._path() + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def resumable(scheduler):
+    """スケジューラーが保存したステップの続きから再開できるか"""
+    return type(scheduler).__name__ in RESUMABLE_SCHEDULERS
+
+
+def scheduler_state(scheduler):
+    """
+    スケジューラーのステップ間で変わる状態（マルチステップ法の履歴・カウンター等）
+
+    タイムステップ列は set_timesteps で同じものが再計算されるため保存しない
+    """
+    return {
+        name: value for name, value in scheduler.__dict__.items()
+        if name not in ("timesteps", "set_timesteps") and not callable(value)
+    }
+
+
+class ResumeDenoising:
+    """
+    パイプラインの実行中だけ初期潜在表現とタイムステップ列を差し替え、保存したステップの続きから実行する
+
+    set_timesteps は状態を初期化するため、呼ばれた直後に保存した状態を戻し、
+    パイプラインのループには処理済みを除いたタイムステップ列を渡す。
+    Euler等はステップの位置をタイムステップ列の検索で求めて sigmas を引くため、
+    スケジューラー自身の呼び出しの前には元のタイムステップ列に戻す。
+    """
+
+    def __init__(self, pipe, state):
+        """
+        Args:
+            pipe (StableDiffusionPipeline): 実行するパイプライン
+            state (dict): GenerationCheckpoint.load() の戻り値
+        """
+        self.pipe = pipe
+        self.state = state
+        self.timesteps = None
+
+    def __enter__(self):
+        scheduler = self.pipe.scheduler
+        original_set_timesteps = scheduler.set_timesteps
+        state = self.state
+
+        def set_timesteps(*args, **kwargs):
+            original_set_timesteps(*args, **kwargs)
+            scheduler.__dict__.update(state["scheduler"])
+            # パイプラインは set_timesteps の直後にループするタイムステップ列を読む
+            self.timesteps = scheduler.timesteps
+            scheduler.timesteps = scheduler.timesteps[state["timestep_index"]:]
+
+        def with_full_timesteps(method):
+            def wrapper(*args, **kwargs):
+                if self.timesteps is not None:
+                    scheduler.timesteps = self.timesteps
+                return method(*args, **kwargs)
+            return wrapper
+
+        def prepare_latents(*args, **kwargs):
+            return state["latents"].to(self.pipe.unet.dtype)
+
+        scheduler.set_timesteps = set_timesteps
+        scheduler.scale_model_input = with_full_timesteps(scheduler.scale_model_input)
+        scheduler.step = with_full_timesteps(scheduler.step)
+        self.pipe.prepare_latents = prepare_latents
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # インスタンス属性を消してクラスのメソッドに戻す
+        scheduler = self.pipe.scheduler
+        del scheduler.set_timesteps
+        del scheduler.scale_model_input
+        del scheduler.step
+        if self.timesteps is not None:
+            scheduler.timesteps = self.timesteps
+        del self.pipe.prepare_latents
+        return False
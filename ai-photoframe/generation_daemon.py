@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 常駐生成デーモン
+読み込み済みのモデルとe-paperディスプレイを1プロセスで保持し、Unixソケット経由でジョブを受け付ける
+"""
+
+import itertools
+import json
+import os
+import queue
+import random
+import signal
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+from telemetry import TRACER
+
+# 値が小さいほど先に処理（CLIからの依頼は連続実行のローテーションより優先）
+PRIORITY_CLIENT = 0
+PRIORITY_ROTATION = 10
+
+# 進行状況以外のイベントで、これを受け取るとジョブの応答が終わる
+FINAL_EVENTS = ("done", "failed", "cancelled", "error")
+
+
+class DaemonJob:
+    """生成または表示のジョブと、クライアントに返すイベントのキュー"""
+
+    _sequence = itertools.count()
+
+    def __init__(self, action, priority, prompt=None, profile=None, path=None, display=True, source="client",
+                 seed=None, resume=None):
+        """
+        Args:
+            action (str): generate / display
+            priority (int): PRIORITY_CLIENT / PRIORITY_ROTATION
+            prompt (str): 生成する画像の説明（generate）
+            profile (str): 生成プロファイル名（Noneの場合は生成器のデフォルト）
+            path (str): 表示する画像のパス（display）
+            display (bool): 生成後に表示するか（generate）
+            source (str): client / rotation / resume
+            seed (int): 乱数シード（generate。指定すると生成済みの同じ条件の画像を再利用）
+            resume (dict): 続きから生成するチェックポイント（resume）
+        """
+        self.action = action
+        self.priority = priority
+        self.prompt = prompt
+        self.profile = profile
+        self.path = path
+        self.display = display
+        self.source = source
+        self.seed = seed
+        self.resume = resume
+        # 同じ優先度では受け付けた順に処理
+        self.order = next(self._sequence)
+        self.cancel_event = threading.Event()
+        self.events = queue.Queue()
+
+    def __lt__(self, other):
+        return (self.priority, self.order) < (other.priority, other.order)
+
+    def emit(self, event, **fields):
+        """クライアントにイベントを送る（ローテーションのジョブは受け手がいないため破棄）"""
+        if self.source == "client":
+            self.events.put(dict(fields, event=event))
+
+    def describe(self):
+        if self.action == "display":
+            return f"表示: {self.path}"
+        return f"生成: '{self.prompt}'"
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """1接続で1リクエスト（JSON 1行）を受け取り、イベントをJSON Linesで返す"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError as e:
+            self._send({"event": "error", "message": f"不正なリクエスト: {e}"})
+            return
+
+        try:
+            job = self.server.generation_daemon.submit(request)
+        except ValueError as e:
+            self._send({"event": "error", "message": f"不正なリクエスト: {e}"})
+            return
+        if job is None:
+            self._send(dict(self.server.generation_daemon.status(), event="status"))
+            return
+
+        while True:
+            event = job.events.get()
+            if not self._send(event):
+                # クライアントが切断してもジョブは最後まで処理する
+                return
+            if event["event"] in FINAL_EVENTS:
+                return
+
+    def _send(self, event):
+        try:
+            self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode('utf-8'))
+            self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class GenerationDaemon:
+    """生成ワーカー・表示ワーカー・ソケットサーバーで構成される常駐プロセス"""
+
+    def __init__(self, photoframe, socket_path, rotation=True, preempt_rotation=True):
+        """
+        Args:
+            photoframe (AIPhotoFrame): 生成・表示を行うフォトフレーム
+            socket_path (str): ジョブを受け付けるUnixソケットのパス
+            rotation (bool): 依頼がない間は連続実行のプロンプトから生成し続けるか
+            preempt_rotation (bool): 依頼を受けたら生成中のローテーションをステップ境界で中断するか
+        """
+        self.photoframe = photoframe
+        self.socket_path = socket_path
+        self.rotation = rotation
+        self.preempt_rotation = preempt_rotation
+        self.prompts = photoframe.config['continuous_mode']['prompts']
+
+        self.generation_queue = queue.PriorityQueue()
+        self.display_queue = queue.PriorityQueue()
+        self.stop_event = threading.Event()
+        self.current_job = None
+        self.current_lock = threading.Lock()
+        self.completed_count = 0
+        self.server = None
+
+    def submit(self, request):
+        """
+        リクエストをジョブとしてキューに追加
+
+        Args:
+            request (dict): {"action": "generate"|"display"|"status", ...}
+
+        Returns:
+            DaemonJob|None: status の場合はNone
+
+        Raises:
+            ValueError: 不明な action・必須の項目がないリクエスト
+        """
+        if not isinstance(request, dict):
+            raise ValueError("JSONオブジェクトではありません")
+        action = request.get("action")
+        if action == "status":
+            return None
+
+        if action == "display":
+            if not request.get("path"):
+                raise ValueError("display には path が必要です")
+            job = DaemonJob("display", PRIORITY_CLIENT, path=request.get("path"))
+            self.display_queue.put(job)
+            job.emit("queued", position=self.display_queue.qsize())
+            return job
+
+        if action != "generate":
+            raise ValueError(f"不明な action: {action}")
+        prompt = request.get("prompt")
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("generate には空でない prompt が必要です")
+        job = DaemonJob(
+            "generate", PRIORITY_CLIENT,
+            prompt=prompt,
+            profile=request.get("profile"),
+            display=request.get("display", True),
+            seed=request.get("seed"),
+        )
+        self.generation_queue.put(job)
+        job.emit("queued", position=self.generation_queue.qsize())
+        print(f"📨 ジョブを受け付けました: {job.describe()} (待ち: {self.generation_queue.qsize()}件)")
+
+        with self.current_lock:
+            current = self.current_job
+        if self.preempt_rotation and current is not None and current.source == "rotation":
+            print("⏭️ ローテーションの生成を中断して依頼を優先します")
+            current.cancel_event.set()
+        return job
+
+    def status(self):
+        """キューと処理中のジョブの状態"""
+        with self.current_lock:
+            current = self.current_job
+        return {
+            "current": current.describe() if current else None,
+            "generation_queue": self.generation_queue.qsize(),
+            "display_queue": self.display_queue.qsize(),
+            "completed": self.completed_count,
+        }
+
+    def _next_generation_job(self):
+        """依頼があればそれを、なければ表示待ちが空のときだけローテーションのジョブを返す"""
+        try:
+            return self.generation_queue.get(timeout=1)
+        except queue.Empty:
+            pass
+
+        if not self.rotation or not self.display_queue.empty() or not self.prompts:
+            return None
+        return DaemonJob(
+            "generate", PRIORITY_ROTATION,
+            prompt=random.choice(self.prompts),
+            profile=self.photoframe.cycle_profile(),
+            source="rotation",
+            seed=self.photoframe.rotation_seed(),
+        )
+
+    def _generation_worker(self):
+        """ジョブを優先度順に取り出して生成し、表示ジョブを表示ワーカーに渡す"""
+        while not self.stop_event.is_set():
+            job = self._next_generation_job()
+            if job is None:
+                continue
+
+            with self.current_lock:
+                self.current_job = job
+            print(f"\n🔄 {job.describe()} ({job.source}) - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            job.emit("started")
+
+            def progress(step, total_steps):
+                job.emit("step", step=step + 1, total=total_steps)
+
+            mark = TRACER.mark()
+            start_time = time.time()
+            try:
+                result_path = self.photoframe.generate_and_display(
+                    job.prompt,
+                    display_immediately=False,
+                    cancel_event=job.cancel_event,
+                    profile=job.profile,
+                    callback=progress,
+                    seed=job.seed,
+                    resume=job.resume,
+                )
+            except Exception as e:
+                print(f"❌ ジョブ処理エラー: {e}")
+                job.emit("error", message=str(e))
+                self.stop_event.wait(30)
+                continue
+            finally:
+                with self.current_lock:
+                    self.current_job = None
+
+            if result_path is None:
+                if job.cancel_event.is_set():
+                    job.emit("cancelled")
+                    continue
+                job.emit("failed")
+                # ローテーションが失敗し続けても空回りしないよう少し待機
+                if job.source == "rotation":
+                    self.stop_event.wait(10)
+                continue
+
+            self.completed_count += 1
+            if not job.display:
+                # 依頼元はパスを受け取った時点でファイルを使えるものとするため、書き出しの完了を待って通知
+                if not self.photoframe.wait_for_output(result_path):
+                    job.emit("failed")
+                    continue
+                job.emit("done", path=result_path)
+                continue
+
+            job.path = result_path
+            job.emit("generated", path=result_path)
+            self.display_queue.put(job)
+            if job.source == "rotation":
+                # 連続実行と同じく、ローテーションの生成ごとにスレッド数・間隔を調整
+                self.photoframe.pace_cycle(mark, 1, time.time() - start_time, self.stop_event)
+
+    def _display_worker(self):
+        """表示ジョブを優先度順に表示（パネルのリフレッシュ中も次の生成は進む）"""
+        while not self.stop_event.is_set():
+            try:
+                job = self.display_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            job.emit("displaying", path=job.path)
+            if self.photoframe.display_image(job.path):
+                job.emit("done", path=job.path)
+            else:
+                job.emit("failed", path=job.path)
+            self.photoframe._cleanup_old_images()
+
+    def _signal_handler(self, signum, frame):
+        """シグナルハンドラー（生成中のジョブを中断して終了）"""
+        print(f"\n🛑 シグナル {signum} を受信しました。デーモンを停止します...")
+        self.stop_event.set()
+        with self.current_lock:
+            if self.current_job is not None:
+                self.current_job.cancel_event.set()
+
+    def _bind(self):
+        """ソケットを作成（前回の異常終了で残ったソケットファイルは削除）"""
+        if os.path.exists(self.socket_path):
+            if daemon_running(self.socket_path):
+                raise RuntimeError(f"デーモンは既に起動しています: {self.socket_path}")
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+
+        server = _DaemonServer(self.socket_path, _RequestHandler)
+        server.generation_daemon = self
+        return server
+
+    def run(self):
+        """モデルを読み込んでジョブの受け付けを開始し、停止要求まで待機"""
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+
+        print("=== AI Photo Frame - 常駐生成デーモン開始 ===")
+        generator = self.photoframe.generator
+        if not generator.load_model():
+            print("❌ モデルの読み込みに失敗したため終了します")
+            return
+        generator.prepare_prompts(self.prompts)
+
+        # 前回の停止で中断した生成は、次の生成がチェックポイントを上書きする前に最初に処理する
+        resume = self.photoframe.pending_resume()
+        if resume is not None:
+            self.generation_queue.put(DaemonJob(
+                "generate", PRIORITY_CLIENT,
+                prompt=resume["job"]["prompt"],
+                profile=resume["job"]["profile"],
+                display=resume["job"].get("display", True),
+                source="resume",
+                resume=resume,
+            ))
+
+        self.server = self._bind()
+        print(f"🔌 ジョブ受付: {self.socket_path}")
+        print(f"ローテーション: {'有効' if self.rotation else '無効'}"
+              f"{'（依頼時は中断して優先）' if self.rotation and self.preempt_rotation else ''}")
+
+        self.photoframe.running = True
+        workers = [
+            threading.Thread(target=self.server.serve_forever, name="daemon-server", daemon=True),
+            threading.Thread(target=self._generation_worker, name="generation-worker"),
+            threading.Thread(target=self._display_worker, name="display-worker"),
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            # メインスレッドはシグナル受信のためタイムアウト付きで待機
+            while not self.stop_event.wait(1):
+                pass
+        finally:
+            self.stop_event.set()
+            self.server.shutdown()
+            self.server.server_close()
+            for worker in workers[1:]:
+                worker.join()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.photoframe.running = False
+            print(f"\n🏁 常駐生成デーモンを終了しました（処理済み: {self.completed_count}件）")
+
+
+def daemon_running(socket_path):
+    """ソケットに接続できる（デーモンが起動している）か"""
+    if not os.path.exists(socket_path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+            return True
+        except OSError:
+            return False
+
+
+def request_daemon(socket_path, request):
+    """
+    デーモンにリクエストを送り、返ってくるイベントを順に返す
+
+    Args:
+        socket_path (str): デーモンのUnixソケットのパス
+        request (dict): {"action": "generate"|"display"|"status", ...}
+
+    Yields:
+        dict: イベント（"event" キーに種類）
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode('utf-8'))
+        with client.makefile('r', encoding='utf-8') as stream:
+            for line in stream:
+                yield json.loads(line)
+
+
+def run_client(socket_path, request):
+    """
+    デーモンにジョブを依頼し、進行状況を表示しながら完了を待つ
+
+    Returns:
+        dict|None: 最後に受け取ったイベント（接続できない場合はNone）
+    """
+    start_time = time.time()
+    last_event = None
+    try:
+        for event in request_daemon(socket_path, request):
+            last_event = event
+            kind = event["event"]
+            if kind == "queued":
+                print(f"📨 デーモンにジョブを送信しました（待ち順: {event['position']}）")
+            elif kind == "started":
+                print("🎨 画像生成を開始...")
+            elif kind == "step":
+                print(f"📊 Step {event['step']:2d}/{event['total']} | 経過: {time.time() - start_time:.0f}秒")
+            elif kind == "generated":
+                print(f"🖼️  生成完了: {event['path']}")
+            elif kind == "displaying":
+                print("📺 e-paperディスプレイに表示中...")
+            elif kind == "error":
+                print(f"❌ デーモンがリクエストを受け付けませんでした: {event.get('message')}")
+            elif kind == "status":
+                print(f"処理中: {event['current'] or 'なし'} | 生成待ち: {event['generation_queue']}件 | "
+                      f"表示待ち: {event['display_queue']}件 | 処理済み: {event['completed']}件")
+    except OSError as e:
+        if last_event is None:
+            return None
+        print(f"⚠️ デーモンとの接続が切れました: {e}")
+    return last_event
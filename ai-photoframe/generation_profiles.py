@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 生成プロファイル
+スケジューラー・ステップ数・ガイダンス・解像度の組み合わせに名前を付けて切り替える
+"""
+
+from datetime import datetime
+
+# quality は従来の固定設定（パイプライン標準スケジューラー、20ステップ、CFG 7.5）と同じ
+DEFAULT_PROFILES = {
+    "quality": {
+        "scheduler": "default",
+        "steps": 20,
+        "guidance_scale": 7.5,
+        "guidance_cutoff": 1.0,
+        "width": 640,
+        "height": 400,
+    },
+    "balanced": {
+        "scheduler": "dpmpp",
+        "steps": 12,
+        "guidance_scale": 7.0,
+        "guidance_cutoff": 1.0,
+        "width": 640,
+        "height": 400,
+    },
+    "fast": {
+        "scheduler": "dpmpp",
+        "steps": 8,
+        "guidance_scale": 6.0,
+        # 後半40%のステップはガイダンスなし（UNetをバッチ1で実行）
+        "guidance_cutoff": 0.6,
+        # 深い特徴は3ステップごとに再計算し、間は最も浅い分岐のみ実行
+        "deep_cache_interval": 3,
+        "deep_cache_branch": 0,
+        # generator.decoder.tiny_path の小型デコーダーでデコード
+        "decoder": "tiny",
+        "width": 512,
+        "height": 320,
+    },
+}
+
+DEFAULT_PROFILE = "quality"
+
+# スケジューラー名 -> (diffusersのクラス名, from_configに渡す追加設定)
+SCHEDULERS = {
+    "dpmpp": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "use_karras_sigmas": True}),
+    "euler_a": ("EulerAncestralDiscreteScheduler", {}),
+    "euler": ("EulerDiscreteScheduler", {}),
+    "ddim": ("DDIMScheduler", {}),
+    # LCM蒸留済みモデル（またはLCM-LoRA）向け。通常のモデルでは2-8ステップでは破綻する
+    "lcm": ("LCMScheduler", {}),
+}
+
+
+def create_scheduler(name, base_config):
+    """
+    名前に対応するスケジューラーを元のスケジューラー設定から生成
+
+    Args:
+        name (str): SCHEDULERS のキー
+        base_config: パイプライン標準スケジューラーの config
+
+    Returns:
+        SchedulerMixin: 生成したスケジューラー
+    """
+    import diffusers
+
+    if name not in SCHEDULERS:
+        raise ValueError(f"不明なスケジューラー: {name}")
+
+    class_name, options = SCHEDULERS[name]
+    scheduler_class = getattr(diffusers, class_name, None)
+    if scheduler_class is None:
+        raise ValueError(f"インストール済みのdiffusersは {class_name} に対応していません")
+    return scheduler_class.from_config(base_config, **options)
+
+
+def load_profiles(config):
+    """
+    組み込みプロファイルに config.json の generator.profiles を上書きしたものを返す
+
+    Args:
+        config (dict): config.json の generator セクション
+
+    Returns:
+        dict: プロファイル名 -> 設定
+    """
+    profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+    for name, overrides in config.get('profiles', {}).items():
+        profiles[name] = dict(profiles.get(name, DEFAULT_PROFILES[DEFAULT_PROFILE]), **overrides)
+    return profiles
+
+
+class ProfileSelector:
+    """連続実行のサイクルごとに使うプロファイルを選択"""
+
+    def __init__(self, schedule):
+        """
+        Args:
+            schedule (dict): config.json の continuous_mode.profile_schedule
+                mode: "fixed"（生成器のデフォルト）/ "rotate" / "time_of_day"
+                rotation: rotate で順番に使うプロファイル名
+                time_of_day: [{"start": "HH:MM", "profile": 名前}, ...]
+        """
+        self.mode = schedule.get('mode', 'fixed')
+        self.rotation = schedule.get('rotation', [])
+        self.time_of_day = sorted(schedule.get('time_of_day', []), key=lambda entry: entry['start'])
+        self.index = 0
+
+    def next_profile(self, now=None):
+        """
+        次のサイクルのプロファイル名
+
+        Returns:
+            str|None: Noneの場合は生成器のデフォルトプロファイル
+        """
+        if self.mode == 'rotate' and self.rotation:
+            profile = self.rotation[self.index % len(self.rotation)]
+            self.index += 1
+            return profile
+
+        if self.mode == 'time_of_day' and self.time_of_day:
+            current = (now or datetime.now()).strftime("%H:%M")
+            # 現在時刻以前で最も遅い開始時刻の設定（なければ前日最後の設定）を使う
+            profile = self.time_of_day[-1]['profile']
+            for entry in self.time_of_day:
+                if entry['start'] <= current:
+                    profile = entry['profile']
+            return profile
+
+        return None
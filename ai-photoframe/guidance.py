@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - ガイダンス打ち切り
+後半のステップで classifier-free guidance を止め、UNetを条件付き側のバッチ1だけで実行する
+"""
+
+import os
+import time
+
+import torch
+
+
+class UNetForwardPatch:
+    """生成中だけUNetのforwardを差し替えるコンテキストマネージャーの基底クラス"""
+
+    def __init__(self, unet):
+        self.unet = unet
+
+    def __enter__(self):
+        # torch.compileのラッパーはforwardをインスタンス属性として持つため、それも含めて退避
+        self.instance_forward = self.unet.__dict__.get('forward')
+        self.original_forward = self.unet.forward
+        self.unet.forward = self._forward
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.instance_forward is not None:
+            self.unet.forward = self.instance_forward
+        else:
+            # インスタンス属性を消してクラスのforwardに戻す
+            del self.unet.forward
+        return False
+
+    def _forward(self, sample, timestep, *args, **kwargs):
+        raise NotImplementedError
+
+
+class GuidanceTruncation(UNetForwardPatch):
+    """
+    UNetのforwardを生成中だけ差し替え、打ち切り後は条件付き入力のみを計算する
+
+    パイプラインは [非条件, 条件] を連結したバッチでUNetを呼び、
+    uncond + scale * (cond - uncond) でノイズを合成する。打ち切り後は条件付き側の
+    出力を2つ並べて返すため、合成結果は条件付き予測そのものになる。
+    """
+
+    def __init__(self, unet, total_steps, cutoff=1.0, convergence_threshold=0.0):
+        """
+        Args:
+            unet (torch.nn.Module): パイプラインのUNet
+            total_steps (int): 推論ステップ数
+            cutoff (float): ガイダンスを適用するステップの割合（1.0で最後まで適用）
+            convergence_threshold (float): 条件付き・非条件の予測の相対差がこれを下回ったら打ち切り（0で無効）
+        """
+        super().__init__(unet)
+        self.cutoff_step = int(round(total_steps * cutoff))
+        self.convergence_threshold = convergence_threshold
+        self.step = 0
+        self.truncated = False
+        self.truncated_at = None
+        self.full_times = []
+        self.single_times = []
+
+    def _truncate(self, step):
+        if not self.truncated:
+            self.truncated = True
+            self.truncated_at = step
+
+    def _forward(self, sample, timestep, *args, **kwargs):
+        if self.step >= self.cutoff_step:
+            self._truncate(self.step)
+
+        start_time = time.time()
+        if self.truncated:
+            half = sample.shape[0] // 2
+            if torch.is_tensor(timestep) and timestep.dim() > 0 and timestep.shape[0] == sample.shape[0]:
+                timestep = timestep[half:]
+            kwargs['encoder_hidden_states'] = kwargs['encoder_hidden_states'][half:]
+            output = self.original_forward(sample[half:], timestep, *args, **kwargs)
+            noise_pred = output[0] if isinstance(output, tuple) else output.sample
+            noise_pred = torch.cat([noise_pred, noise_pred])
+            self.single_times.append(time.time() - start_time)
+        else:
+            output = self.original_forward(sample, timestep, *args, **kwargs)
+            noise_pred = output[0] if isinstance(output, tuple) else output.sample
+            self.full_times.append(time.time() - start_time)
+
+            if self.convergence_threshold > 0 and noise_pred.shape[0] % 2 == 0:
+                noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+                difference = (noise_pred_text - noise_pred_uncond).norm() / noise_pred_text.norm()
+                if difference.item() < self.convergence_threshold:
+                    # このステップまではガイダンスを適用し、次のステップから打ち切る
+                    self._truncate(self.step + 1)
+
+        self.step += 1
+        if isinstance(output, tuple):
+            return (noise_pred,) + tuple(output[1:])
+        output.sample = noise_pred
+        return output
+
+    def summary(self):
+        """
+        ステップ時間の集計
+
+        Returns:
+            dict: 打ち切りステップと、バッチ2/バッチ1の平均ステップ時間
+        """
+        def average(times):
+            return sum(times) / len(times) if times else None
+
+        return {
+            "truncated_at": self.truncated_at,
+            "full_steps": len(self.full_times),
+            "single_steps": len(self.single_times),
+            "full_step_time": average(self.full_times),
+            "single_step_time": average(self.single_times),
+        }
+
+    def report(self):
+        """集計結果を表示"""
+        result = self.summary()
+        if result["truncated_at"] is None:
+            print(f"🧭 ガイダンス: 全{result['full_steps']}ステップで適用")
+            return
+
+        print(f"🧭 ガイダンス: {result['truncated_at']}ステップで打ち切り "
+              f"(バッチ2: {result['full_steps']}回 平均{result['full_step_time'] or 0:.2f}秒, "
+              f"バッチ1: {result['single_steps']}回 平均{result['single_step_time'] or 0:.2f}秒)")
+
+
+def compare_guidance_cutoffs(generator, prompt, output_dir, cutoffs=(1.0, 0.8, 0.6, 0.4), seed=0, profile=None):
+    """
+    ガイダンス打ち切り位置ごとに同じプロンプト・シードで生成し、ステップ時間と画質を比較
+
+    Args:
+        generator (ImageGenerator): 画像生成器
+        prompt (str): 比較に使うプロンプト
+        output_dir (str): 比較画像の保存先
+        cutoffs (tuple): ガイダンスを適用するステップの割合（先頭が基準）
+        seed (int): 乱数シード
+        profile (str): 基準にする生成プロファイル名
+
+    Returns:
+        list: 打ち切り位置ごとの計測結果
+    """
+    from PIL import Image
+    from precision import image_similarity
+
+    base_name, base_settings = generator.resolve_profile(profile)
+    results = []
+    for cutoff in cutoffs:
+        print(f"\n=== ガイダンス打ち切り: {cutoff:.0%} ===")
+        name = f"{base_name}_guidance_{int(cutoff * 100)}"
+        # 比較用のプロファイルは生成中だけ追加し、同名の既存プロファイルがあれば元に戻す
+        original = generator.profiles.get(name)
+        generator.profiles[name] = dict(base_settings, guidance_cutoff=cutoff, guidance_convergence=0.0)
+        output_path = os.path.join(output_dir, f"guidance_{int(cutoff * 100)}.png")
+
+        start_time = time.time()
+        try:
+            success = generator.generate_image(prompt, output_path, seed=seed, profile=name)
+        finally:
+            if original is None:
+                del generator.profiles[name]
+            else:
+                generator.profiles[name] = original
+        duration = time.time() - start_time
+
+        if success:
+            results.append(dict(generator.backend.last_guidance_stats or {},
+                                cutoff=cutoff, duration=duration, output_path=output_path))
+
+    if not results:
+        return results
+
+    baseline = Image.open(results[0]["output_path"])
+    print("\n=== ガイダンス打ち切り比較 ===")
+    print(f"{'割合':>6} {'生成時間':>8} {'バッチ2/step':>12} {'バッチ1/step':>12} {'SSIM':>8}")
+    for result in results:
+        result["similarity"] = image_similarity(baseline, Image.open(result["output_path"]))
+        full = f"{result['full_step_time']:.2f}s" if result.get("full_step_time") else "-"
+        single = f"{result['single_step_time']:.2f}s" if result.get("single_step_time") else "-"
+        print(f"{result['cutoff']:>6.0%} {result['duration']:>7.0f}s {full:>12} {single:>12} {result['similarity']:>8.4f}")
+    return results
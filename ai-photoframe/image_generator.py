@@ -4,41 +4,138 @@ AI Photo Frame - Image Generator
 FastSD CPUベースの640x400画像生成機能
 """
 
-from diffusers import StableDiffusionPipeline
 import torch
 from time import time
 import os
+import random
 from PIL import Image
 import sys
+from prompt_cache import PromptEmbeddingCache
+from model_snapshot import ModelSnapshot
+from precision import PrecisionStore
+from inference_backends import create_backend
+from generation_profiles import DEFAULT_PROFILE, load_profiles
+from telemetry import TRACER, StepSpans, current_rss_mb
+from batch_planner import BatchPlanner
+from memory_governor import MemoryGovernor
+from generation_checkpoint import GenerationCheckpoint
+from result_cache import cache_key
+from output_writer import create_writer
+
+DEFAULT_MODEL_ID = "stabilityai/stable-diffusion-2-1-base"
+
+
+class GenerationCancelled(Exception):
+    """ステップ境界で生成が中断されたことを示す例外"""
+
 
 class ImageGenerator:
-    def __init__(self):
+    def __init__(self, config=None):
+        """
+        Args:
+            config (dict): config.json の内容（generator セクションを参照）
+        """
+        self.config = (config or {}).get('generator', {})
+        # 生成画像の書き出し（image.format の画質・圧縮、サムネイル・表示サイズのコピー）
+        self.output_writer = create_writer(config or {})
+        self.model_id = self.config.get('model_id', DEFAULT_MODEL_ID)
         self.pipe = None
         self.model_loaded = False
+
+        # freeze済みモデルスナップショット（存在すればHFキャッシュより優先して読み込み）
+        snapshot_config = self.config.get('snapshot', {})
+        self.snapshot = None
+        if snapshot_config.get('enabled', True):
+            self.snapshot = ModelSnapshot(
+                snapshot_config.get('directory', '~/.cache/ai-photoframe/snapshot'),
+                self.model_id,
+            )
+
+        # 精度モード（float32 / bfloat16 / int8）と変換済みコンポーネントの保存先
+        precision_config = self.config.get('precision', {})
+        self.precision = PrecisionStore(
+            precision_config.get('directory', '~/.cache/ai-photoframe/precision'),
+            self.model_id,
+            precision_config.get('mode', 'float32'),
+        )
+
+        # プロンプト埋め込みキャッシュ
+        cache_config = self.config.get('embedding_cache', {})
+        self.embedding_cache = None
+        if cache_config.get('enabled', True):
+            self.embedding_cache = PromptEmbeddingCache(
+                cache_config.get('directory', '~/.cache/ai-photoframe/prompt_embeds'),
+                self.model_id,
+                # int8 / bfloat16 のテキストエンコーダーの埋め込みを float32 と混同しない
+                self.precision.mode,
+            )
+        self.release_text_encoder_when_cached = cache_config.get('release_text_encoder', True)
+
+        # 生成プロファイル（スケジューラー・ステップ数・ガイダンス・解像度）
+        self.profiles = load_profiles(self.config)
+        self.default_profile = self.config.get('profile', DEFAULT_PROFILE)
+
+        # 推論バックエンド（torch / torch_compile / onnxruntime / openvino）
+        self.backend = create_backend(self, self.config.get('backend', {}))
+
+        # 生成の途中保存（停止・再起動後に続きから生成する）
+        checkpoint_config = self.config.get('checkpoint', {})
+        self.checkpoint = None
+        if checkpoint_config.get('enabled', True):
+            self.checkpoint = GenerationCheckpoint(
+                checkpoint_config.get('directory', '~/.cache/ai-photoframe/checkpoint'),
+                checkpoint_config.get('interval_steps', 1),
+            )
+
+        # バッチ生成の枚数（メモリ予算と解像度ごとの実測メモリから決定）
+        batch_config = self.config.get('batch', {})
+        self.batch_planner = BatchPlanner(
+            memory_budget_mb=batch_config.get('memory_budget_mb', 1536),
+            max_size=batch_config.get('max_size', 4),
+        )
+
+        # メモリガバナー（ステージごとのピークRSSから attention slicing・VAEのタイル分割・解放を決定）
+        memory_config = self.config.get('memory', {})
+        self.governor = None
+        if memory_config.get('enabled', True):
+            self.governor = MemoryGovernor(
+                budget_mb=memory_config.get('budget_mb'),
+                attention_slicing=memory_config.get('attention_slicing', 'auto'),
+            )
+
+        # 直近に成功した生成の条件（画像ストアへの記録用）
+        self.last_generation = None
         
+    def _model_source(self):
+        """読み込み元（freeze済みスナップショットがあればそのパス、なければモデルID）"""
+        if self.snapshot is not None and self.snapshot.is_ready():
+            return self.snapshot.directory
+        return self.model_id
+
+    def _load_kwargs(self, source):
+        """from_pretrainedに渡す共通オプション"""
+        kwargs = {
+            "torch_dtype": torch.float32,  # CPU互換性のためfloat32使用
+            "low_cpu_mem_usage": True,     # 重みを遅延配置し、余分なコピーを作らない
+        }
+        if source != self.model_id:
+            # スナップショットはsafetensorsをmmapで読み込み、HFキャッシュの解決も行わない
+            kwargs["use_safetensors"] = True
+            kwargs["local_files_only"] = True
+        return kwargs
+
     def load_model(self):
         """Stable Diffusionモデルを読み込み"""
         if self.model_loaded:
             return True
             
         try:
-            print("Stable Diffusionモデルを読み込み中...")
-            print("初回実行時はモデルのダウンロードに時間がかかります")
-            
-            # 軽量なモデルを使用
-            model_id = "stabilityai/stable-diffusion-2-1-base"
-            
-            # CPU最適化設定でパイプラインを読み込み
-            self.pipe = StableDiffusionPipeline.from_pretrained(
-                model_id,
-                torch_dtype=torch.float32,  # CPU互換性のためfloat32使用
-                safety_checker=None,        # 高速化のため安全チェッカーを無効
-                requires_safety_checker=False,
-            )
-            self.pipe = self.pipe.to("cpu")
-            
-            # メモリ効率の最適化
-            self.pipe.enable_attention_slicing()
+            print(f"Stable Diffusionモデルを読み込み中...（バックエンド: {self.backend.name}）")
+            with TRACER.span("model_load", backend=self.backend.name):
+                self.backend.load()
+            self.pipe = self.backend.pipe
+            if self.governor is not None:
+                self.governor.after_load(current_rss_mb())
             
             self.model_loaded = True
             print("✅ モデル読み込み完了！")
@@ -47,8 +144,132 @@ class ImageGenerator:
         except Exception as e:
             print(f"❌ モデル読み込みエラー: {e}")
             return False
+
+    def freeze_model(self):
+        """
+        バックエンドの高速起動用成果物（スナップショット・エクスポート）を書き出し
+
+        Returns:
+            bool: 書き出し成功時True
+        """
+        if not self.model_loaded:
+            if not self.load_model():
+                return False
+
+        try:
+            result = self.backend.freeze()
+            self.pipe = self.backend.pipe
+            return result
+
+        except Exception as e:
+            print(f"❌ スナップショット作成エラー: {e}")
+            return False
+
+    def set_num_threads(self, threads):
+        """
+        推論のスレッド数を変更（連続実行のペース配分用）
+
+        Args:
+            threads (int): torchの演算スレッド数
+        """
+        if torch.get_num_threads() != threads:
+            torch.set_num_threads(threads)
+
+    def release_text_encoder(self):
+        """テキストエンコーダーをメモリから解放"""
+        if self.backend.release_text_encoder():
+            print("🧹 テキストエンコーダーを解放しました（全プロンプトの埋め込みがキャッシュ済み）")
+
+    def encode_prompt(self, prompt):
+        """
+        プロンプトと空の非条件プロンプトの埋め込みを取得（キャッシュ優先）
+
+        Args:
+            prompt (str): 生成する画像の説明
+
+        Returns:
+            tuple: (prompt_embeds, negative_prompt_embeds)
+        """
+        if self.embedding_cache is not None:
+            with TRACER.span("text_encode", cached=True):
+                prompt_embeds = self.embedding_cache.get(prompt)
+                negative_prompt_embeds = self.embedding_cache.get("")
+            if prompt_embeds is not None and negative_prompt_embeds is not None:
+                return prompt_embeds, negative_prompt_embeds
+
+        with TRACER.span("text_encode", cached=False):
+            prompt_embeds, negative_prompt_embeds = self.backend.encode_prompt(prompt)
+
+        if self.embedding_cache is not None:
+            self.embedding_cache.put(prompt, prompt_embeds)
+            self.embedding_cache.put("", negative_prompt_embeds)
+
+        return prompt_embeds, negative_prompt_embeds
+
+    def prepare_prompts(self, prompts):
+        """
+        固定プロンプト一覧の埋め込みを事前にキャッシュし、不要になったテキストエンコーダーを解放
+
+        Args:
+            prompts (list): 連続実行で使用するプロンプト一覧
+
+        Returns:
+            bool: 準備成功時True
+        """
+        if self.embedding_cache is None:
+            return True
+
+        if not self.model_loaded:
+            if not self.load_model():
+                return False
+
+        missing = [prompt for prompt in prompts if not self.embedding_cache.contains(prompt)]
+        if missing:
+            print(f"プロンプト埋め込みをキャッシュ中: {len(missing)}/{len(prompts)}個")
+        for prompt in missing:
+            self.encode_prompt(prompt)
+
+        if self.release_text_encoder_when_cached:
+            self.release_text_encoder()
+        return True
     
-    def generate_image(self, prompt, output_path="generated_image.png", callback=None):
+    def resolve_profile(self, name=None):
+        """
+        プロファイル名を設定に解決
+
+        Args:
+            name (str): プロファイル名（Noneの場合はデフォルト）
+
+        Returns:
+            tuple: (プロファイル名, 設定)
+        """
+        name = name or self.default_profile
+        if name not in self.profiles:
+            print(f"⚠️ 不明な生成プロファイル: {name}（{DEFAULT_PROFILE} を使用します）")
+            name = DEFAULT_PROFILE
+        return name, self.profiles[name]
+
+    def result_key(self, prompt, seed, profile=None):
+        """
+        生成条件のキャッシュキー（モデル・精度・推論バックエンド・プロンプト・シード・プロファイルの設定）
+
+        Args:
+            prompt (str): 生成する画像の説明
+            seed (int): 乱数シード
+            profile (str): 生成プロファイル名（Noneの場合はデフォルト）
+
+        Returns:
+            str: result_cache.cache_key の戻り値
+        """
+        profile_name, settings = self.resolve_profile(profile)
+        # プロファイルで指定しない場合のデコード方法も画像に影響するため含める
+        # （小型デコーダーの重みがない場合等は実際に使われる方法を記録する）
+        decoder = settings.get('decoder', self.config.get('decoder', {}).get('mode', 'full'))
+        settings = dict(settings, decoder=self.backend.decode_mode(decoder))
+        return cache_key(self.model_id, self.precision.mode, self.backend.name, prompt, seed, profile_name, settings)
+
+    def generate_image(self, prompt, output_path="generated_image.png", callback=None, cancel_event=None, seed=None,
+                       profile=None, job=None, resume=None, wait_for_write=True, on_written=None):
         """
         画像を生成して保存
 
@@ -56,53 +277,303 @@ class ImageGenerator:
             prompt (str): 生成する画像の説明
             output_path (str): 保存先パス
             callback (callable): 進行状況コールバック関数
+            cancel_event (threading.Event): セットされると次のステップ境界で生成を中断
+            seed (int): 乱数シード（Noneの場合はランダム）
+            profile (str): 生成プロファイル名（Noneの場合はデフォルト）
+            job (dict): 再開時に必要な呼び出し側の情報（指定すると途中状態を保存する）
+            resume (dict): 続きから生成するチェックポイント（GenerationCheckpoint.pending() の戻り値）
+            wait_for_write (bool): Falseの場合は画像の書き出しを待たずに戻る（output_writer.wait で完了を待つ）
+            on_written (callable): 書き出し完了後に書き出しスレッドで呼ばれる on_written(path, image, generation)
 
         Returns:
-            bool: 生成成功時True
+            bool: 生成成功時True（条件は last_generation に記録）
         """
         if not self.model_loaded:
             if not self.load_model():
                 return False
         
+        steps = None
+        checkpoint = None
         try:
+            profile_name, settings = self.resolve_profile(profile)
+            total_steps = settings['steps']
+            # 同じ画像を再生成できるよう、ランダムの場合もシードを決めて記録する
+            if seed is None:
+                seed = random.randrange(2 ** 31)
+
+            # 途中保存するジョブの条件。再開時はモデル・プロファイルの設定が変わっていないことを確認する
+            checkpoint_job = {
+                "prompt": prompt,
+                "seed": seed,
+                "profile": profile_name,
+                "output_path": output_path,
+                "model_id": self.model_id,
+                "settings": settings,
+            }
+            if resume is not None:
+                saved = resume["job"]
+                if any(saved.get(key) != checkpoint_job[key] for key in ("prompt", "seed", "model_id", "settings")):
+                    print("⚠️ チェックポイントと生成条件が一致しないため最初から生成します")
+                    resume = None
+            checkpoint = None
+            if self.checkpoint is not None and job is not None:
+                checkpoint = self.checkpoint
+                checkpoint.begin(dict(job, **checkpoint_job))
             print(f"画像生成中: '{prompt}'")
-            print("Raspberry Pi CPUでは10-15分程度かかります...")
+            print(f"生成プロファイル: {profile_name} ({settings['scheduler']}, {total_steps}ステップ, "
+                  f"CFG {settings['guidance_scale']}, {settings['width']}x{settings['height']})")
 
-            # コールバック関数を定義
+            # コールバック関数を定義（コールバックの間隔を1ステップのUNet時間として記録）
             def step_callback(step, timestep, latents):
+                steps.lap(step=step)
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled()
                 if callback:
-                    callback(step, 20)  # 現在のstep、総step数
+                    callback(step, total_steps)  # 現在のstep、総step数
                 return {}
 
-            # 640x400サイズで画像生成
+            # プロファイルの解像度で画像生成（表示時に640x400へリサイズ）
             start_time = time()
-            image = self.pipe(
-                prompt,
-                num_inference_steps=20,      # バランスの取れたステップ数
-                guidance_scale=7.5,
-                height=400,                  # e-paperサイズに合わせて調整
-                width=640,
-                callback=step_callback,
-                callback_steps=1,            # 毎ステップでコールバック実行
-            ).images[0]
+            self.backend.set_scheduler(settings['scheduler'])
+            mark = TRACER.mark()
+            prompt_embeds, negative_prompt_embeds = self.encode_prompt(prompt)
+            options = self._apply_memory_plan(self._generation_options(settings))
+            baseline_rss = current_rss_mb()
+            steps = StepSpans(TRACER, "unet_step", "unet_denoise", profile=profile_name)
+            image = self.backend.generate(
+                prompt_embeds,
+                negative_prompt_embeds,
+                step_callback,
+                seed=seed,
+                checkpoint=checkpoint,
+                resume=resume,
+                **options,
+            )
             end_time = time()
+            self._record_batch_memory(steps, settings, 1, baseline_rss)
             
-            # 画像保存
-            image.save(output_path)
-            
+            if self.governor is not None:
+                self.governor.observe(TRACER.records(mark, current_thread=True))
+
             duration = end_time - start_time
+            key = self.result_key(prompt, seed, profile_name)
+            self.last_generation = {
+                "prompt": prompt,
+                "seed": seed,
+                "profile": profile_name,
+                "generation_time": duration,
+                "cache_key": key,
+            }
+
+            # 画像保存（キャッシュキーを埋め込み、インデックスを作り直しても再利用できるようにする）
+            written = on_written
+            if checkpoint is not None:
+                # 画像がディスクに書き終わるまではチェックポイントを残し、書き出し前に停止しても再開できるようにする
+                def written(path, written_image, generation):
+                    try:
+                        if on_written is not None:
+                            on_written(path, written_image, generation)
+                    finally:
+                        checkpoint.complete(path)
+
+            self._write_output(image, output_path, self.last_generation, written)
+            if wait_for_write and not self.output_writer.wait(output_path):
+                return False
             print(f"🎉 画像生成成功！")
             print(f"⏱️  生成時間: {duration:.1f}秒 ({duration/60:.1f}分)")
             print(f"🖼️  保存先: {os.path.abspath(output_path)}")
             
             return True
-            
+
+        except GenerationCancelled:
+            # チェックポイントは残し、次の起動時に続きから生成する
+            print("⏹️ 画像生成を中断しました")
+            return False
+
         except Exception as e:
             print(f"❌ 画像生成エラー: {e}")
             import traceback
             traceback.print_exc()
+            # チェックポイントは残す（再開し続けても失敗する場合は MAX_RESUME_ATTEMPTS で破棄される）
             return False
 
+        finally:
+            # デコード開始後に計測を始めた未完了のステップは破棄し、完了したステップの合計を記録
+            if steps is not None:
+                steps.finish()
+
+    def _write_output(self, image, output_path, generation, on_written=None):
+        """生成画像の書き出しを書き出しスレッドに依頼（メタデータ・派生画像も同じジョブで書く）"""
+        callback = None
+        if on_written is not None:
+            def callback(path, written_image):
+                on_written(path, written_image, generation)
+
+        metadata = {
+            "key": generation["cache_key"],
+            "prompt": generation["prompt"],
+            "seed": generation["seed"],
+            "profile": generation["profile"],
+        }
+        self.output_writer.submit(image, output_path, metadata, callback)
+
+    def _generation_options(self, settings):
+        """プロファイルの設定をバックエンドの generate / generate_batch の引数に変換"""
+        return {
+            "num_inference_steps": settings['steps'],
+            "guidance_scale": settings['guidance_scale'],
+            "guidance_cutoff": settings.get('guidance_cutoff', 1.0),
+            "guidance_convergence": settings.get('guidance_convergence', 0.0),
+            "deep_cache_interval": settings.get('deep_cache_interval', 0),
+            "deep_cache_branch": settings.get('deep_cache_branch', 0),
+            "decoder": settings.get('decoder', self.config.get('decoder', {}).get('mode', 'full')),
+            "height": settings['height'],
+            "width": settings['width'],
+        }
+
+    def _apply_memory_plan(self, options):
+        """
+        メモリガバナーの設定をバックエンドに反映（埋め込みの取得後・デノイズ前に呼ぶ）
+
+        Args:
+            options (dict): _generation_options の戻り値
+
+        Returns:
+            dict: デコード方法を差し替えた生成設定
+        """
+        if self.governor is None:
+            return options
+
+        self.backend.set_attention_slicing(self.governor.attention_slicing())
+        if self.governor.release_idle:
+            # デノイズ中に使わないコンポーネントを外し、次に必要になった時点で再読み込みする
+            released = [name for name, release in (("テキストエンコーダー", self.backend.release_text_encoder),
+                                                   ("VAE", self.backend.release_vae)) if release()]
+            if released:
+                print(f"🧹 メモリ節約のため解放: {', '.join(released)}")
+        # タイル分割はキャッシュキーに含めない（プロファイルのデコード方法と同じ画像になる）
+        return dict(options, decoder=self.governor.decoder_mode(options["decoder"]))
+
+    def _record_batch_memory(self, steps, settings, batch_size, baseline_rss):
+        """UNetのステップ中のピークRSSをバッチ枚数の決定に反映（ピークをリセットできた場合のみ）"""
+        records = steps.records
+        if baseline_rss is None or not records or not all(record["peak_is_stage_local"] for record in records):
+            return
+        self.batch_planner.record(settings, batch_size, baseline_rss, max(record["peak_rss_mb"] for record in records))
+
+    def generate_batch(self, prompts, output_paths, seeds=None, profile=None, callback=None, cancel_event=None,
+                       wait_for_write=True, on_written=None):
+        """
+        複数の画像をまとめて生成し1枚ずつ保存（1回に生成する枚数はメモリ予算から自動で決定）
+
+        Args:
+            prompts (list): 1枚ごとのプロンプト（同じプロンプトの繰り返しも可）
+            output_paths (list): 1枚ごとの保存先パス
+            seeds (list): 1枚ごとの乱数シード（Noneの要素はランダム）
+            profile (str): 生成プロファイル名（全画像で共通）
+            callback (callable): 進行状況コールバック関数 callback(step, total_steps)
+            cancel_event (threading.Event): セットされると次のステップ境界で生成を中断
+            wait_for_write (bool): Falseの場合は画像の書き出しを待たずに戻る
+            on_written (callable): 1枚の書き出し完了ごとに呼ばれる on_written(path, image, generation)
+
+        Returns:
+            list: 1枚ごとの生成条件（last_generation と同じ形式。生成できなかった画像はNone）
+        """
+        results = [None] * len(prompts)
+        if not self.model_loaded:
+            if not self.load_model():
+                return results
+
+        profile_name, settings = self.resolve_profile(profile)
+        seeds = [seed if seed is not None else random.randrange(2 ** 31) for seed in (seeds or [None] * len(prompts))]
+        self.backend.set_scheduler(settings['scheduler'])
+
+        start = 0
+        while start < len(prompts):
+            size = self.batch_planner.size_for(settings, len(prompts) - start)
+            indices = list(range(start, start + size))
+            start += size
+            try:
+                chunk = self._generate_chunk(
+                    [prompts[i] for i in indices], [output_paths[i] for i in indices], [seeds[i] for i in indices],
+                    profile_name, settings, callback, cancel_event, on_written,
+                )
+            except GenerationCancelled:
+                print("⏹️ バッチ生成を中断しました")
+                break
+            except Exception as e:
+                # メモリ不足等は残りのバッチでも起きやすいため打ち切る
+                print(f"❌ バッチ生成エラー: {e}")
+                import traceback
+                traceback.print_exc()
+                break
+            for i, result in zip(indices, chunk):
+                results[i] = result
+
+        if wait_for_write:
+            for i, output_path in enumerate(output_paths):
+                if results[i] is not None and not self.output_writer.wait(output_path):
+                    results[i] = None
+
+        if any(results):
+            self.last_generation = [result for result in results if result][-1]
+        return results
+
+    def _generate_chunk(self, prompts, output_paths, seeds, profile_name, settings, callback, cancel_event,
+                        on_written=None):
+        """1回のパイプライン呼び出しで生成して保存（generate_batch から呼ばれる）"""
+        total_steps = settings['steps']
+        print(f"バッチ画像生成中: {len(prompts)}枚 ({profile_name}, {total_steps}ステップ, "
+              f"{settings['width']}x{settings['height']})")
+        for prompt, seed in zip(prompts, seeds):
+            print(f"  - '{prompt}' (シード {seed})")
+
+        steps = None
+
+        def step_callback(step, timestep, latents):
+            steps.lap(step=step)
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled()
+            if callback:
+                callback(step, total_steps)
+            return {}
+
+        try:
+            start_time = time()
+            mark = TRACER.mark()
+            # 同じプロンプトの埋め込みは1回だけ取得する
+            embeds = {prompt: self.encode_prompt(prompt) for prompt in dict.fromkeys(prompts)}
+            prompt_embeds = torch.cat([embeds[prompt][0] for prompt in prompts])
+            negative_prompt_embeds = torch.cat([embeds[prompt][1] for prompt in prompts])
+
+            options = self._apply_memory_plan(self._generation_options(settings))
+            baseline_rss = current_rss_mb()
+            steps = StepSpans(TRACER, "unet_step", "unet_denoise", profile=profile_name, batch_size=len(prompts))
+            images = self.backend.generate_batch(prompt_embeds, negative_prompt_embeds, step_callback, seeds, **options)
+            duration = time() - start_time
+            self._record_batch_memory(steps, settings, len(prompts), baseline_rss)
+        finally:
+            if steps is not None:
+                steps.finish()
+
+        results = []
+        for image, prompt, seed, output_path in zip(images, prompts, seeds, output_paths):
+            result = {
+                "prompt": prompt,
+                "seed": seed,
+                "profile": profile_name,
+                # 1枚あたりの時間（バッチ全体の時間を枚数で割る）
+                "generation_time": duration / len(prompts),
+                "cache_key": self.result_key(prompt, seed, profile_name),
+            }
+            self._write_output(image, output_path, result, on_written)
+            results.append(result)
+        if self.governor is not None:
+            self.governor.observe(TRACER.records(mark, current_thread=True))
+        print(f"🎉 バッチ画像生成成功！ {len(prompts)}枚 / {duration:.1f}秒 "
+              f"(1枚あたり {duration / len(prompts):.1f}秒)")
+        return results
+
 def main():
     """テスト実行用のメイン関数"""
     print("=== AI Photo Frame - Image Generator Test ===")
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 生成画像ストア
+生成画像のメタデータをSQLiteのインデックスに記録し、一覧表示と保持ポリシーをインデックスだけで処理する
+"""
+
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+from output_writer import FORMATS, is_derived
+from result_cache import read_cache_key
+
+INDEX_FILE = "index.sqlite3"
+
+# 件数・合計サイズはトリガーで totals に反映し、保持判定で全件を数えないようにする
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL,
+    prompt TEXT,
+    seed INTEGER,
+    profile TEXT,
+    generation_time REAL,
+    file_size INTEGER NOT NULL,
+    cache_key TEXT
+);
+CREATE INDEX IF NOT EXISTS images_created_at ON images (created_at);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    count INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, count, bytes) VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS images_insert AFTER INSERT ON images BEGIN
+    UPDATE totals SET count = count + 1, bytes = bytes + NEW.file_size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS images_delete AFTER DELETE ON images BEGIN
+    UPDATE totals SET count = count - 1, bytes = bytes - OLD.file_size WHERE id = 0;
+END;
+"""
+
+
+class ImageStore:
+    """生成画像のインデックスと保持ポリシー（件数・合計サイズ・経過日数）"""
+
+    def __init__(self, directory, max_count=10, max_bytes=None, max_age_days=None):
+        """
+        Args:
+            directory (str): 生成画像の保存先ディレクトリ（インデックスもここに保存）
+            max_count (int): 保持する最大枚数（Noneの場合は無制限）
+            max_bytes (int): 保持する画像の合計サイズの上限（Noneの場合は無制限）
+            max_age_days (float): 保持する最大日数（Noneの場合は無制限）
+        """
+        self.directory = directory
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        # デーモンでは生成ワーカーと表示ワーカーの両方から使うため接続を共有してロックする
+        self.lock = threading.Lock()
+
+        is_new = not os.path.exists(self._index_path())
+        self.db = sqlite3.connect(self._index_path(), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        # 表示中のCLIからの読み取りと書き込みが互いを待たないようにする
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self._migrate()
+        if is_new:
+            self._import_existing()
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _migrate(self):
+        """生成結果キャッシュ導入前のインデックスにキーの列を追加"""
+        columns = [row["name"] for row in self.db.execute("PRAGMA table_info(images)")]
+        with self.db:
+            if "cache_key" not in columns:
+                self.db.execute("ALTER TABLE images ADD COLUMN cache_key TEXT")
+            self.db.execute("CREATE INDEX IF NOT EXISTS images_cache_key ON images (cache_key)")
+
+    def _import_existing(self):
+        """インデックス導入前に保存された画像を登録（初回のみ）"""
+        # サムネイル・表示サイズのコピーは元画像と一緒に削除するため登録しない
+        image_files = [path for path in glob.glob(os.path.join(self.directory, "ai_photo_*"))
+                       if os.path.splitext(path)[1].lower() in FORMATS and not is_derived(path)]
+        with self.lock, self.db:
+            for path in image_files:
+                stat = os.stat(path)
+                # キーを埋め込んだ画像はインデックスを作り直しても再利用できる
+                self.db.execute(
+                    "INSERT OR IGNORE INTO images (path, created_at, file_size, cache_key) VALUES (?, ?, ?, ?)",
+                    (path, stat.st_mtime, stat.st_size, read_cache_key(path)),
+                )
+        if image_files:
+            print(f"🗂️ 既存の画像{len(image_files)}枚をインデックスに登録しました")
+
+    def add(self, path, prompt=None, seed=None, profile=None, generation_time=None, cache_key=None):
+        """
+        生成画像を登録
+
+        Args:
+            path (str): 画像のパス
+            prompt (str): 生成に使ったプロンプト
+            seed (int): 乱数シード
+            profile (str): 生成プロファイル名
+            generation_time (float): 生成時間（秒）
+            cache_key (str): 生成条件のキー（result_cache.cache_key）
+        """
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO images "
+                "(path, created_at, prompt, seed, profile, generation_time, file_size, cache_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, time.time(), prompt, seed, profile, generation_time, os.path.getsize(path), cache_key),
+            )
+
+    def find(self, cache_key):
+        """
+        同じ条件で生成済みの画像を探す
+
+        Args:
+            cache_key (str): 生成条件のキー
+
+        Returns:
+            str|None: 画像のパス（ない場合はNone。ファイルが消えていればインデックスからも外す）
+        """
+        with self.lock, self.db:
+            rows = self.db.execute(
+                "SELECT id, path FROM images WHERE cache_key = ? ORDER BY created_at DESC", (cache_key,)
+            ).fetchall()
+            for row in rows:
+                if os.path.exists(row["path"]):
+                    return row["path"]
+                self.db.execute("DELETE FROM images WHERE id = ?", (row["id"],))
+        return None
+
+    def totals(self):
+        """
+        Returns:
+            tuple: (枚数, 合計サイズ)
+        """
+        with self.lock:
+            row = self.db.execute("SELECT count, bytes FROM totals WHERE id = 0").fetchone()
+        return row["count"], row["bytes"]
+
+    def recent(self, limit=20):
+        """
+        新しい順に画像のメタデータを返す
+
+        Returns:
+            list: sqlite3.Row（path, created_at, prompt, seed, profile, generation_time, file_size, cache_key）
+        """
+        with self.lock:
+            return self.db.execute(
+                "SELECT * FROM images ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+    def _over_limit(self):
+        count, total_bytes = self.db.execute("SELECT count, bytes FROM totals WHERE id = 0").fetchone()
+        return ((self.max_count is not None and count > self.max_count)
+                or (self.max_bytes is not None and total_bytes > self.max_bytes))
+
+    def evict(self):
+        """
+        保持ポリシーを超えた古い画像をインデックスから外す
+
+        Returns:
+            list: 外した画像のパス（ファイルの削除は呼び出し側で行う）
+        """
+        evicted = []
+        with self.lock, self.db:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                rows = self.db.execute("SELECT path FROM images WHERE created_at < ?", (cutoff,)).fetchall()
+                self.db.execute("DELETE FROM images WHERE created_at < ?", (cutoff,))
+                evicted.extend(row["path"] for row in rows)
+
+            # 最古の1件は created_at のインデックスから取得できる
+            while self._over_limit():
+                row = self.db.execute("SELECT id, path FROM images ORDER BY created_at LIMIT 1").fetchone()
+                if row is None:
+                    break
+                self.db.execute("DELETE FROM images WHERE id = ?", (row["id"],))
+                evicted.append(row["path"])
+        return evicted
@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 推論バックエンド
+PyTorch eager / torch.compile / ONNX Runtime / OpenVINO を同じインターフェースで扱う
+"""
+
+import contextlib
+import gc
+import os
+import time
+
+import numpy as np
+import torch
+
+from generation_profiles import create_scheduler
+from deep_cache import DeepCacheUNet
+from generation_checkpoint import ResumeDenoising, resumable
+from guidance import GuidanceTruncation
+from model_snapshot import LoadTimer
+from vae_decode import LatentDecoder, resolve_decode_mode
+
+
+class InferenceBackend:
+    """推論バックエンドの共通インターフェース"""
+
+    name = None
+
+    def __init__(self, generator, options):
+        """
+        Args:
+            generator (ImageGenerator): モデルIDや読み込み元を提供する画像生成器
+            options (dict): config.json の generator.backend セクション
+        """
+        self.generator = generator
+        self.options = options
+        self.pipe = None
+        self.default_scheduler = None
+        self.schedulers = {}
+        self.last_guidance_stats = None
+        self.last_stage_stats = None
+
+    def load(self):
+        """パイプラインを読み込み"""
+        raise NotImplementedError
+
+    def freeze(self):
+        """次回以降の起動を高速化する成果物を書き出し"""
+        raise NotImplementedError
+
+    def encode_prompt(self, prompt):
+        """
+        プロンプトと空の非条件プロンプトの埋め込みを計算
+
+        Returns:
+            tuple: (prompt_embeds, negative_prompt_embeds) のtorch.Tensor
+        """
+        raise NotImplementedError
+
+    def release_text_encoder(self):
+        """
+        テキストエンコーダーをメモリから解放
+
+        Returns:
+            bool: 解放した場合True
+        """
+        return False
+
+    def release_vae(self):
+        """
+        VAE（フルデコーダー）をメモリから解放（次のデコード前に再読み込み）
+
+        Returns:
+            bool: 解放した場合True
+        """
+        return False
+
+    def decode_mode(self, mode):
+        """
+        指定したデコード方法で実際に使われる方法（キャッシュキーに記録する）
+
+        Args:
+            mode (str): プロファイルのデコード方法
+
+        Returns:
+            str: エクスポート済みのバックエンドは常にパイプラインのVAE（full）でデコードする
+        """
+        return "full"
+
+    def set_attention_slicing(self, slice_size):
+        """
+        attention slicing の粒度を切り替え（対応しないバックエンドでは何もしない）
+
+        Args:
+            slice_size (str|int): None（分割なし） / "auto" / "max" / スライス数
+        """
+
+    def set_scheduler(self, name):
+        """
+        スケジューラーを切り替え（生成済みのものは再利用）
+
+        Args:
+            name (str): "default"（パイプライン標準）または SCHEDULERS のキー
+        """
+        if self.default_scheduler is None:
+            self.default_scheduler = self.pipe.scheduler
+
+        if name == "default":
+            self.pipe.scheduler = self.default_scheduler
+            return
+
+        if name not in self.schedulers:
+            self.schedulers[name] = create_scheduler(name, self.default_scheduler.config)
+        self.pipe.scheduler = self.schedulers[name]
+
+    def generate(self, prompt_embeds, negative_prompt_embeds, callback, seed=None,
+                 guidance_cutoff=1.0, guidance_convergence=0.0, deep_cache_interval=0, deep_cache_branch=0,
+                 decoder="full", checkpoint=None, resume=None, **params):
+        """
+        埋め込みから画像を1枚生成
+
+        Args:
+            prompt_embeds (torch.Tensor): プロンプトの埋め込み
+            negative_prompt_embeds (torch.Tensor): 非条件プロンプトの埋め込み
+            callback (callable): 毎ステップ呼ばれる callback(step, timestep, latents)
+            seed (int): 乱数シード（Noneの場合はランダム）
+            guidance_cutoff (float): ガイダンスを適用するステップの割合
+            guidance_convergence (float): 予測が収束したとみなしてガイダンスを打ち切る相対差（0で無効）
+            deep_cache_interval (int): UNetの深い特徴を再計算する間隔（1以下で無効）
+            deep_cache_branch (int): 毎ステップ計算する浅い分岐の深さ
+            decoder (str): 潜在表現のデコード方法（full / tiled / tiny）
+            checkpoint (GenerationCheckpoint): ステップ境界ごとに途中状態を保存する先（Noneで保存しない）
+            resume (dict): 続きから生成する保存済みの状態（GenerationCheckpoint.load() の戻り値）
+            **params: num_inference_steps, guidance_scale, height, width
+
+        Returns:
+            PIL.Image.Image: 生成画像
+        """
+        raise NotImplementedError
+
+    def generate_batch(self, prompt_embeds, negative_prompt_embeds, callback, seeds, **options):
+        """
+        埋め込みのバッチから画像を複数枚生成（対応しないバックエンドでは1枚ずつ生成）
+
+        Args:
+            prompt_embeds (torch.Tensor): プロンプトの埋め込み（1枚ごとに1行）
+            negative_prompt_embeds (torch.Tensor): 非条件プロンプトの埋め込み（同じ行数）
+            callback (callable): 毎ステップ呼ばれる callback(step, timestep, latents)
+            seeds (list): 1枚ごとの乱数シード
+            **options: generate と同じ生成設定（checkpoint / resume を除く）
+
+        Returns:
+            list: PIL.Image.Image（seeds と同じ順）
+        """
+        return [
+            self.generate(prompt_embeds[i:i + 1], negative_prompt_embeds[i:i + 1], callback, seed=seed, **options)
+            for i, seed in enumerate(seeds)
+        ]
+
+
+class TorchBackend(InferenceBackend):
+    """eager実行のPyTorchパイプライン"""
+
+    name = "torch"
+
+    def load(self):
+        from diffusers import AutoencoderKL, StableDiffusionPipeline, UNet2DConditionModel
+        from transformers import CLIPTextModel
+
+        source = self.generator._model_source()
+        kwargs = self.generator._load_kwargs(source)
+        timer = LoadTimer()
+
+        if source == self.generator.model_id:
+            print("初回実行時はモデルのダウンロードに時間がかかります")
+
+        # コンポーネントごとに読み込み、起動時間の内訳を計測（精度モードの成果物があれば優先）
+        precision = self.generator.precision
+        text_encoder = timer.measure("text_encoder", lambda: precision.load_or_convert(
+            "text_encoder", lambda: CLIPTextModel.from_pretrained(source, subfolder="text_encoder", **kwargs)))
+        unet = timer.measure("unet", lambda: precision.load_or_convert(
+            "unet", lambda: UNet2DConditionModel.from_pretrained(source, subfolder="unet", **kwargs)))
+        vae = timer.measure("vae", lambda: precision.load_or_convert(
+            "vae", lambda: AutoencoderKL.from_pretrained(source, subfolder="vae", **kwargs)))
+
+        # CPU最適化設定でパイプラインを組み立て（tokenizer・schedulerのみ追加で読み込み）
+        self.pipe = timer.measure("pipeline", lambda: StableDiffusionPipeline.from_pretrained(
+            source,
+            text_encoder=text_encoder,
+            unet=unet,
+            vae=vae,
+            safety_checker=None,        # 高速化のため安全チェッカーを無効
+            requires_safety_checker=False,
+            **kwargs,
+        ))
+        self.pipe = self.pipe.to("cpu")
+
+        # メモリ効率の最適化（粒度はメモリガバナーが生成ごとに切り替える）
+        self.attention_slicing = "auto"
+        self.pipe.enable_attention_slicing()
+
+        # デコードはパイプラインの外で行い、UNetと別に時間・メモリを計測する
+        self.decoder = LatentDecoder(self.pipe, self.generator.config.get('decoder', {}))
+
+        timer.report(f"{source} ({precision.mode})")
+
+    def decode_mode(self, mode):
+        # 小型デコーダーの重みがなければ full にフォールバックするため、その場合は full として記録
+        return resolve_decode_mode(mode, self.generator.config.get('decoder', {}).get('tiny_path'))
+
+    def freeze(self):
+        snapshot = self.generator.snapshot
+        if snapshot is None:
+            print("❌ スナップショットの保存先が設定されていません")
+            return False
+
+        print(f"モデルスナップショットを書き出し中: {snapshot.directory}")
+        if self.generator.precision.mode == "float32":
+            # 解放済みのテキストエンコーダー・VAEもスナップショットには含める
+            self._load_text_encoder()
+            self._load_vae()
+            snapshot.freeze(self.pipe)
+        else:
+            # 変換済みの重み（int8はsafetensorsで保存できず、bfloat16はfloat32として読み込まれる）を
+            # 焼き込まないよう、未変換のfloat32コンポーネントを読み直して書き出す
+            from diffusers import StableDiffusionPipeline
+
+            source = self.generator._model_source()
+            pipe = StableDiffusionPipeline.from_pretrained(
+                source,
+                safety_checker=None,
+                requires_safety_checker=False,
+                **self.generator._load_kwargs(source),
+            )
+            snapshot.freeze(pipe)
+            del pipe
+        print("✅ スナップショット作成完了（次回起動からこのスナップショットを読み込みます）")
+        return True
+
+    def _load_text_encoder(self):
+        """解放済みのテキストエンコーダーを必要になった時点で再読み込み"""
+        if self.pipe.text_encoder is not None:
+            return
+
+        from transformers import CLIPTextModel
+
+        print("テキストエンコーダーを再読み込み中...")
+        source = self.generator._model_source()
+        self.pipe.text_encoder = self.generator.precision.load_or_convert(
+            "text_encoder",
+            lambda: CLIPTextModel.from_pretrained(
+                source,
+                subfolder="text_encoder",
+                **self.generator._load_kwargs(source),
+            ),
+        ).to("cpu")
+
+    def _load_vae(self):
+        """解放済みのVAEを必要になった時点で再読み込み"""
+        if self.pipe.vae is not None:
+            return
+
+        from diffusers import AutoencoderKL
+
+        print("VAEを再読み込み中...")
+        source = self.generator._model_source()
+        self.pipe.vae = self.generator.precision.load_or_convert(
+            "vae",
+            lambda: AutoencoderKL.from_pretrained(
+                source,
+                subfolder="vae",
+                **self.generator._load_kwargs(source),
+            ),
+        ).to("cpu")
+
+    def encode_prompt(self, prompt):
+        self._load_text_encoder()
+        with torch.no_grad():
+            return self.pipe.encode_prompt(
+                prompt,
+                device="cpu",
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=True,
+            )
+
+    def release_text_encoder(self):
+        if self.pipe is None or self.pipe.text_encoder is None:
+            return False
+
+        self.pipe.text_encoder = None
+        gc.collect()
+        return True
+
+    def release_vae(self):
+        if self.pipe is None or self.pipe.vae is None:
+            return False
+
+        self.pipe.vae = None
+        gc.collect()
+        return True
+
+    def set_attention_slicing(self, slice_size):
+        if slice_size == self.attention_slicing:
+            return
+        if slice_size is None:
+            self.pipe.disable_attention_slicing()
+        else:
+            self.pipe.enable_attention_slicing(slice_size)
+        self.attention_slicing = slice_size
+
+    def generate(self, prompt_embeds, negative_prompt_embeds, callback, seed=None, checkpoint=None, resume=None,
+                 **options):
+        return self._generate(prompt_embeds, negative_prompt_embeds, callback, [seed],
+                              checkpoint=checkpoint, resume=resume, **options)[0]
+
+    def generate_batch(self, prompt_embeds, negative_prompt_embeds, callback, seeds, **options):
+        return self._generate(prompt_embeds, negative_prompt_embeds, callback, seeds, **options)
+
+    def _generate(self, prompt_embeds, negative_prompt_embeds, callback, seeds,
+                  guidance_cutoff=1.0, guidance_convergence=0.0, deep_cache_interval=0, deep_cache_branch=0,
+                  decoder="full", checkpoint=None, resume=None, **params):
+        """
+        1回のパイプライン呼び出しで埋め込みの行数分の画像を生成（checkpoint / resume は1枚の場合のみ）
+
+        Returns:
+            list: PIL.Image.Image（seeds と同じ順）
+        """
+        # キャッシュ済み埋め込みはfloat32のため、UNetの精度に合わせてキャスト
+        dtype = self.pipe.unet.dtype
+        # ガイダンス1以下ではパイプラインが非条件側を連結せずUNetを呼ぶため、打ち切りも収束判定も行わない
+        guided = params.get('guidance_scale', 7.5) > 1
+        truncation = GuidanceTruncation(
+            self.pipe.unet,
+            params['num_inference_steps'],
+            cutoff=guidance_cutoff if guided else 1.0,
+            convergence_threshold=guidance_convergence if guided else 0.0,
+        )
+        deep_cache = None
+        if deep_cache_interval > 1:
+            deep_cache = DeepCacheUNet(self.pipe.unet, deep_cache_interval, branch=deep_cache_branch)
+
+        # 途中保存・再開のため乱数生成器は常に明示的に作る。バッチでは1枚ごとに作り、
+        # 各画像の初期ノイズを同じシードの1枚生成と揃える
+        generators = []
+        for seed in seeds:
+            generator = torch.Generator("cpu")
+            if seed is not None:
+                generator.manual_seed(seed)
+            else:
+                generator.seed()
+            generators.append(generator)
+        generator = generators[0]
+
+        # 再開時はステップ数を数える各処理を保存したステップに合わせる
+        start_index = 0
+        if resume is not None and not resumable(self.pipe.scheduler):
+            print(f"⚠️ {type(self.pipe.scheduler).__name__} は途中からの再開に対応していないため最初から生成します")
+            resume = None
+        if resume is not None:
+            start_index = resume["timestep_index"]
+            generator.set_state(resume["generator_state"])
+            truncation.step = start_index
+            if resume["guidance_truncated_at"] is not None:
+                truncation._truncate(resume["guidance_truncated_at"])
+            if deep_cache is not None:
+                deep_cache.step = start_index
+            print(f"⏯️ {start_index}ステップ目から生成を再開します")
+
+        def step_callback(step, timestep, latents):
+            # 再開時のパイプラインは残りのタイムステップだけを0から数える
+            step += start_index
+            # 中断の確認（callback内）より前に保存し、完了したステップを失わない
+            if checkpoint is not None:
+                checkpoint.save(step + 1, latents, self.pipe.scheduler, generator, truncation.truncated_at)
+            return callback(step, timestep, latents)
+
+        # 特徴キャッシュを内側のforwardとし、その外側でガイダンス打ち切りがバッチを切り替える
+        denoise_start = time.time()
+        with contextlib.ExitStack() as stack:
+            if deep_cache is not None:
+                stack.enter_context(deep_cache)
+            stack.enter_context(truncation)
+            if resume is not None:
+                stack.enter_context(ResumeDenoising(self.pipe, resume))
+            latents = self.pipe(
+                prompt_embeds=prompt_embeds.to(dtype),
+                negative_prompt_embeds=negative_prompt_embeds.to(dtype),
+                generator=generators if len(generators) > 1 else generator,
+                callback=step_callback,
+                callback_steps=1,            # 毎ステップでコールバック実行
+                output_type="latent",
+                **params,
+            ).images
+        denoise_time = time.time() - denoise_start
+
+        self.last_guidance_stats = truncation.summary()
+        truncation.report()
+        if deep_cache is not None:
+            deep_cache.report()
+
+        # メモリガバナーが解放したVAEはデノイズ後に読み込み、UNetの実行中と重ならないようにする
+        if decoder != "tiny" or not self.decoder.tiny_available():
+            self._load_vae()
+
+        # デコードのピークメモリがバッチ枚数に比例しないよう1枚ずつデコード
+        images = []
+        decode_time = 0.0
+        for index in range(latents.shape[0]):
+            images.append(self.decoder.decode(latents[index:index + 1], decoder))
+            decode_time += self.decoder.last_stats["decode_time"]
+        self.last_stage_stats = dict(self.decoder.last_stats, denoise_time=denoise_time, decode_time=decode_time,
+                                     batch_size=len(images))
+        print(f"⏱️  UNet: {denoise_time:.1f}秒" + (f"（{len(images)}枚）" if len(images) > 1 else ""))
+        self.decoder.report()
+        return images
+
+
+class TorchCompileBackend(TorchBackend):
+    """UNetをtorch.compileでグラフコンパイルしたPyTorchパイプライン"""
+
+    name = "torch_compile"
+
+    def load(self):
+        super().load()
+
+        # 初回生成時にコンパイルが走るため、1枚目のみ時間がかかる
+        print("UNetをtorch.compileでコンパイル設定中（初回生成時にコンパイルされます）...")
+        self.pipe.unet = torch.compile(
+            self.pipe.unet,
+            mode=self.options.get('compile_mode', 'default'),
+        )
+
+
+class ExportedBackend(InferenceBackend):
+    """エクスポート済みグラフを実行するランタイム（optimumのパイプラインを利用）"""
+
+    # エクスポートしたテキストエンコーダーの input_ids の型
+    input_ids_dtype = np.int64
+
+    def _pipeline_class(self):
+        raise NotImplementedError
+
+    def _runtime_kwargs(self):
+        return {}
+
+    def _export_directory(self):
+        base = self.options.get('export_directory', '~/.cache/ai-photoframe/exported')
+        return os.path.join(os.path.expanduser(base), self.name)
+
+    def _is_exported(self):
+        return os.path.exists(os.path.join(self._export_directory(), "model_index.json"))
+
+    def _export(self):
+        """PyTorchモデルをエクスポートしてキャッシュに保存（初回のみ）"""
+        pipeline_class = self._pipeline_class()
+        source = self.generator._model_source()
+        export_dir = self._export_directory()
+
+        print(f"{self.name}形式にモデルをエクスポート中（初回のみ）: {export_dir}")
+        pipe = pipeline_class.from_pretrained(source, export=True, **self._runtime_kwargs())
+        pipe.save_pretrained(export_dir)
+        print("✅ エクスポート完了")
+        return pipe
+
+    def load(self):
+        if self.generator.precision.mode != "float32":
+            print(f"⚠️ {self.name}バックエンドでは精度モード {self.generator.precision.mode} は使用されません")
+
+        timer = LoadTimer()
+        if self._is_exported():
+            pipeline_class = self._pipeline_class()
+            self.pipe = timer.measure("pipeline", lambda: pipeline_class.from_pretrained(
+                self._export_directory(), **self._runtime_kwargs()))
+        else:
+            self.pipe = timer.measure("export", self._export)
+        timer.report(self._export_directory())
+
+    def freeze(self):
+        # 既存のエクスポートを作り直す
+        self.pipe = self._export()
+        return True
+
+    def _encode_text(self, text):
+        """トークナイザーとエクスポート済みテキストエンコーダーで1つの文字列を埋め込みに変換"""
+        tokenizer = self.pipe.tokenizer
+        input_ids = tokenizer(
+            text,
+            padding="max_length",
+            max_length=tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="np",
+        ).input_ids
+        return torch.from_numpy(np.asarray(self.pipe.text_encoder(input_ids=input_ids.astype(self.input_ids_dtype))[0]))
+
+    def encode_prompt(self, prompt):
+        # optimumの非公開メソッド（_encode_prompt）はバージョンで引数が変わるため、
+        # 公開されているトークナイザーとテキストエンコーダーを直接使う
+        return self._encode_text(prompt), self._encode_text("")
+
+    def generate(self, prompt_embeds, negative_prompt_embeds, callback, seed=None,
+                 guidance_cutoff=1.0, guidance_convergence=0.0, deep_cache_interval=0, deep_cache_branch=0,
+                 decoder="full", checkpoint=None, resume=None, **params):
+        if resume is not None:
+            # optimumのパイプラインはスケジューラーの状態を外から差し替えられない
+            print(f"⚠️ {self.name}バックエンドは途中からの再開に対応していないため最初から生成します")
+        if guidance_cutoff < 1.0 or guidance_convergence > 0:
+            # エクスポート済みグラフはバッチサイズ固定のため途中でバッチ1に切り替えられない
+            print(f"⚠️ {self.name}バックエンドではガイダンス打ち切りは使用されません")
+        if deep_cache_interval > 1:
+            print(f"⚠️ {self.name}バックエンドでは特徴キャッシュは使用されません")
+        if decoder != "full":
+            print(f"⚠️ {self.name}バックエンドではデコード方法 {decoder} は使用されません")
+        return self.pipe(
+            prompt_embeds=prompt_embeds.numpy(),
+            negative_prompt_embeds=negative_prompt_embeds.numpy(),
+            generator=np.random.RandomState(seed) if seed is not None else None,
+            callback=callback,
+            callback_steps=1,
+            **params,
+        ).images[0]
+
+
+class OnnxRuntimeBackend(ExportedBackend):
+    """ONNX Runtime (CPUExecutionProvider) で実行"""
+
+    name = "onnxruntime"
+
+    # ONNXへのエクスポート時に input_ids はint32で固定される
+    input_ids_dtype = np.int32
+
+    def _pipeline_class(self):
+        from optimum.onnxruntime import ORTStableDiffusionPipeline
+        return ORTStableDiffusionPipeline
+
+    def _runtime_kwargs(self):
+        return {"provider": "CPUExecutionProvider"}
+
+
+class OpenVINOBackend(ExportedBackend):
+    """OpenVINO で実行（入力サイズを固定してコンパイル）"""
+
+    name = "openvino"
+
+    def __init__(self, generator, options):
+        super().__init__(generator, options)
+        self.static_shape = None
+
+    def _pipeline_class(self):
+        from optimum.intel import OVStableDiffusionPipeline
+        return OVStableDiffusionPipeline
+
+    def _runtime_kwargs(self):
+        # reshape後にコンパイルするため読み込み時にはコンパイルしない
+        return {"compile": False}
+
+    def generate(self, prompt_embeds, negative_prompt_embeds, callback, seed=None, **params):
+        # 静的形状の方が高速なため、解像度が変わった時のみ再コンパイル
+        shape = (params.get('height'), params.get('width'))
+        if shape != self.static_shape:
+            self.pipe.reshape(batch_size=1, height=shape[0], width=shape[1], num_images_per_prompt=1)
+            self.pipe.compile()
+            self.static_shape = shape
+        return super().generate(prompt_embeds, negative_prompt_embeds, callback, seed=seed, **params)
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (TorchBackend, TorchCompileBackend, OnnxRuntimeBackend, OpenVINOBackend)
+}
+
+
+def create_backend(generator, options):
+    """
+    config.json の generator.backend.name に対応するバックエンドを生成
+
+    Args:
+        generator (ImageGenerator): 画像生成器
+        options (dict): generator.backend セクション
+
+    Returns:
+        InferenceBackend: 未知の名前の場合はPyTorch eager
+    """
+    name = options.get('name', TorchBackend.name)
+    if name not in BACKENDS:
+        print(f"⚠️ 不明なバックエンド: {name}（{TorchBackend.name} を使用します）")
+        name = TorchBackend.name
+    return BACKENDS[name](generator, options)
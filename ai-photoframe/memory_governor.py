@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - メモリガバナー
+ステージごとのピークRSSをメモリ予算と比較し、attention slicing の粒度・VAEのタイル分割・
+使っていないコンポーネントの解放を生成ごとに切り替える
+"""
+
+import os
+
+# attention slicing の段階（速い順。後ろほどピークメモリが小さい）
+#   None: 分割なし / "auto": ヘッドを半分ずつ / "max": 1スライスずつ
+ATTENTION_LEVELS = (None, "auto", "max")
+
+# ピークが予算のこの割合を超えたら1段階節約側へ、下回ったら1段階速い側へ戻す
+HIGH_WATER = 0.9
+LOW_WATER = 0.6
+
+# ピークが予算のこの割合を超えたら、使っていないコンポーネントを生成ごとに解放する
+RELEASE_WATER = 0.8
+
+# 予算を自動で決める場合に、上限のうち使ってよい割合
+AUTO_BUDGET_RATIO = 0.9
+
+MEASURED_STAGES = ("text_encode", "unet_denoise", "vae_decode")
+
+
+def _read_first_int(path):
+    try:
+        with open(path, 'r') as f:
+            value = f.read().split()[0]
+        return int(value)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _cgroup_memory_max():
+    """cgroup v2 の memory.max（systemd の MemoryMax）。制限なし・読めない場合はNone"""
+    try:
+        with open("/proc/self/cgroup", 'r') as f:
+            for line in f:
+                if line.startswith("0::"):
+                    path = os.path.join("/sys/fs/cgroup", line[3:].strip().lstrip("/"), "memory.max")
+                    return _read_first_int(path)
+    except OSError:
+        pass
+    return None
+
+
+def detect_memory_budget_mb():
+    """
+    物理メモリと systemd の MemoryMax の小さい方から予算を決める
+
+    Returns:
+        float|None: MB（どちらも読めない場合はNone）
+    """
+    limits = []
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    limits.append(int(line.split()[1]) / 1024)
+                    break
+    except OSError:
+        pass
+    cgroup_max = _cgroup_memory_max()
+    if cgroup_max is not None:
+        limits.append(cgroup_max / 1024 / 1024)
+    if not limits:
+        return None
+    return min(limits) * AUTO_BUDGET_RATIO
+
+
+class MemoryGovernor:
+    """生成ごとのステージのピークRSSから、次の生成のメモリ設定を決める"""
+
+    def __init__(self, budget_mb=None, attention_slicing="auto"):
+        """
+        Args:
+            budget_mb (float): プロセス全体のRSSの予算（Noneの場合は物理メモリ・MemoryMaxから自動）
+            attention_slicing (str): 予算に余裕がある場合の attention slicing（None / "auto" / "max"）
+        """
+        self.budget_mb = budget_mb or detect_memory_budget_mb()
+        if attention_slicing not in ATTENTION_LEVELS:
+            print(f"⚠️ 不明な attention slicing: {attention_slicing}（auto を使用します）")
+            attention_slicing = "auto"
+        self.preferred_level = ATTENTION_LEVELS.index(attention_slicing)
+        self.attention_level = self.preferred_level
+        self.tiled_decode = False
+        self.release_idle = False
+        self.last_peaks = {}
+
+    def attention_slicing(self):
+        """次の生成で使う attention slicing"""
+        return ATTENTION_LEVELS[self.attention_level]
+
+    def decoder_mode(self, mode):
+        """
+        次の生成で使うデコード方法（予算を超えた場合は full をタイル分割に切り替える）
+
+        Args:
+            mode (str): プロファイルのデコード方法
+        """
+        if self.tiled_decode and mode == "full":
+            return "tiled"
+        return mode
+
+    def after_load(self, rss_mb):
+        """
+        モデル読み込み直後のRSSから初期設定を決める
+
+        Args:
+            rss_mb (float): 読み込み後のRSS（MB）
+        """
+        if self.budget_mb is None or rss_mb is None:
+            return
+        print(f"🧠 メモリ予算: {self.budget_mb:.0f}MB | モデル読み込み後: {rss_mb:.0f}MB")
+        if rss_mb > self.budget_mb * RELEASE_WATER:
+            # 読み込んだだけで予算に近い場合は最初の生成から節約する
+            self.release_idle = True
+            self.attention_level = len(ATTENTION_LEVELS) - 1
+            self.tiled_decode = True
+            self._report("読み込み後のRSSが予算に近いため節約設定で開始")
+
+    def observe(self, records):
+        """
+        1回の生成で記録したステージのピークRSSから次の生成の設定を更新
+
+        Args:
+            records (list): TRACER.records() の戻り値（この生成の記録）
+        """
+        if self.budget_mb is None:
+            return
+        peaks = {}
+        for record in records:
+            if record["stage"] in MEASURED_STAGES:
+                peaks[record["stage"]] = max(peaks.get(record["stage"], 0), record["peak_rss_mb"])
+        if not peaks:
+            return
+        self.last_peaks = peaks
+
+        changes = []
+        high, low = self.budget_mb * HIGH_WATER, self.budget_mb * LOW_WATER
+
+        denoise = peaks.get("unet_denoise")
+        if denoise is not None:
+            if denoise > high and self.attention_level < len(ATTENTION_LEVELS) - 1:
+                self.attention_level += 1
+                changes.append(f"attention slicing → {self.attention_slicing()}")
+            elif denoise < low and self.attention_level > self.preferred_level:
+                self.attention_level -= 1
+                changes.append(f"attention slicing → {self.attention_slicing()}")
+
+        decode = peaks.get("vae_decode")
+        if decode is not None:
+            if decode > high and not self.tiled_decode:
+                self.tiled_decode = True
+                changes.append("VAEをタイル分割")
+            elif decode < low and self.tiled_decode:
+                self.tiled_decode = False
+                changes.append("VAEのタイル分割を解除")
+
+        # 解放と再読み込みを毎回繰り返さないよう、解除は十分に下回った場合のみ
+        peak = max(peaks.values())
+        if peak > self.budget_mb * RELEASE_WATER and not self.release_idle:
+            self.release_idle = True
+            changes.append("使っていないコンポーネントを解放")
+        elif peak < low and self.release_idle:
+            self.release_idle = False
+            changes.append("コンポーネントの解放を停止")
+
+        self._report(", ".join(changes))
+
+    def _report(self, changes=""):
+        peaks = " / ".join(f"{stage} {self.last_peaks[stage]:.0f}MB"
+                           for stage in MEASURED_STAGES if stage in self.last_peaks)
+        line = f"🧠 ピークRSS: {peaks or '未計測'}（予算 {self.budget_mb:.0f}MB）"
+        if changes:
+            line += f" → {changes}"
+        print(line)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - モデルスナップショット
+解決済みの設定とsafetensors重みをローカルに書き出し、起動時にそのまま読み込めるようにする
+"""
+
+import json
+import os
+import shutil
+import time
+
+
+class ModelSnapshot:
+    """freeze済みパイプラインの保存先とメタデータを管理"""
+
+    MANIFEST_FILE = "snapshot.json"
+
+    # スナップショットは常に未変換の重みで作成し、精度モードの変換は読み込み時に上から適用する
+    PRECISION = "float32"
+
+    def __init__(self, directory, model_id):
+        """
+        Args:
+            directory (str): スナップショットの保存先ディレクトリ
+            model_id (str): スナップショット元のモデルID
+        """
+        self.directory = os.path.expanduser(directory)
+        self.model_id = model_id
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, self.MANIFEST_FILE)
+
+    def manifest(self):
+        """
+        スナップショットのメタデータを読み込み
+
+        Returns:
+            dict|None: メタデータ（未作成の場合はNone）
+        """
+        try:
+            with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ スナップショット情報の読み込みエラー: {e}")
+            return None
+
+    def is_ready(self):
+        """同じモデルIDのfloat32の重みから作成されたスナップショットが存在するか"""
+        manifest = self.manifest()
+        if manifest is None or manifest.get("model_id") != self.model_id:
+            return False
+        # 精度の記録がない古いスナップショットは変換済みの重みを含む可能性があるため使わない
+        return manifest.get("precision") == self.PRECISION
+
+    def freeze(self, pipe):
+        """
+        読み込み済みパイプラインをsafetensors形式で書き出し
+
+        Args:
+            pipe (StableDiffusionPipeline): 書き出すパイプライン（float32の未変換のコンポーネント）
+
+        Returns:
+            str: スナップショットのパス
+        """
+        # 書き込み途中のスナップショットを読み込まないよう一時ディレクトリ経由で置き換え
+        tmp_dir = self.directory + ".tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+        pipe.save_pretrained(tmp_dir, safe_serialization=True)
+        with open(os.path.join(tmp_dir, self.MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                "model_id": self.model_id,
+                "precision": self.PRECISION,
+                "created_at": time.time(),
+            }, f, ensure_ascii=False, indent=2)
+
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.replace(tmp_dir, self.directory)
+        return self.directory
+
+
+class LoadTimer:
+    """コンポーネントごとの読み込み時間を記録"""
+
+    def __init__(self):
+        self.timings = []
+
+    def measure(self, name, loader):
+        """
+        loaderを実行して所要時間を記録
+
+        Args:
+            name (str): コンポーネント名
+            loader (callable): 読み込み処理
+
+        Returns:
+            loaderの戻り値
+        """
+        start_time = time.time()
+        result = loader()
+        self.timings.append((name, time.time() - start_time))
+        return result
+
+    def report(self, source):
+        """読み込み時間の内訳を表示"""
+        total = sum(duration for _, duration in self.timings)
+        print(f"⏱️  モデル読み込み時間: {total:.1f}秒 (読み込み元: {source})")
+        for name, duration in self.timings:
+            print(f"    {name:<14} {duration:6.2f}秒")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 生成画像の書き出し
+エンコード・メタデータの埋め込み・サムネイルと表示サイズのコピーの作成・fsync をバックグラウンドスレッドで行い、
+次の生成を書き出しの完了を待たずに始められるようにする
+"""
+
+import atexit
+import glob
+import os
+import queue
+import threading
+
+from result_cache import exif_metadata, png_metadata
+from telemetry import TRACER
+
+# 拡張子 -> PILの保存形式（形式は保存先の拡張子で決まる）
+FORMATS = {".png": "PNG", ".webp": "WEBP", ".jpg": "JPEG", ".jpeg": "JPEG"}
+
+# config.json の image.format -> 拡張子
+EXTENSIONS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg", "jpg": ".jpg"}
+
+# 派生画像は元画像の拡張子の前に付ける（例: ai_photo_XXX.thumb.png）
+THUMBNAIL_SUFFIX = ".thumb"
+DISPLAY_SUFFIX = ".display"
+
+# 書き出し待ちの上限（エンコードが追いつかない場合は生成側を待たせる）
+MAX_PENDING = 8
+
+
+def extension_for(image_format):
+    """
+    image.format に対応する拡張子
+
+    Args:
+        image_format (str): png / webp / jpeg
+
+    Returns:
+        str: ".png" 等（不明な形式は ".png"）
+    """
+    extension = EXTENSIONS.get(str(image_format).lower())
+    if extension is None:
+        print(f"⚠️ 不明な画像形式: {image_format}（png を使用します）")
+        return ".png"
+    return extension
+
+
+def derived_paths(image_path):
+    """
+    画像のサムネイルと表示サイズのコピーのパス
+
+    Returns:
+        dict: thumbnail / display -> パス
+    """
+    stem, extension = os.path.splitext(image_path)
+    return {
+        "thumbnail": f"{stem}{THUMBNAIL_SUFFIX}{extension}",
+        "display": f"{stem}{DISPLAY_SUFFIX}{extension}",
+    }
+
+
+def is_derived(path):
+    """サムネイル・表示サイズのコピーのパスか"""
+    stem = os.path.splitext(path)[0]
+    return stem.endswith(THUMBNAIL_SUFFIX) or stem.endswith(DISPLAY_SUFFIX)
+
+
+def remove_derived(image_path):
+    """
+    画像のサムネイル・表示サイズのコピーを削除
+
+    Returns:
+        int: 削除したファイル数
+    """
+    removed = 0
+    for path in derived_paths(image_path).values():
+        # 書き込み途中で停止した一時ファイルも消す
+        for candidate in glob.glob(glob.escape(path) + "*"):
+            try:
+                os.remove(candidate)
+                removed += 1
+            except OSError as e:
+                print(f"⚠️ ファイル削除エラー {candidate}: {e}")
+    return removed
+
+
+class OutputWriter:
+    """生成画像と派生画像を1回の書き出しジョブでまとめて保存するバックグラウンドの書き出しスレッド"""
+
+    def __init__(self, quality=95, png_compress_level=6, thumbnail_size=(160, 100), display_size=None,
+                 fsync=True):
+        """
+        Args:
+            quality (int): JPEG / WebP の画質（1-100）
+            png_compress_level (int): PNGの圧縮レベル（0-9。小さいほど速くファイルが大きい）
+            thumbnail_size (tuple): サムネイルの最大サイズ（Noneで作らない）
+            display_size (tuple): 表示サイズのコピーの解像度（Noneで作らない）
+            fsync (bool): 置き換え前にディスクへの書き込みを待つか（電源断で壊れた画像を残さない）
+        """
+        self.quality = quality
+        self.png_compress_level = png_compress_level
+        self.thumbnail_size = tuple(thumbnail_size) if thumbnail_size else None
+        self.display_size = tuple(display_size) if display_size else None
+        self.fsync = fsync
+
+        self.queue = queue.Queue(maxsize=MAX_PENDING)
+        # 書き出し中・待ちの画像のパス -> 完了時にセットするイベント
+        self.pending = {}
+        self.failed = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        # 終了時に書き出し待ちの画像を失わないよう、プロセス終了前に書き終える
+        atexit.register(self.close)
+
+    def submit(self, image, path, metadata=None, on_written=None):
+        """
+        画像の書き出しを依頼してすぐに戻る
+
+        Args:
+            image (PIL.Image.Image): 生成画像（依頼後は変更しないこと）
+            path (str): 保存先（拡張子で形式を決める）
+            metadata (dict): 埋め込む生成条件（cache_key, prompt, seed, profile）
+            on_written (callable): 書き出し完了後に書き出しスレッドで呼ばれる on_written(path, image)
+        """
+        with self.lock:
+            self.pending[path] = threading.Event()
+            self.failed.discard(path)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="output-writer", daemon=True)
+                self.thread.start()
+        self.queue.put((image, path, metadata, on_written))
+
+    def write(self, image, path, metadata=None, on_written=None):
+        """
+        書き出しを依頼して完了まで待つ
+
+        Returns:
+            bool: 書き出し成功時True
+        """
+        self.submit(image, path, metadata, on_written)
+        return self.wait(path)
+
+    def wait(self, path, timeout=None):
+        """
+        画像の書き出し完了を待つ（依頼されていないパスはすぐに戻る）
+
+        Returns:
+            bool: 書き出し済み（または依頼されていない）場合True、失敗・タイムアウト時False
+        """
+        with self.lock:
+            event = self.pending.get(path)
+        if event is not None and not event.wait(timeout):
+            return False
+        with self.lock:
+            return path not in self.failed
+
+    def flush(self):
+        """依頼済みの書き出しがすべて終わるまで待つ"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """書き出しを終えてスレッドを止める"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self._write_job(*job)
+            finally:
+                self.queue.task_done()
+
+    def _write_job(self, image, path, metadata, on_written):
+        success = False
+        try:
+            extension = os.path.splitext(path)[1].lower()
+            with TRACER.span("image_write", format=FORMATS.get(extension, "PNG").lower()):
+                # 派生画像を先に書き、元画像が見えた時点で派生画像も揃っているようにする
+                derived = derived_paths(path)
+                if self.thumbnail_size:
+                    thumbnail = image.copy()
+                    thumbnail.thumbnail(self.thumbnail_size)
+                    self._save(thumbnail, derived["thumbnail"])
+                if self.display_size:
+                    display_copy = image if image.size == self.display_size else image.resize(self.display_size)
+                    self._save(display_copy, derived["display"])
+                self._save(image, path, metadata)
+            success = True
+        except Exception as e:
+            print(f"❌ 画像の書き出しエラー {path}: {e}")
+
+        if success and on_written is not None:
+            try:
+                on_written(path, image)
+            except Exception as e:
+                print(f"⚠️ 書き出し後の処理でエラー {path}: {e}")
+
+        with self.lock:
+            if not success:
+                self.failed.add(path)
+            event = self.pending.pop(path, None)
+        if event is not None:
+            event.set()
+
+    def _save(self, image, path, metadata=None):
+        """形式ごとの設定でエンコードし、一時ファイル経由で置き換え"""
+        image_format = FORMATS.get(os.path.splitext(path)[1].lower(), "PNG")
+        options = {"format": image_format}
+        if image_format == "PNG":
+            options["compress_level"] = self.png_compress_level
+            if metadata:
+                options["pnginfo"] = png_metadata(**metadata)
+        else:
+            options["quality"] = self.quality
+            if metadata:
+                options["exif"] = exif_metadata(**metadata)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+
+        # 表示側・インデックスが書き込み途中のファイルを読まないよう一時ファイル経由で置き換え
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            image.save(f, **options)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+def create_writer(config):
+    """
+    config.json の image / display セクションから作成
+
+    Args:
+        config (dict): config.json の内容
+
+    Returns:
+        OutputWriter: 書き出しスレッド（最初の依頼で起動）
+    """
+    image_config = config.get('image', {})
+    display_size = None
+    if image_config.get('display_copy', True):
+        display_size = config.get('display', {}).get('resolution')
+    return OutputWriter(
+        quality=image_config.get('quality', 95),
+        png_compress_level=image_config.get('png_compress_level', 6),
+        thumbnail_size=image_config.get('thumbnail_size', [160, 100]),
+        display_size=display_size,
+        fsync=image_config.get('fsync', True),
+    )
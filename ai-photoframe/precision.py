@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 精度モード
+bfloat16 / 動的int8量子化したコンポーネントを作成・保存し、float32との比較を行う
+"""
+
+import hashlib
+import multiprocessing
+import os
+import platform
+import resource
+import time
+
+import numpy as np
+import torch
+
+PRECISION_MODES = ("float32", "bfloat16", "int8")
+
+# モードごとに変換するコンポーネント（int8はLinear層を持つものだけ量子化）
+CONVERTED_COMPONENTS = {
+    "float32": (),
+    "bfloat16": ("text_encoder", "unet", "vae"),
+    "int8": ("text_encoder", "unet"),
+}
+
+
+def cpu_supports_bfloat16():
+    """CPUがbfloat16演算命令を持つか（/proc/cpuinfo のフラグで判定）"""
+    try:
+        with open("/proc/cpuinfo", 'r', encoding='utf-8') as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    # x86: AVX512-BF16 / AMX-BF16, ARM: BF16拡張
+    return bool(flags & {"avx512_bf16", "amx_bf16", "bf16"})
+
+
+def resolve_mode(mode):
+    """
+    設定された精度モードを実行環境で使えるモードに解決
+
+    Args:
+        mode (str): float32 / bfloat16 / int8
+
+    Returns:
+        str: 使用する精度モード
+    """
+    if mode not in PRECISION_MODES:
+        print(f"⚠️ 不明な精度モード: {mode}（float32 を使用します）")
+        return "float32"
+    if mode == "bfloat16" and not cpu_supports_bfloat16():
+        print("⚠️ このCPUはbfloat16に対応していません（float32 を使用します）")
+        return "float32"
+    return mode
+
+
+def convert(module, mode):
+    """
+    コンポーネントを指定の精度に変換
+
+    Args:
+        module (torch.nn.Module): float32のコンポーネント
+        mode (str): bfloat16 / int8
+
+    Returns:
+        torch.nn.Module: 変換後のコンポーネント
+    """
+    if mode == "bfloat16":
+        return module.to(dtype=torch.bfloat16)
+
+    if mode == "int8":
+        # ARMではx86向けのfbgemmが使えないためqnnpackを使用
+        if platform.machine().startswith(("arm", "aarch64")) and "qnnpack" in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = "qnnpack"
+        # モデルクラス（configやdtype属性）を保つためインプレースで置き換え
+        return torch.ao.quantization.quantize_dynamic(
+            module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+
+    return module
+
+
+class PrecisionStore:
+    """変換済みコンポーネントを再利用可能な成果物として保存"""
+
+    def __init__(self, directory, model_id, mode):
+        """
+        Args:
+            directory (str): 成果物の保存先ディレクトリ
+            model_id (str): 変換元のモデルID
+            mode (str): 精度モード
+        """
+        self.mode = resolve_mode(mode)
+        model_key = hashlib.sha256(model_id.encode("utf-8")).hexdigest()[:16]
+        self.directory = os.path.join(os.path.expanduser(directory), model_key, self.mode)
+
+    def _path(self, component):
+        return os.path.join(self.directory, f"{component}.pt")
+
+    def load_or_convert(self, component, loader):
+        """
+        変換済みの成果物があれば読み込み、なければfloat32から変換して保存
+
+        Args:
+            component (str): text_encoder / unet / vae
+            loader (callable): float32のコンポーネントを読み込む関数
+
+        Returns:
+            torch.nn.Module: 指定精度のコンポーネント
+        """
+        if component not in CONVERTED_COMPONENTS[self.mode]:
+            return loader()
+
+        path = self._path(component)
+        if os.path.exists(path):
+            try:
+                return self._load(path)
+            except Exception as e:
+                print(f"⚠️ 変換済みの {component} を読み込めないため変換し直します: {e}")
+                os.remove(path)
+
+        print(f"{component} を {self.mode} に変換中（初回のみ）...")
+        module = convert(loader(), self.mode)
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        tmp_path = path + ".tmp"
+        torch.save(module, tmp_path)
+        # 次回起動時に読み込めない成果物を残さないよう、書き出した直後に一度読み戻して確認
+        try:
+            self._load(tmp_path)
+        except Exception as e:
+            print(f"⚠️ 変換済みの {component} を読み戻せないため保存しません（毎回変換します）: {e}")
+            os.remove(tmp_path)
+            return module
+        os.replace(tmp_path, path)
+        return module
+
+    @staticmethod
+    def _load(path):
+        """
+        変換済みのコンポーネントを読み込み
+
+        量子化済みモジュールはsafetensorsで表現できないためモジュールごと保存している。
+        torch 2.6以降は weights_only=True が既定でモジュールのpickleを拒否するため明示する
+        （このディレクトリのファイルは自分で書き出したもののみ）
+        """
+        return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def image_similarity(image_a, image_b):
+    """
+    2枚の画像のSSIM（輝度、7x7ウィンドウの平均）を計算
+
+    Args:
+        image_a (PIL.Image.Image): 基準画像
+        image_b (PIL.Image.Image): 比較画像
+
+    Returns:
+        float: 1.0で完全一致
+    """
+    a = np.asarray(image_a.convert("L"), dtype=np.float64)
+    b = np.asarray(image_b.convert("L").resize(image_a.size), dtype=np.float64)
+
+    def box_mean(x, size=7):
+        # 累積和による移動平均（validモード）
+        c = np.cumsum(np.cumsum(np.pad(x, ((1, 0), (1, 0))), axis=0), axis=1)
+        total = c[size:, size:] - c[:-size, size:] - c[size:, :-size] + c[:-size, :-size]
+        return total / (size * size)
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_a, mu_b = box_mean(a), box_mean(b)
+    var_a = box_mean(a * a) - mu_a ** 2
+    var_b = box_mean(b * b) - mu_b ** 2
+    cov = box_mean(a * b) - mu_a * mu_b
+
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim.mean())
+
+
+def _run_trial(config, mode, prompt, seed, output_path, results):
+    """子プロセスで1モード分の生成を行い、ステップ時間とピークRSSを返す"""
+    from image_generator import ImageGenerator
+
+    config = dict(config)
+    config['generator'] = dict(config.get('generator', {}))
+    config['generator']['precision'] = dict(config['generator'].get('precision', {}), mode=mode)
+
+    generator = ImageGenerator(config)
+    step_times = []
+
+    def step_callback(step, total_steps):
+        step_times.append(time.time())
+
+    success = generator.generate_image(prompt, output_path, callback=step_callback, seed=seed)
+    # 初回ステップはウォームアップを含むため2ステップ目以降の間隔で計測
+    intervals = np.diff(step_times[1:]) if len(step_times) > 2 else np.diff(step_times)
+    results.put({
+        "mode": generator.precision.mode,
+        "success": success,
+        "seconds_per_step": float(np.mean(intervals)) if len(intervals) else None,
+        # Linuxのru_maxrssはKB単位
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "output_path": output_path,
+    })
+
+
+def compare_precision_modes(config, prompt, output_dir, modes=PRECISION_MODES, seed=0):
+    """
+    各精度モードで同じプロンプト・シードの画像を生成し、float32と比較
+
+    ピークRSSが混ざらないよう、モードごとに別プロセスで実行する
+
+    Args:
+        config (dict): config.json の内容
+        prompt (str): 比較に使うプロンプト
+        output_dir (str): 比較画像の保存先
+        modes (tuple): 比較する精度モード（先頭が基準）
+        seed (int): 乱数シード
+
+    Returns:
+        list: モードごとの計測結果
+    """
+    from PIL import Image
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for mode in modes:
+        print(f"\n=== 精度モード: {mode} ===")
+        output_path = os.path.join(output_dir, f"precision_{mode}.png")
+        queue = context.Queue()
+        process = context.Process(target=_run_trial, args=(config, mode, prompt, seed, output_path, queue))
+        process.start()
+        process.join()
+        if queue.empty():
+            print(f"❌ {mode} の計測に失敗しました")
+            continue
+        results.append(queue.get())
+
+    baseline = next((r for r in results if r["mode"] == "float32" and r["success"]), None)
+    print("\n=== 精度モード比較 ===")
+    print(f"{'モード':<10} {'秒/ステップ':>10} {'ピークRSS':>10} {'SSIM':>8}")
+    for result in results:
+        if not result["success"]:
+            print(f"{result['mode']:<10} {'失敗':>10}")
+            continue
+        similarity = None
+        if baseline is not None:
+            similarity = image_similarity(Image.open(baseline["output_path"]), Image.open(result["output_path"]))
+        result["similarity"] = similarity
+        step_text = f"{result['seconds_per_step']:.2f}s" if result["seconds_per_step"] is not None else "-"
+        similarity_text = f"{similarity:.4f}" if similarity is not None else "-"
+        print(f"{result['mode']:<10} {step_text:>10} {result['peak_rss_mb']:>8.0f}MB {similarity_text:>8}")
+    return results
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - プロンプト埋め込みキャッシュ
+モデルID+精度モード+プロンプトをキーにCLIPテキストエンコーダーの出力をディスクに保存
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import torch
+
+
+class PromptEmbeddingCache:
+    """プロンプト埋め込みをメモリマップ可能な .npy ファイルとして保持するキャッシュ"""
+
+    def __init__(self, directory, model_id, precision="float32"):
+        """
+        Args:
+            directory (str): キャッシュの保存先ディレクトリ
+            model_id (str): キーに含めるモデルID（モデル変更時に別キーになる）
+            precision (str): キーに含める精度モード（int8等はテキストエンコーダーの出力が変わる）
+        """
+        self.directory = os.path.expanduser(directory)
+        self.model_id = model_id
+        self.precision = precision
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, prompt):
+        """モデルID・精度モード・プロンプト文字列から内容アドレスのキーを生成"""
+        return hashlib.sha256(f"{self.model_id}\n{self.precision}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _path(self, prompt):
+        return os.path.join(self.directory, f"{self.key(prompt)}.npy")
+
+    def contains(self, prompt):
+        return os.path.exists(self._path(prompt))
+
+    def get(self, prompt):
+        """
+        キャッシュ済みの埋め込みを読み込み
+
+        Args:
+            prompt (str): プロンプト
+
+        Returns:
+            torch.Tensor|None: 埋め込み（キャッシュにない場合はNone）
+        """
+        path = self._path(prompt)
+        if not os.path.exists(path):
+            return None
+
+        # copy-on-writeのメモリマップで読み込み、パイプラインには複製せずに渡す
+        array = np.load(path, mmap_mode='c')
+        return torch.from_numpy(array)
+
+    def put(self, prompt, embeds):
+        """
+        埋め込みを保存
+
+        Args:
+            prompt (str): プロンプト
+            embeds (torch.Tensor): テキストエンコーダーの出力
+        """
+        path = self._path(prompt)
+        tmp_path = path + ".tmp"
+        # bfloat16等はNumPyで扱えないためfloat32で保存し、読み込み時にキャストする
+        array = embeds.detach().to("cpu", torch.float32).numpy()
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 生成結果キャッシュのキー
+モデル・プロンプト・シード・生成設定から決まるキーを画像のメタデータとインデックスに記録し、
+同じ条件の生成を省いて保存済みの画像を使う
+"""
+
+import hashlib
+import json
+
+# PNGのテキストチャンクのキー
+PNG_KEY_FIELD = "aiphotoframe:cache_key"
+
+# JPEG / WebP ではEXIFの ImageDescription に記録する
+EXIF_DESCRIPTION_TAG = 0x010E
+
+# キーに含める内容を変えたら上げる（古いキーの画像とは一致しなくなる）
+KEY_VERSION = 2
+
+
+def cache_key(model_id, precision, backend, prompt, seed, profile, settings):
+    """
+    生成条件のハッシュ
+
+    Args:
+        model_id (str): モデルID（またはローカルパス）
+        precision (str): 精度モード（float32 / bfloat16 / int8）
+        backend (str): 推論バックエンド名（ONNX Runtime / OpenVINO は初期ノイズの乱数生成が異なる）
+        prompt (str): プロンプト
+        seed (int): 乱数シード
+        profile (str): 生成プロファイル名
+        settings (dict): プロファイルの設定（スケジューラー・ステップ数・ガイダンス・解像度・デコード方法）
+
+    Returns:
+        str: SHA-256 の16進文字列
+    """
+    payload = {
+        "version": KEY_VERSION,
+        "model_id": model_id,
+        "precision": precision,
+        "backend": backend,
+        "prompt": prompt,
+        "seed": seed,
+        "profile": profile,
+        "settings": settings,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def png_metadata(key, prompt, seed, profile):
+    """
+    画像に埋め込むテキストチャンク
+
+    Returns:
+        PIL.PngImagePlugin.PngInfo: Image.save の pnginfo に渡す
+    """
+    from PIL.PngImagePlugin import PngInfo
+
+    info = PngInfo()
+    info.add_text(PNG_KEY_FIELD, key)
+    info.add_itxt("aiphotoframe:prompt", prompt)
+    info.add_text("aiphotoframe:seed", str(seed))
+    info.add_text("aiphotoframe:profile", profile)
+    return info
+
+
+def exif_metadata(key, prompt, seed, profile):
+    """
+    JPEG / WebP に埋め込むEXIF（ImageDescription にPNGのテキストチャンクと同じ内容をJSONで格納）
+
+    Returns:
+        PIL.Image.Exif: Image.save の exif に渡す
+    """
+    from PIL import Image
+
+    exif = Image.Exif()
+    # ImageDescription はASCIIのため、プロンプトの非ASCII文字はエスケープする
+    exif[EXIF_DESCRIPTION_TAG] = json.dumps({
+        PNG_KEY_FIELD: key,
+        "aiphotoframe:prompt": prompt,
+        "aiphotoframe:seed": str(seed),
+        "aiphotoframe:profile": profile,
+    }, ensure_ascii=True)
+    return exif
+
+
+def read_cache_key(path):
+    """
+    画像に埋め込まれたキャッシュキー（PNGのテキストチャンクまたはEXIF）
+
+    Returns:
+        str|None: キー（埋め込まれていない・読めない場合はNone）
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            key = getattr(image, "text", {}).get(PNG_KEY_FIELD)
+            if key is not None:
+                return key
+            description = image.getexif().get(EXIF_DESCRIPTION_TAG)
+    except OSError:
+        return None
+    try:
+        return json.loads(description).get(PNG_KEY_FIELD) if description else None
+    except (ValueError, AttributeError):
+        return None
@@ -28,22 +28,32 @@ cd "$PHOTOFRAME_DIR"
 # 引数があればそのまま渡す、なければヘルプを表示
 if [ $# -eq 0 ]; then
     echo "使用方法:"
-    echo "  $0 generate \"プロンプト\"      # 画像生成して表示"
-    echo "  $0 generate-only \"プロンプト\" # 画像生成のみ"
+    echo "  $0 generate \"プロンプト\" [--seed N]      # 画像生成して表示"
+    echo "  $0 generate-only \"プロンプト\" [--seed N] # 画像生成のみ"
+    echo "  $0 generate-batch 枚数 [\"プロンプト\"] # まとめて生成"
     echo "  $0 display image_path       # 既存画像を表示"
     echo "  $0 list                     # 生成画像一覧"
     echo "  $0 continuous               # 永続実行モード"
+    echo "  $0 daemon                   # 常駐生成デーモン"
+    echo "  $0 daemon-status            # 常駐生成デーモンのキュー状態"
+    echo "  $0 pool [枚数]              # 複数ワーカーで生成（生成サーバー向け）"
+    echo "  $0 pool-bench [枚数]        # ワーカー数・スレッド数ごとのスループット比較"
+    echo "  $0 freeze                   # 高速起動用モデルスナップショットを作成"
+    echo "  $0 compare-precision        # 精度モードの速度・メモリ・画質を比較"
+    echo "  $0 compare-guidance         # ガイダンス打ち切り位置の速度・画質を比較"
+    echo "  $0 startup-bench            # コマンドごとの起動時間を計測"
     echo ""
     echo "例:"
     echo "  $0 generate \"beautiful mountain landscape\""
     echo "  $0 generate-only \"sunset over ocean\""
+    echo "  $0 generate \"sunset over ocean\" --seed 42  # 同じ条件の生成済み画像があれば再利用"
     echo "  $0 display /path/to/image.jpg"
     echo "  $0 list"
     echo "  $0 continuous"
     echo ""
     echo "💡 ヒント:"
     echo "  - 画像は自動的に 640x400 サイズで生成されます"
-    echo "  - 生成された画像は最新10枚のみ保持されます"
+    echo "  - 生成された画像は config.json の image.max_stored 枚まで保持されます"
     echo "  - ファイル名には生成日時が含まれます (ai_photo_YYYYMMDD_HHMMSS.png)"
     echo "  - 永続実行モードは config.json で設定できます"
 else
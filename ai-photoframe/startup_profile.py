@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 起動時間の計測
+CLIコマンドごとのimport・初期化・実行時間を記録し、コマンド間で比較する
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# 設定すると計測結果をこのファイルにJSON Linesで追記
+LOG_ENV = "AIPHOTOFRAME_STARTUP_LOG"
+
+
+class StartupTimer:
+    """起動からの区間ごとの所要時間を記録"""
+
+    def __init__(self, started_at=None):
+        """
+        Args:
+            started_at (float): 計測開始時刻（time.perf_counter の値）
+        """
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.last = self.started_at
+        self.phases = []
+
+    def mark(self, name):
+        """前回の区切りからここまでを name の区間として記録"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def measure(self, name, loader):
+        """
+        loaderを実行して所要時間を name の内訳として記録（遅延初期化用）
+
+        区切りは進めないため、この時間は次に mark する区間にも含まれる
+
+        Returns:
+            loaderの戻り値
+        """
+        start_time = time.perf_counter()
+        result = loader()
+        self.phases.append((name, time.perf_counter() - start_time))
+        return result
+
+    def save(self, command):
+        """環境変数で指定されたファイルに計測結果を追記"""
+        path = os.environ.get(LOG_ENV)
+        if not path:
+            return
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                "command": command,
+                "total": time.perf_counter() - self.started_at,
+                "phases": dict(self.phases),
+            }, ensure_ascii=False) + "\n")
+
+
+def run_startup_benchmark(script_path, commands, repeat=3):
+    """
+    各コマンドを別プロセスで実行し、起動時間の内訳を表示
+
+    Args:
+        script_path (str): ai_photoframe.py のパス
+        commands (list): 計測するコマンド（引数のリスト）のリスト
+        repeat (int): 各コマンドの実行回数（中央値を表示）
+
+    Returns:
+        dict: コマンド -> 計測結果の中央値
+    """
+    results = {}
+    for args in commands:
+        label = " ".join(args) or "(usage)"
+        runs = []
+        for _ in range(repeat):
+            with tempfile.NamedTemporaryFile('r', suffix=".jsonl", encoding='utf-8') as log:
+                env = dict(os.environ, **{LOG_ENV: log.name})
+                start_time = time.perf_counter()
+                subprocess.run([sys.executable, script_path] + args, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                wall = time.perf_counter() - start_time
+                lines = log.read().splitlines()
+            record = json.loads(lines[-1]) if lines else {"phases": {}}
+            record["wall"] = wall
+            runs.append(record)
+
+        runs.sort(key=lambda record: record["wall"])
+        results[label] = runs[len(runs) // 2]
+
+    print("=== 起動時間（中央値） ===")
+    for label, record in results.items():
+        phases = " | ".join(f"{name}: {duration * 1000:.0f}ms" for name, duration in record["phases"].items())
+        print(f"{label:<24} 合計 {record['wall'] * 1000:6.0f}ms  ({phases})")
+    return results
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - ステージ計測
+モデル読み込みからパネルのリフレッシュまで、ステージごとの実時間・CPU時間・ピークRSSを記録し、
+JSON Lines と Prometheus テキスト形式で書き出す
+"""
+
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus のメトリクス名の接頭辞
+METRIC_PREFIX = "aiphotoframe_stage"
+
+
+def reset_peak_rss():
+    """
+    プロセスのピークRSS（VmHWM）をリセット
+
+    Returns:
+        bool: リセットできた場合True（Linux以外やカーネルが未対応の場合はFalse）
+    """
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def current_rss_mb():
+    """
+    プロセスの現在のRSS（MB）
+
+    Returns:
+        float|None: /proc が読めない場合はNone
+    """
+    try:
+        with open("/proc/self/status", 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    """
+    プロセスのピークRSS（MB）
+
+    reset_peak_rss() 以降のピークを返す。/proc が読めない場合は起動以降のピーク
+    """
+    try:
+        with open("/proc/self/status", 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Linuxのru_maxrssはKB単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Span:
+    """1ステージの計測区間"""
+
+    def __init__(self, tracer, stage, labels):
+        self.tracer = tracer
+        self.stage = stage
+        self.labels = labels
+        self.peak_rss_mb = 0.0
+        self.peak_is_stage_local = False
+        self.record = None
+        self.started_wall = time.perf_counter()
+        # torchは複数スレッドで計算するため、スレッド単位ではなくプロセスのCPU時間を使う
+        self.started_cpu = time.process_time()
+
+    def end(self, **labels):
+        """
+        区間を閉じて記録
+
+        Returns:
+            dict: 記録した内容
+        """
+        return self.tracer._finish(self, labels)
+
+
+class StepSpans:
+    """ステップコールバックの間隔を1ステップずつ記録し、最後に合計を記録"""
+
+    def __init__(self, tracer, stage, total_stage, **labels):
+        """
+        Args:
+            tracer (Tracer): 記録先
+            stage (str): 各ステップのステージ名
+            total_stage (str): 全ステップの合計を記録するステージ名
+        """
+        self.tracer = tracer
+        self.stage = stage
+        self.total_stage = total_stage
+        self.labels = labels
+        self.records = []
+        self.current = tracer.start(stage, **labels)
+
+    def lap(self, **labels):
+        """現在のステップを閉じて次のステップの計測を開始"""
+        self.records.append(self.current.end(**labels))
+        self.current = self.tracer.start(self.stage, **self.labels)
+
+    def finish(self):
+        """
+        最後の（未完了の）ステップを破棄し、完了したステップの合計を記録
+
+        Returns:
+            dict|None: 合計の記録（完了したステップがない場合はNone）
+        """
+        self.tracer.discard(self.current)
+        if not self.records:
+            return None
+        return self.tracer.add(
+            self.total_stage,
+            wall=sum(record["wall"] for record in self.records),
+            cpu=sum(record["cpu"] for record in self.records),
+            peak_rss_mb=max(record["peak_rss_mb"] for record in self.records),
+            steps=len(self.records),
+            **self.labels,
+        )
+
+
+class Tracer:
+    """
+    ステージの計測結果を集計し、JSON Lines・Prometheus テキスト形式で書き出す
+
+    ピークRSSはプロセス全体の値。区間の開始時に VmHWM をリセットし、リセット前の値を
+    開いているすべての区間（他スレッドを含む）に反映するため、入れ子や並行する区間でも
+    各区間の最大値は失われない。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open_spans = []
+        self.sequence = 0
+        self.recent = []
+        self.totals = {}
+        self.jsonl_path = None
+        self.jsonl_max_bytes = None
+        self.prometheus_path = None
+        self.prometheus_interval = 5
+        self.last_prometheus_write = 0
+        self.server = None
+
+    def configure(self, jsonl_path=None, jsonl_max_mb=10, prometheus_path=None, prometheus_port=None):
+        """
+        書き出し先を設定
+
+        Args:
+            jsonl_path (str): 区間ごとの記録を追記するファイル（Noneの場合は書き出さない）
+            jsonl_max_mb (float): これを超えたら .1 に退避して新しいファイルに書く
+            prometheus_path (str): Prometheus テキスト形式の書き出し先（node_exporter の textfile 用）
+            prometheus_port (int): 指定するとローカルホストの /metrics で公開
+        """
+        self.jsonl_path = jsonl_path
+        self.jsonl_max_bytes = jsonl_max_mb * 1024 * 1024 if jsonl_max_mb else None
+        self.prometheus_path = prometheus_path
+        if prometheus_port and self.server is None:
+            self._serve(prometheus_port)
+
+    def _fold_peak(self):
+        """現在の VmHWM を開いているすべての区間に反映"""
+        current = peak_rss_mb()
+        for span in self.open_spans:
+            span.peak_rss_mb = max(span.peak_rss_mb, current)
+
+    def start(self, stage, **labels):
+        """
+        区間の計測を開始（with を使えない場合用。end() で閉じる）
+
+        Returns:
+            Span: 計測中の区間
+        """
+        with self.lock:
+            self._fold_peak()
+            span = Span(self, stage, labels)
+            span.peak_is_stage_local = reset_peak_rss()
+            self.open_spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """
+        with ブロックを1ステージとして計測（例外で抜けた場合は記録しない）
+
+        Yields:
+            Span: 計測中の区間（終了後は record に記録内容）
+        """
+        span = self.start(stage, **labels)
+        try:
+            yield span
+        except BaseException:
+            self.discard(span)
+            raise
+        span.end()
+
+    def discard(self, span):
+        """区間を記録せずに閉じる（中断・例外時用）"""
+        with self.lock:
+            if span in self.open_spans:
+                self._fold_peak()
+                self.open_spans.remove(span)
+
+    def _finish(self, span, labels):
+        wall = time.perf_counter() - span.started_wall
+        cpu = time.process_time() - span.started_cpu
+        with self.lock:
+            self._fold_peak()
+            if span in self.open_spans:
+                self.open_spans.remove(span)
+        span.record = self.add(
+            span.stage, wall=wall, cpu=cpu, peak_rss_mb=span.peak_rss_mb,
+            peak_is_stage_local=span.peak_is_stage_local, **dict(span.labels, **labels)
+        )
+        return span.record
+
+    def add(self, stage, wall, cpu, peak_rss_mb, **labels):
+        """
+        計測済みの値を1区間として記録
+
+        Returns:
+            dict: 記録した内容
+        """
+        record = dict(labels, stage=stage, wall=wall, cpu=cpu, peak_rss_mb=peak_rss_mb, ts=time.time())
+        with self.lock:
+            self.sequence += 1
+            totals = self.totals.setdefault(stage, {"count": 0, "wall": 0.0, "cpu": 0.0})
+            totals["count"] += 1
+            totals["wall"] += wall
+            totals["cpu"] += cpu
+            totals["last_wall"] = wall
+            totals["last_peak_rss_mb"] = peak_rss_mb
+
+            # report() 用に直近の記録をスレッドごとに区別できるよう保持
+            self.recent.append((self.sequence, threading.get_ident(), record))
+            del self.recent[:-500]
+
+            if self.jsonl_path:
+                self._append_jsonl(record)
+        self.write_prometheus(force=False)
+        return record
+
+    def _append_jsonl(self, record):
+        try:
+            if (self.jsonl_max_bytes and os.path.exists(self.jsonl_path)
+                    and os.path.getsize(self.jsonl_path) > self.jsonl_max_bytes):
+                os.replace(self.jsonl_path, self.jsonl_path + ".1")
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ 計測結果の書き込みエラー: {e}")
+
+    def mark(self):
+        """
+        現在の記録位置（report に渡すと、これ以降に記録したものだけを表示）
+
+        Returns:
+            int: 記録の通し番号
+        """
+        with self.lock:
+            return self.sequence
+
+    def records(self, since=0, current_thread=False):
+        """
+        since 以降の記録（直近500件まで）
+
+        Args:
+            since (int): mark() の戻り値
+            current_thread (bool): 呼び出し元のスレッドで記録したものだけを返すか
+
+        Returns:
+            list: 記録（dict）のリスト
+        """
+        thread_id = threading.get_ident()
+        with self.lock:
+            return [record for sequence, ident, record in self.recent
+                    if sequence > since and (not current_thread or ident == thread_id)]
+
+    def report(self, since=0, skip=("unet_step",)):
+        """
+        since 以降にこのスレッドで記録したステージを1行で表示
+
+        Args:
+            since (int): mark() の戻り値
+            skip (tuple): 表示しないステージ（合計を別に記録するステップ単位の区間など）
+        """
+        records = [record for record in self.records(since, current_thread=True) if record["stage"] not in skip]
+        if records:
+            print("⏱️  " + " | ".join(
+                f"{record['stage']}: {record['wall']:.2f}秒 (CPU {record['cpu']:.1f}秒, {record['peak_rss_mb']:.0f}MB)"
+                for record in records
+            ))
+        self.write_prometheus(force=True)
+
+    def prometheus_text(self):
+        """集計結果を Prometheus テキスト形式で返す"""
+        metrics = [
+            ("runs_total", "counter", "ステージの実行回数", lambda t: t["count"]),
+            ("wall_seconds_total", "counter", "ステージの実時間の合計", lambda t: t["wall"]),
+            ("cpu_seconds_total", "counter", "ステージ中のプロセスCPU時間の合計", lambda t: t["cpu"]),
+            ("last_wall_seconds", "gauge", "直近のステージの実時間", lambda t: t["last_wall"]),
+            ("last_peak_rss_bytes", "gauge", "直近のステージ中のプロセスのピークRSS",
+             lambda t: t["last_peak_rss_mb"] * 1024 * 1024),
+        ]
+        with self.lock:
+            totals = {stage: dict(values) for stage, values in self.totals.items()}
+
+        lines = []
+        for suffix, metric_type, description, value in metrics:
+            name = f"{METRIC_PREFIX}_{suffix}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for stage in sorted(totals):
+                lines.append(f'{name}{{stage="{stage}"}} {value(totals[stage]):.6g}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, force=True):
+        """Prometheus テキスト形式のファイルを書き出し（force=False の場合は一定間隔ごと）"""
+        if not self.prometheus_path:
+            return
+        now = time.time()
+        if not force and now - self.last_prometheus_write < self.prometheus_interval:
+            return
+        self.last_prometheus_write = now
+
+        # 収集側が書き込み途中のファイルを読まないよう一時ファイル経由で置き換え
+        tmp_path = self.prometheus_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.prometheus_path)
+        except OSError as e:
+            print(f"⚠️ メトリクスの書き込みエラー: {e}")
+
+    def _serve(self, port):
+        """ローカルホストの /metrics で Prometheus テキスト形式を公開"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        except OSError as e:
+            print(f"⚠️ メトリクスを公開できません（ポート {port}）: {e}")
+            return
+        threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"📈 メトリクス公開: http://127.0.0.1:{port}/metrics")
+
+
+# プロセス内で共有する計測器
+TRACER = Tracer()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 温度・負荷に応じた連続実行のペース配分
+CPU温度・スロットリング状態・負荷を読み、スレッド数・サイクル間隔・生成プロファイルを切り替えて
+連続して生成し続けたときの枚/時を最大にする（短時間の最高速度ではなく）
+"""
+
+import os
+
+# get_throttled のうち「現在」起きている状態のビット（過去に起きたことを示す上位ビットは見ない）
+#   0x2: ARMの周波数上限 / 0x4: スロットリング中 / 0x8: ソフト温度上限
+THROTTLED_NOW_MASK = 0x2 | 0x4 | 0x8
+
+# 枚/時の移動平均の重み（直近のサイクルの割合）
+RATE_SMOOTHING = 0.3
+
+
+class SystemSensors:
+    """sysfs / proc から温度・スロットリング状態・負荷を読む（パスを差し替えれば任意のファイルを読める）"""
+
+    def __init__(self, temperature_path="/sys/class/thermal/thermal_zone0/temp",
+                 throttled_path="/sys/devices/platform/soc/soc:firmware/get_throttled",
+                 loadavg_path="/proc/loadavg"):
+        """
+        Args:
+            temperature_path (str): CPU温度（ミリ℃の整数）
+            throttled_path (str): Raspberry Pi ファームウェアの get_throttled（16進のビット列）
+            loadavg_path (str): ロードアベレージ（先頭の1分平均を使う）
+        """
+        self.temperature_path = temperature_path
+        self.throttled_path = throttled_path
+        self.loadavg_path = loadavg_path
+
+    @staticmethod
+    def _read(path):
+        if not path:
+            return None
+        try:
+            with open(path, 'r') as f:
+                return f.read().split()[0]
+        except (OSError, IndexError):
+            return None
+
+    def read(self):
+        """
+        現在の状態
+
+        Returns:
+            dict: temperature（℃）/ throttled（bool）/ load（1分平均）。読めない項目はNone
+        """
+        readings = {"temperature": None, "throttled": None, "load": None}
+        try:
+            value = self._read(self.temperature_path)
+            if value is not None:
+                readings["temperature"] = int(value) / 1000
+            value = self._read(self.throttled_path)
+            if value is not None:
+                readings["throttled"] = bool(int(value, 16) & THROTTLED_NOW_MASK)
+            value = self._read(self.loadavg_path)
+            if value is not None:
+                readings["load"] = float(value)
+        except ValueError as e:
+            print(f"⚠️ センサー値を読み取れません: {e}")
+        return readings
+
+
+class ThermalPacer:
+    """サイクルごとの温度・負荷・ステップ速度から、次のサイクルのスレッド数・間隔・プロファイルを決める"""
+
+    def __init__(self, sensors, hot_celsius=75, cool_celsius=65, gap_step_seconds=30, max_gap_seconds=300,
+                 min_threads=None, max_threads=None, profile_ladder=("quality", "balanced", "fast")):
+        """
+        Args:
+            sensors (SystemSensors): 温度・スロットリング・負荷の読み取り元
+            hot_celsius (float): これ以上（またはスロットリング中）なら発熱を抑える
+            cool_celsius (float): これ以下なら抑えた設定を1段階戻す
+            gap_step_seconds (float): 1回に増減するサイクル間の待機時間
+            max_gap_seconds (float): サイクル間の待機時間の上限
+            min_threads (int): 発熱を抑える場合のスレッド数の下限（Noneの場合は最大の半分）
+            max_threads (int): スレッド数の上限（Noneの場合は論理CPU数）
+            profile_ladder (list): 高品質から順のプロファイル名（間隔を上限まで広げても熱い場合に1段階ずつ下げる）
+        """
+        self.sensors = sensors
+        self.hot_celsius = hot_celsius
+        self.cool_celsius = cool_celsius
+        self.gap_step_seconds = gap_step_seconds
+        self.max_gap_seconds = max_gap_seconds
+        self.max_threads = max_threads or os.cpu_count() or 1
+        self.min_threads = max(1, min(min_threads or self.max_threads // 2, self.max_threads))
+        self.profile_ladder = list(profile_ladder)
+
+        # 発熱を抑えるための設定（負荷によるスレッド数の制限とは別に持つ）
+        self.thermal_threads = self.max_threads
+        self.gap = 0
+        self.profile_level = 0
+        # 他プロセスの負荷を考慮した実際のスレッド数
+        self.threads = self.max_threads
+        self.images_per_hour = None
+
+    def profile_for(self, profile):
+        """
+        発熱を抑える段階に応じて軽いプロファイルに置き換える
+
+        Args:
+            profile (str): スケジュールで選ばれたプロファイル名
+
+        Returns:
+            str: 次のサイクルで使うプロファイル名
+        """
+        if self.profile_level == 0 or not self.profile_ladder:
+            return profile
+        # ラダーにないプロファイルは最も高品質な段から数える
+        start = self.profile_ladder.index(profile) if profile in self.profile_ladder else 0
+        return self.profile_ladder[min(start + self.profile_level, len(self.profile_ladder) - 1)]
+
+    def after_cycle(self, records, images, cycle_seconds):
+        """
+        1サイクルの結果とセンサーの値から次のサイクルの設定を決めて記録
+
+        Args:
+            records (list): このサイクルの TRACER.records()（unet_denoise からステップ速度を求める）
+            images (int): このサイクルで生成した枚数
+            cycle_seconds (float): このサイクルの生成にかかった時間
+
+        Returns:
+            dict: threads（スレッド数）/ gap（次のサイクルまでの待機秒数）
+        """
+        readings = self.sensors.read()
+        temperature, throttled, load = readings["temperature"], readings["throttled"], readings["load"]
+
+        denoise = [record for record in records if record["stage"] == "unet_denoise"]
+        steps = sum(record.get("steps", 0) for record in denoise)
+        denoise_wall = sum(record["wall"] for record in denoise)
+        seconds_per_step = denoise_wall / steps if steps else None
+
+        # 待機時間も含めた枚/時（連続して生成し続けたときの値）を移動平均で追う（再利用のみのサイクルは除く）
+        if images and steps and cycle_seconds > 0:
+            rate = 3600 * images / (cycle_seconds + self.gap)
+            self.images_per_hour = rate if self.images_per_hour is None else (
+                RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.images_per_hour)
+
+        hot = bool(throttled) or (temperature is not None and temperature >= self.hot_celsius)
+        cool = not throttled and (temperature is None or temperature <= self.cool_celsius)
+        changes = []
+        if hot:
+            changes.append(self._cool_down())
+        elif cool:
+            changes.append(self._speed_up())
+
+        # ロードアベレージには自分のスレッドも含まれるため、それを引いた分を他プロセスの負荷とみなす
+        threads = self.thermal_threads
+        if load is not None:
+            external = max(0.0, load - self.threads)
+            threads = max(1, min(threads, self.max_threads - round(external)))
+        if threads != self.threads:
+            changes.append(f"スレッド数 {self.threads} → {threads}"
+                           + ("（他プロセスの負荷）" if threads < self.thermal_threads else ""))
+            self.threads = threads
+
+        self._report(temperature, throttled, load, seconds_per_step, [change for change in changes if change])
+        return {"threads": self.threads, "gap": self.gap}
+
+    def _cool_down(self):
+        """
+        発熱を1段階抑える
+
+        スレッド数を減らしてもメモリ帯域が律速のため速度の低下は小さく、次に待機時間を入れ、
+        それでも熱い場合にだけ軽いプロファイルに切り替える
+        """
+        if self.thermal_threads > self.min_threads:
+            self.thermal_threads -= 1
+            return f"発熱抑制: スレッド上限 {self.thermal_threads}"
+        if self.gap < self.max_gap_seconds:
+            self.gap = min(self.max_gap_seconds, self.gap + self.gap_step_seconds)
+            return f"発熱抑制: サイクル間隔 {self.gap:.0f}秒"
+        if self.profile_level < len(self.profile_ladder) - 1:
+            self.profile_level += 1
+            return f"発熱抑制: プロファイルを{self.profile_level}段階軽く"
+        return None
+
+    def _speed_up(self):
+        """冷えている場合に1段階戻す（枚/時への影響が大きい待機時間から）"""
+        if self.gap > 0:
+            self.gap = max(0, self.gap - self.gap_step_seconds)
+            return f"冷却済み: サイクル間隔 {self.gap:.0f}秒"
+        if self.thermal_threads < self.max_threads:
+            self.thermal_threads += 1
+            return f"冷却済み: スレッド上限 {self.thermal_threads}"
+        if self.profile_level > 0:
+            self.profile_level -= 1
+            return "冷却済み: プロファイルを1段階戻す" if self.profile_level else "冷却済み: プロファイルを元に戻す"
+        return None
+
+    def _report(self, temperature, throttled, load, seconds_per_step, changes):
+        parts = [
+            f"{temperature:.1f}℃" if temperature is not None else "温度不明",
+            "スロットリング中" if throttled else ("スロットリングなし" if throttled is not None else "スロットリング不明"),
+            f"負荷 {load:.2f}" if load is not None else "負荷不明",
+        ]
+        if seconds_per_step is not None:
+            parts.append(f"{seconds_per_step:.2f}秒/ステップ")
+        if self.images_per_hour is not None:
+            parts.append(f"{self.images_per_hour:.1f}枚/時")
+        line = "🌡️ " + " | ".join(parts) + f" → スレッド {self.threads}, 間隔 {self.gap:.0f}秒"
+        if changes:
+            line += f"（{', '.join(changes)}）"
+        print(line)
+
+
+def create_pacer(config):
+    """
+    config.json の continuous_mode.pacing から作成
+
+    Returns:
+        ThermalPacer|None: 無効の場合はNone
+    """
+    if not config.get('enabled', True):
+        return None
+    sensors = SystemSensors(
+        temperature_path=config.get('temperature_path', "/sys/class/thermal/thermal_zone0/temp"),
+        throttled_path=config.get('throttled_path', "/sys/devices/platform/soc/soc:firmware/get_throttled"),
+        loadavg_path=config.get('loadavg_path', "/proc/loadavg"),
+    )
+    return ThermalPacer(
+        sensors,
+        hot_celsius=config.get('hot_celsius', 75),
+        cool_celsius=config.get('cool_celsius', 65),
+        gap_step_seconds=config.get('gap_step_seconds', 30),
+        max_gap_seconds=config.get('max_gap_seconds', 300),
+        min_threads=config.get('min_threads'),
+        max_threads=config.get('max_threads'),
+        profile_ladder=config.get('profile_ladder', ("quality", "balanced", "fast")),
+    )
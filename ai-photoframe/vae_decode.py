@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 潜在表現のデコード
+通常のVAE / タイル分割デコード / 小型蒸留デコーダー（TAESD）を切り替え、時間とピークメモリを計測する
+"""
+
+import os
+
+import torch
+
+from telemetry import TRACER
+
+DECODE_MODES = ("full", "tiled", "tiny")
+
+
+def tiny_decoder_available(tiny_path):
+    """小型デコーダーの重みがローカルにあるか（パイプラインの読み込み前にも確認できる）"""
+    return bool(tiny_path) and os.path.exists(os.path.expanduser(tiny_path))
+
+
+def resolve_decode_mode(mode, tiny_path):
+    """
+    実際に使われるデコード方法
+
+    Args:
+        mode (str): 指定されたデコード方法
+        tiny_path (str): 小型デコーダーの重みのパス
+
+    Returns:
+        str: 不明な方法・小型デコーダーの重みがない場合は full
+    """
+    if mode not in DECODE_MODES:
+        return "full"
+    if mode == "tiny" and not tiny_decoder_available(tiny_path):
+        return "full"
+    return mode
+
+
+class LatentDecoder:
+    """パイプラインのVAEまたは小型デコーダーで潜在表現を画像に変換"""
+
+    def __init__(self, pipe, options):
+        """
+        Args:
+            pipe (StableDiffusionPipeline): VAEと画像後処理を提供するパイプライン
+            options (dict): config.json の generator.decoder セクション
+        """
+        self.pipe = pipe
+        self.tiny_path = options.get('tiny_path')
+        self.tile_size = options.get('tile_size', 256)
+        self.tiny_vae = None
+        self.last_stats = None
+
+    def tiny_available(self):
+        """小型デコーダーの重みがローカルにあるか"""
+        return tiny_decoder_available(self.tiny_path)
+
+    def _load_tiny(self):
+        """小型デコーダーをローカルパスから読み込み（初回のみ）"""
+        if self.tiny_vae is not None:
+            return self.tiny_vae
+
+        from diffusers import AutoencoderTiny
+
+        print(f"小型デコーダーを読み込み中: {self.tiny_path}")
+        self.tiny_vae = AutoencoderTiny.from_pretrained(
+            os.path.expanduser(self.tiny_path),
+            torch_dtype=torch.float32,
+            local_files_only=True,
+        ).to("cpu")
+        return self.tiny_vae
+
+    def _set_tiling(self, enabled):
+        vae = self.pipe.vae
+        if enabled:
+            # タイルを小さくするほどピークメモリは下がるが、継ぎ目のブレンド処理が増える
+            vae.tile_sample_min_size = self.tile_size
+            vae.tile_latent_min_size = self.tile_size // 8
+            vae.enable_tiling()
+            vae.enable_slicing()
+        else:
+            vae.disable_tiling()
+            vae.disable_slicing()
+
+    def decode(self, latents, mode="full"):
+        """
+        潜在表現をPIL画像に変換
+
+        Args:
+            latents (torch.Tensor): パイプラインが出力した潜在表現
+            mode (str): full / tiled / tiny
+
+        Returns:
+            PIL.Image.Image: デコードした画像
+        """
+        if mode not in DECODE_MODES:
+            print(f"⚠️ 不明なデコードモード: {mode}（full を使用します）")
+            mode = "full"
+        if mode == "tiny" and not self.tiny_available():
+            print(f"⚠️ 小型デコーダーが見つかりません: {self.tiny_path}（full を使用します）")
+            mode = "full"
+
+        with TRACER.span("vae_decode", mode=mode) as span, torch.no_grad():
+            if mode == "tiny":
+                vae = self._load_tiny()
+            else:
+                vae = self.pipe.vae
+                self._set_tiling(mode == "tiled")
+
+            latents = latents.to(vae.dtype)
+            image = vae.decode(latents / vae.config.scaling_factor, return_dict=False)[0]
+            image = self.pipe.image_processor.postprocess(image.float(), output_type="pil")[0]
+
+        self.last_stats = {
+            "mode": mode,
+            "decode_time": span.record["wall"],
+            "decode_peak_rss_mb": span.record["peak_rss_mb"],
+            # リセットできない環境では起動以降のピークになる
+            "peak_rss_is_stage_local": span.record["peak_is_stage_local"],
+        }
+        return image
+
+    def report(self):
+        """直近のデコード時間とピークRSSを表示"""
+        stats = self.last_stats
+        if stats is None:
+            return
+        scope = "デコード中" if stats["peak_rss_is_stage_local"] else "起動以降"
+        print(f"🖼️  デコード({stats['mode']}): {stats['decode_time']:.1f}秒 | "
+              f"ピークRSS({scope}): {stats['decode_peak_rss_mb']:.0f}MB")
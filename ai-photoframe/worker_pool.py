@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+AI Photo Frame - 生成ワーカープール
+多コアの生成サーバー向けに、CPUコアを分割した複数のワーカープロセスで共有ジョブキューから生成する。
+重みは1つのファイルにまとめてメモリマップし、ワーカー間でページキャッシュを共有する
+"""
+
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import time
+
+SHARED_WEIGHTS_FILE = "weights.bin"
+SHARED_INDEX_FILE = "index.json"
+
+# メモリマップする重みの先頭位置の境界（SIMD命令のアライメント）
+ALIGNMENT = 64
+
+# 共有する重みを持つパイプラインのコンポーネント
+SHARED_COMPONENTS = ("unet", "vae", "text_encoder")
+
+
+def _cpu_topology(cpu):
+    """(ソケット, 物理コア) の番号（sysfsが読めない場合は論理CPU番号）"""
+    base = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+    try:
+        with open(os.path.join(base, "physical_package_id"), 'r') as f:
+            package = int(f.read())
+        with open(os.path.join(base, "core_id"), 'r') as f:
+            core = int(f.read())
+        return package, core
+    except (OSError, ValueError):
+        return 0, cpu
+
+
+def partition_cores(workers, threads_per_worker=None):
+    """
+    使用可能な論理CPUをワーカーごとの組に分割
+
+    同じ物理コアのSMTスレッドと同じソケットのコアが同じワーカーに入るよう、
+    (ソケット, 物理コア) 順に並べて先頭から割り当てる
+
+    Args:
+        workers (int): ワーカー数
+        threads_per_worker (int): 1ワーカーのスレッド数（Noneの場合は均等に分割）
+
+    Returns:
+        list: ワーカーごとの論理CPU番号のリスト
+    """
+    cpus = sorted(os.sched_getaffinity(0), key=lambda cpu: (_cpu_topology(cpu), cpu))
+    per_worker = threads_per_worker or max(1, len(cpus) // workers)
+    if workers * per_worker > len(cpus):
+        per_worker = max(1, len(cpus) // workers)
+        print(f"⚠️ CPUが{len(cpus)}個のため1ワーカーのスレッド数を{per_worker}にします")
+    if workers > len(cpus):
+        print(f"⚠️ ワーカー数がCPU数（{len(cpus)}個）を超えるため、一部のワーカーはCPUを共有します")
+    return [cpus[i * per_worker:(i + 1) * per_worker] or [cpus[i % len(cpus)]] for i in range(workers)]
+
+
+def process_memory_mb():
+    """
+    プロセスのRSSとPSS（共有ページを共有プロセス数で割った値）
+
+    Returns:
+        dict: {"rss_mb", "pss_mb"}（読めない値はNone）
+    """
+    memory = {"rss_mb": None, "pss_mb": None}
+    try:
+        with open("/proc/self/smaps_rollup", 'r') as f:
+            for line in f:
+                if line.startswith("Rss:"):
+                    memory["rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("Pss:"):
+                    memory["pss_mb"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+class SharedWeights:
+    """
+    パイプラインの重みを1つのファイルに書き出し、各ワーカーのパラメータをそのメモリマップに置き換える
+
+    MAP_PRIVATE でマップするため、読み取りのみのページはすべてのワーカーで共有され、
+    書き込まれたページだけがそのワーカーの私有メモリになる
+    """
+
+    def __init__(self, directory, model_id, precision):
+        """
+        Args:
+            directory (str): 共有重みの保存先ディレクトリ
+            model_id (str): モデルID（またはローカルパス）
+            precision (str): 精度モード（変換後の重みを共有する）
+        """
+        model_key = hashlib.sha256(model_id.encode("utf-8")).hexdigest()[:16]
+        self.directory = os.path.join(os.path.expanduser(directory), model_key, precision)
+        self.model_id = model_id
+        self.precision = precision
+        self.mapped = None
+
+    def is_ready(self):
+        return os.path.exists(os.path.join(self.directory, SHARED_INDEX_FILE))
+
+    @staticmethod
+    def _components(pipe):
+        """共有するコンポーネント（torch.compile のラッパーは元のモジュールを使う）"""
+        for name in SHARED_COMPONENTS:
+            module = getattr(pipe, name, None)
+            if module is not None:
+                yield name, getattr(module, "_orig_mod", module)
+
+    def export(self, pipe):
+        """
+        読み込み済みパイプラインの浮動小数点の重みを書き出し（量子化済みの重みは各ワーカーが保持）
+
+        Args:
+            pipe (StableDiffusionPipeline): 書き出すパイプライン
+        """
+        import torch
+
+        # bfloat16はNumPyで扱えないため同じ幅の整数として書き出す
+        raw_dtypes = {1: torch.uint8, 2: torch.int16, 4: torch.int32, 8: torch.int64}
+        tmp_dir = self.directory + ".tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        index = {"model_id": self.model_id, "precision": self.precision, "tensors": {}}
+        offset = 0
+        with open(os.path.join(tmp_dir, SHARED_WEIGHTS_FILE), 'wb') as f:
+            for component, module in self._components(pipe):
+                for name, tensor in module.state_dict().items():
+                    # 動的量子化のLinearは state_dict に dtype・パック済みパラメータのタプルを含む
+                    if not torch.is_tensor(tensor) or not tensor.is_floating_point() or tensor.is_quantized:
+                        continue
+                    data = tensor.detach().contiguous().view(-1)
+                    raw = data.view(raw_dtypes[data.element_size()]).numpy()
+                    padding = -offset % ALIGNMENT
+                    f.write(b"\0" * padding)
+                    offset += padding
+                    index["tensors"][f"{component}.{name}"] = {
+                        "offset": offset, "dtype": str(tensor.dtype).replace("torch.", ""),
+                        "shape": list(tensor.shape),
+                    }
+                    f.write(raw.tobytes())
+                    offset += raw.nbytes
+        index["size"] = offset
+        with open(os.path.join(tmp_dir, SHARED_INDEX_FILE), 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.replace(tmp_dir, self.directory)
+        print(f"🧩 共有重みを書き出しました: {self.directory} ({offset / 1024 / 1024:.0f}MB)")
+
+    def attach(self, pipe):
+        """
+        パイプラインのパラメータ・バッファを共有重みのメモリマップ上のテンソルに置き換え
+
+        Returns:
+            int: 置き換えた重みのバイト数（形式が一致しない場合は0）
+        """
+        import torch
+
+        with open(os.path.join(self.directory, SHARED_INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get("model_id") != self.model_id or index.get("precision") != self.precision:
+            print("⚠️ 共有重みのモデル・精度が一致しないため使用しません")
+            return 0
+
+        with open(os.path.join(self.directory, SHARED_WEIGHTS_FILE), 'rb') as f:
+            # 書き込み可能なテンソルにするため copy-on-write でマップ（ファイルは変更されない）
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        attached = 0
+        with torch.no_grad():
+            for component, module in self._components(pipe):
+                for name, tensor in module.state_dict(keep_vars=True).items():
+                    entry = index["tensors"].get(f"{component}.{name}")
+                    if entry is None or entry["dtype"] != str(tensor.dtype).replace("torch.", ""):
+                        continue
+                    if list(tensor.shape) != entry["shape"]:
+                        continue
+                    dtype = tensor.dtype
+                    count = tensor.numel()
+                    shared = torch.frombuffer(self.mapped, dtype=dtype, count=count,
+                                              offset=entry["offset"]).view(entry["shape"])
+                    parent_name, _, attr = name.rpartition(".")
+                    parent = module.get_submodule(parent_name) if parent_name else module
+                    if attr in parent._parameters:
+                        parent._parameters[attr].data = shared
+                    elif attr in parent._buffers:
+                        parent._buffers[attr] = shared
+                    else:
+                        continue
+                    attached += count * tensor.element_size()
+        return attached
+
+
+def _worker_main(index, cores, threads, config, prompts, jobs, results):
+    """
+    ワーカープロセスの処理（コアを固定してパイプラインを読み込み、終了の通知までジョブを生成）
+
+    torchのスレッド数は読み込み時に決まるため、torchのimport前に環境変数とアフィニティを設定する
+    """
+    # 停止は親プロセスが終了の通知で行い、端末・systemdからのシグナルで生成途中に終了しない
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    os.sched_setaffinity(0, cores)
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(threads)
+
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    from image_generator import ImageGenerator
+    from inference_backends import TorchBackend
+
+    generator = ImageGenerator(config)
+    if not generator.load_model():
+        results.put({"event": "failed", "worker": index})
+        return
+
+    # 共有重みは最初のワーカーが書き出し、以降のワーカーは起動時にマップする
+    pool_config = config.get('worker_pool', {})
+    shared_bytes = 0
+    if pool_config.get('shared_weights', True) and isinstance(generator.backend, TorchBackend):
+        pipe = generator.backend.pipe
+        shared = SharedWeights(
+            pool_config.get('directory', '~/.cache/ai-photoframe/shared-weights'),
+            generator.model_id, generator.precision.mode,
+        )
+        if not shared.is_ready():
+            shared.export(pipe)
+        shared_bytes = shared.attach(pipe)
+
+    # 埋め込みキャッシュの書き込みが重ならないよう、ワーカーは1つずつ起動する
+    generator.prepare_prompts(prompts)
+    results.put(dict(process_memory_mb(), event="ready", worker=index, cores=list(cores), threads=threads,
+                     shared_mb=shared_bytes / 1024 / 1024))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        start_time = time.time()
+        success = generator.generate_image(
+            job["prompt"], job["output_path"], seed=job.get("seed"), profile=job.get("profile"),
+        )
+        results.put({
+            "event": "done" if success else "failed",
+            "worker": index,
+            "job_id": job["job_id"],
+            "output_path": job["output_path"],
+            "generation": generator.last_generation if success else None,
+            "duration": time.time() - start_time,
+        })
+
+
+class GenerationWorkerPool:
+    """コアを分割したワーカープロセスと、全ワーカーが取り出す共有ジョブキュー"""
+
+    def __init__(self, config, workers, threads_per_worker=None, prompts=()):
+        """
+        Args:
+            config (dict): config.json の内容（各ワーカーの ImageGenerator に渡す）
+            workers (int): ワーカー数
+            threads_per_worker (int): 1ワーカーのスレッド数（Noneの場合はコアを均等に分割）
+            prompts (list): 起動時に埋め込みをキャッシュするプロンプト
+        """
+        self.config = config
+        self.layout = partition_cores(workers, threads_per_worker)
+        self.prompts = list(prompts)
+        # torchを読み込み済みのプロセスをforkしないよう spawn で起動する
+        self.context = multiprocessing.get_context("spawn")
+        self.jobs = self.context.Queue()
+        self.results = self.context.Queue()
+        self.processes = []
+        self.ready = []
+        self.next_job_id = 0
+        # 結果を受け取っていないジョブのID -> 保存先（停止時に強制終了したワーカーの書き途中の画像を消す）
+        self.outstanding = {}
+
+    def start(self):
+        """
+        ワーカーを1つずつ起動し、全ワーカーの読み込み完了まで待つ
+
+        読み込み中のピークメモリが重ならず、共有重みも最初のワーカーが書き出したものを後続が使う
+
+        Returns:
+            bool: 全ワーカーが起動した場合True
+        """
+        for index, cores in enumerate(self.layout):
+            process = self.context.Process(
+                target=_worker_main,
+                args=(index, cores, len(cores), self.config, self.prompts, self.jobs, self.results),
+                name=f"generation-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+            event = self._wait_ready(process)
+            if event is None:
+                print(f"❌ ワーカー{index}の起動に失敗しました")
+                self.close()
+                return False
+            self.ready.append(event)
+            pss = f", PSS {event['pss_mb']:.0f}MB" if event['pss_mb'] is not None else ""
+            print(f"👷 ワーカー{index}: CPU {cores} / {len(cores)}スレッド | "
+                  f"共有重み {event['shared_mb']:.0f}MB{pss}")
+        return True
+
+    def _wait_ready(self, process):
+        while True:
+            try:
+                event = self.results.get(timeout=5)
+            except queue.Empty:
+                if not process.is_alive():
+                    return None
+                continue
+            if event["event"] == "ready":
+                return event
+            if event["event"] == "failed":
+                return None
+
+    def submit(self, prompt, output_path, seed=None, profile=None):
+        """
+        ジョブを共有キューに追加（空いたワーカーが取り出す）
+
+        Returns:
+            int: ジョブID
+        """
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        self.outstanding[job_id] = output_path
+        self.jobs.put({"job_id": job_id, "prompt": prompt, "output_path": output_path,
+                       "seed": seed, "profile": profile})
+        return job_id
+
+    def result(self, timeout=None):
+        """
+        完了したジョブを1件取り出す
+
+        Returns:
+            dict|None: {"event", "worker", "job_id", "output_path", "generation", "duration"}（タイムアウト時はNone）
+        """
+        try:
+            event = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.outstanding.pop(event.get("job_id"), None)
+        return event
+
+    def alive(self):
+        return any(process.is_alive() for process in self.processes)
+
+    def close(self, timeout=600):
+        """
+        未着手のジョブを取り消してワーカーに終了を通知し、生成中のジョブの完了を待つ
+
+        終了の通知はキューの末尾に入るため、先に未着手のジョブを取り除かないと
+        各ワーカーが残りのジョブをすべて生成してから終了する
+
+        Args:
+            timeout (float): 生成中のジョブを待つ上限秒数（超えたワーカーは強制終了して書き途中の画像を消す）
+
+        Returns:
+            list: 終了を待つ間に届いた結果（呼び出し側で登録する）
+        """
+        cancelled = 0
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                self.outstanding.pop(job["job_id"], None)
+                cancelled += 1
+        if cancelled:
+            print(f"🗑️ 未着手のジョブ{cancelled}件を取り消しました")
+
+        for _ in self.processes:
+            self.jobs.put(None)
+        late = []
+        deadline = time.time() + timeout
+        while self.alive() and time.time() < deadline:
+            event = self.result(timeout=1)
+            if event is not None:
+                late.append(event)
+        for process in self.processes:
+            if process.is_alive():
+                # ワーカーはSIGTERMを無視するためSIGKILLで止める
+                process.kill()
+            process.join()
+        # 終了したワーカーがキューに残した結果
+        while True:
+            event = self.result(timeout=0.1)
+            if event is None:
+                break
+            late.append(event)
+        self.processes = []
+
+        for output_path in self.outstanding.values():
+            self._remove_partial(output_path)
+        self.outstanding = {}
+        return late
+
+    @staticmethod
+    def _remove_partial(output_path):
+        """強制終了したワーカーの書き途中の画像と派生画像を削除"""
+        from output_writer import remove_derived
+
+        for path in (output_path, output_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+                print(f"🗑️ 書き途中の画像を削除しました: {path}")
+        remove_derived(output_path)
+
+
+def default_layouts(cpus=None):
+    """
+    比較するワーカー数・スレッド数の組（1ワーカー2スレッド以上でコアを使い切る分割）
+
+    Returns:
+        list: (ワーカー数, 1ワーカーのスレッド数) のリスト
+    """
+    cpus = cpus or len(os.sched_getaffinity(0))
+    layouts = []
+    workers = 1
+    while workers <= max(1, cpus // 2):
+        layouts.append((workers, cpus // workers))
+        workers *= 2
+    return layouts
+
+
+def run_pool_benchmark(config, prompts, output_dir, images=None, layouts=None, output_path="pool_bench.json"):
+    """
+    ワーカー数・スレッド数の組ごとに同じ枚数を生成し、1時間あたりの枚数を比較
+
+    Args:
+        config (dict): config.json の内容
+        prompts (list): 生成に使うプロンプト
+        output_dir (str): 計測用画像の保存先
+        images (int): 各組で生成する枚数（Noneの場合は最大ワーカー数の2倍）
+        layouts (list): (ワーカー数, スレッド数) のリスト（Noneの場合は default_layouts）
+        output_path (str): 結果JSONの保存先
+
+    Returns:
+        list: 組ごとの計測結果
+    """
+    layouts = [tuple(layout) for layout in (layouts or default_layouts())]
+    images = images or 2 * max(workers for workers, _ in layouts)
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"=== AI Photo Frame - ワーカープールのスループット比較（各{images}枚） ===")
+
+    report = []
+    for workers, threads in layouts:
+        print(f"\n--- {workers}ワーカー x {threads}スレッド ---")
+        pool = GenerationWorkerPool(config, workers, threads, prompts)
+        load_start = time.time()
+        if not pool.start():
+            report.append({"workers": workers, "threads": threads, "error": "start failed"})
+            continue
+        load_time = time.time() - load_start
+
+        # 読み込みを除き、最初のジョブ投入から全ジョブの完了までを計測
+        start_time = time.time()
+        for index in range(images):
+            pool.submit(prompts[index % len(prompts)], os.path.join(output_dir, f"pool_{workers}x{threads}_{index}.png"),
+                        seed=index)
+        completed, durations, finished = 0, [], 0
+        while finished < images:
+            event = pool.result(timeout=5)
+            if event is None:
+                if not pool.alive():
+                    print("❌ ワーカーが終了したため計測を打ち切ります")
+                    break
+                continue
+            finished += 1
+            if event["event"] == "done":
+                completed += 1
+                durations.append(event["duration"])
+        elapsed = time.time() - start_time
+        pool.close()
+
+        pss = [event["pss_mb"] for event in pool.ready if event["pss_mb"] is not None]
+        result = {
+            "workers": workers,
+            "threads": threads,
+            "completed": completed,
+            "images_per_hour": completed / elapsed * 3600 if elapsed > 0 else 0,
+            "seconds_per_image_per_worker": sum(durations) / len(durations) if durations else None,
+            "load_seconds": load_time,
+            "total_pss_mb": sum(pss) if pss else None,
+        }
+        report.append(result)
+        print(f"📈 {result['images_per_hour']:.1f}枚/時 | 1枚 {result['seconds_per_image_per_worker'] or 0:.1f}秒/ワーカー | "
+              f"読み込み {load_time:.0f}秒" + (f" | PSS合計 {result['total_pss_mb']:.0f}MB" if pss else ""))
+
+    print("\n=== 結果 ===")
+    print(f"{'ワーカー':>8} {'スレッド':>8} {'枚/時':>10} {'秒/枚':>10}")
+    for result in report:
+        if "error" in result:
+            print(f"{result['workers']:>8} {result['threads']:>8} {'失敗':>10}")
+            continue
+        print(f"{result['workers']:>8} {result['threads']:>8} {result['images_per_hour']:>10.1f} "
+              f"{result['seconds_per_image_per_worker'] or 0:>10.1f}")
+    best = max((result for result in report if "error" not in result),
+               key=lambda result: result["images_per_hour"], default=None)
+    if best is not None:
+        print(f"🏆 最速: {best['workers']}ワーカー x {best['threads']}スレッド "
+              f"（worker_pool.workers / worker_pool.threads_per_worker に設定）")
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({"timestamp": time.time(), "cpus": len(os.sched_getaffinity(0)), "results": report},
+                  f, ensure_ascii=False, indent=2)
+    print(f"📁 結果: {output_path}")
+    return report